@@ -0,0 +1,152 @@
+"""
+    Micro-benchmark for path expression handling in rdf_io.models
+
+    Compares the cost of parsing a path on every call with the cached compiled form, for parsing alone and for a full
+    evaluation against plain python objects - and evaluation with getattr_path as it was before paths were compiled
+    (kept below as _old_getattr_path), which parsed as it went. No database is needed.
+
+    python benchmarks/bench_paths.py [iterations]
+"""
+import itertools
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings
+if not settings.configured :
+    settings.configure(INSTALLED_APPS=['django.contrib.contenttypes', 'rdf_io'],
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}})
+import django
+django.setup()
+
+from rdf_io.models import CompiledPath, compile_path
+
+PATHS = (
+    'term',
+    'scheme__uri',
+    'label.label_text@language',
+    'notation[namespace.prefix="skos"].code^^"xsd:string"',
+    'semrelation(origin_concept)[rel_type="1"].target_concept.term@"en"',
+)
+
+class _Obj(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+# a plain object graph that the scalar paths above can be evaluated against
+OBJ = _Obj(term='frog', scheme=_Obj(uri='http://example.org/scheme'), label=_Obj(label_text='Frog', language='en'))
+EVAL_PATHS = PATHS[:3]
+
+
+# getattr_path and _getattr_related before paths were compiled - only the parts plain objects reach: the lookup of
+# related models by name (the AttributeError branch) needs the database and is left out
+def _old_getattr_path(obj,path) :
+    try :
+        return _old_getattr_related(obj,obj, path.replace('__','.').replace("/",".").split('.'))
+    except ValueError as e:
+        raise ValueError("Failed to map '{}' on '{}' (cause {})".format(path, obj, e))
+
+def _old_dequote(s):
+    if  s.startswith(("'", '"', '<')):
+        return s[1:-1]
+    return s
+
+def _old_apply_filter(val, filter,localobj, rootobj) :
+    for targetval in filter.replace(" OR ",",").split(",") :
+        tval = _old_dequote(targetval)
+        if tval.startswith('^') :
+            tval = getattr(rootobj,tval[1:])
+        elif tval.startswith('.') :
+            tval = getattr(localobj,tval[1:])
+        if tval == 'None' :
+            return bool(val)
+        elif tval == 'NotNone' :
+            return not bool(val)
+        elif val == tval :
+            return True
+    return False
+
+def _old_getattr_related(rootobj,obj, fields):
+    if not len(fields):
+        return [obj]
+    field = fields.pop(0)
+    filter = None
+    try:
+        try:
+            (field,langfield) = field.split('@')
+            if langfield[0] in ["'" , '"'] :
+                lang = langfield[1:-1]
+            else:
+                lang = _old_getattr_related(rootobj,obj, [langfield,] + fields).pop(0)
+                fields = []
+        except:
+            lang = None
+        try:
+            (field,typefield) = field.split('^^')
+            if typefield[0] in ["'" , '"'] :
+                typeuri = typefield[1:-1]
+            else:
+                try:
+                    typeuri = _old_getattr_related(rootobj,obj, [typefield,] + fields).pop(0)
+                except Exception as e :
+                    raise ValueError("error accessing data type field '{}' in field '{}' : {}".format(typefield, field, e) )
+                fields = []
+        except:
+            typeuri = None
+        if "[" in field :
+            filter = field[ field.index("[") +1 : -1 ]
+            field = field[0:field.index("[")]
+        val = getattr(obj, field)
+        if not val :
+            return []
+        try:
+            return itertools.chain(*(_old_getattr_related(rootobj,xx, fields[:]) for xx in val.all()))
+        except Exception as e:
+            pass
+        if filter and not _old_apply_filter(val, filter, obj, rootobj) :
+            return []
+        if lang:
+            val = "@".join((val,lang))
+        elif typeuri :
+            val = "^^".join((val,typeuri))
+    except AttributeError:
+        raise ValueError("Could not locate attribute '{}' in element '{}'".format(field, type(obj)))
+    return _old_getattr_related(obj,val, fields)
+
+def parse_uncached():
+    for p in PATHS :
+        CompiledPath(p)
+
+def parse_cached():
+    for p in PATHS :
+        compile_path(p)
+
+def eval_uncached():
+    for p in EVAL_PATHS :
+        CompiledPath(p).evaluate(OBJ)
+
+def eval_cached():
+    for p in EVAL_PATHS :
+        compile_path(p).evaluate(OBJ)
+
+def eval_old():
+    for p in EVAL_PATHS :
+        _old_getattr_path(OBJ, p)
+
+def main(number=20000):
+    # the old and new implementations must agree for the comparison to mean anything
+    for p in EVAL_PATHS :
+        assert list(_old_getattr_path(OBJ, p)) == list(compile_path(p).evaluate(OBJ)), p
+    results = []
+    for name, fn in (('parse per call', parse_uncached), ('parse cached', parse_cached),
+                     ('evaluate, old getattr_path', eval_old), ('evaluate, parse per call', eval_uncached),
+                     ('evaluate, cached', eval_cached)):
+        elapsed = min(timeit.repeat(fn, number=number, repeat=3))
+        results.append((name, elapsed))
+        print("%-26s %8.2f us/call" % (name, elapsed * 1e6 / number))
+    return results
+
+if __name__ == '__main__' :
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
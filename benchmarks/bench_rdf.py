@@ -0,0 +1,287 @@
+"""
+    Benchmarks for building, serialising, exporting and publishing RDF with rdf_io
+
+    Runs each operation over synthetic models (benchmarks/benchapp) with one mapping shape each:
+        flat      - fields of the object only
+        fk        - values reached through chains of foreign keys
+        reverse   - values from related objects pointing back at the object (model(property) paths)
+        embedded  - EmbeddedMappings producing blank node structures
+    at each of the requested scales (number of objects), against an in-memory sqlite database and an in-process
+    fake RDF4J/LDP server (benchmarks/fakestore.py) answering after a configurable latency.
+
+    Reports objects/sec, database queries per object, bytes per object (output or sent to the store), store requests
+    and peak memory - tracemalloc where available, otherwise the peak RSS of the process, which never goes down.
+
+    python benchmarks/bench_rdf.py [--scales 1,100,1000] [--scenarios flat,fk] [--operations build,sync_rdf4j]
+                                   [--latency 0.005] [--output baseline.json] [--compare baseline.json]
+
+    --output saves the results as a JSON baseline, --compare prints the change from a saved baseline.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from django.conf import settings
+if not settings.configured :
+    settings.configure(INSTALLED_APPS=['django.contrib.contenttypes', 'rdf_io', 'benchapp'],
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+        MIGRATION_MODULES={'rdf_io': None, 'benchapp': None}, USE_TZ=True)
+import django
+django.setup()
+
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.contrib.contenttypes.models import ContentType
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+    import resource
+
+from rdf_io.models import Namespace, ObjectType, ObjectMapping, AttributeMapping, EmbeddedMapping, ServiceBinding
+from rdf_io.plans import get_mapping_plan
+from rdf_io.sync import sync_model
+from rdf_io.utils import queryset_chunks
+from rdf_io.views.serialize import build_graph, _export_lines
+
+from benchapp.models import Item, Publisher, Author, Book, Term, TermLabel, Record, Contact
+from fakestore import FakeStore
+
+NAMESPACES = (
+    ('ex', 'http://example.org/'),
+    ('rdf', 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'),
+    ('rdfs', 'http://www.w3.org/2000/01/rdf-schema#'),
+    ('skos', 'http://www.w3.org/2004/02/skos/core#'),
+)
+
+# how many related objects each reverse / embedded object has
+CHILDREN = 3
+
+
+def _mapping(model, name, id_attr, attributes=(), embedded=()):
+    om = ObjectMapping.objects.create(content_type=ContentType.objects.get_for_model(model), name=name, auto_push=False,
+        id_attr=id_attr, target_uri_expr='"ex:%s/"' % name)
+    om.obj_type.add(ObjectType.objects.get_or_create(uri='ex:%s' % name.capitalize(), defaults={'label': name})[0])
+    for (attr, predicate, is_resource) in attributes :
+        AttributeMapping.objects.create(scope=om, attr=attr, predicate=predicate, is_resource=is_resource)
+    for (attr, predicate, struct) in embedded :
+        EmbeddedMapping.objects.create(scope=om, attr=attr, predicate=predicate, struct=struct, use_blank=True)
+    return om
+
+
+def _create_flat(start, count):
+    Item.objects.bulk_create([ Item(code='i%d' % i, title='Item %d' % i, description='A description of item %d' % i, quantity=i)
+        for i in range(start, start + count) ])
+
+def _create_fk(start, count):
+    publishers = list(Publisher.objects.all()[:10])
+    if not publishers :
+        Publisher.objects.bulk_create([ Publisher(name='Publisher %d' % i, country='Country %d' % (i % 3)) for i in range(10) ])
+        publishers = list(Publisher.objects.all())
+        Author.objects.bulk_create([ Author(name='Author %d' % i, publisher=publishers[i % 10]) for i in range(100) ])
+    authors = list(Author.objects.all()[:100])
+    Book.objects.bulk_create([ Book(isbn='b%d' % i, title='Book %d' % i, author=authors[i % 100], publisher=publishers[i % 10])
+        for i in range(start, start + count) ])
+
+def _create_reverse(start, count):
+    Term.objects.bulk_create([ Term(code='t%d' % i) for i in range(start, start + count) ])
+    terms = Term.objects.filter(code__in=[ 't%d' % i for i in range(start, start + count) ])
+    TermLabel.objects.bulk_create([ TermLabel(term=t, text='%s label %d' % (t.code, j), lang=('en', 'fr', 'de')[j % 3])
+        for t in terms for j in range(CHILDREN) ])
+
+def _create_embedded(start, count):
+    Record.objects.bulk_create([ Record(ident='r%d' % i, title='Record %d' % i) for i in range(start, start + count) ])
+    records = Record.objects.filter(ident__in=[ 'r%d' % i for i in range(start, start + count) ])
+    Contact.objects.bulk_create([ Contact(record=r, name='Contact %d' % j, email='c%d@example.org' % j, role=('author', 'editor')[j % 2])
+        for r in records for j in range(CHILDREN) ])
+
+
+# scenario : (model, id field, create(start, count), mapping setup)
+SCENARIOS = {
+    'flat' : (Item, 'code', _create_flat, lambda: _mapping(Item, 'item', 'code', (
+        ('title', 'rdfs:label', False), ('description', 'rdfs:comment', False), ('quantity', 'ex:quantity', False),
+        ('code', 'skos:notation', False), ('"ex:Collection"', 'ex:partOf', True)))),
+    'fk' : (Book, 'isbn', _create_fk, lambda: _mapping(Book, 'book', 'isbn', (
+        ('title', 'rdfs:label', False), ('author.name', 'ex:author', False), ('author.publisher.name', 'ex:authorPublisher', False),
+        ('publisher.name', 'ex:publisher', False), ('publisher.country', 'ex:country', False)))),
+    'reverse' : (Term, 'code', _create_reverse, lambda: _mapping(Term, 'term', 'code', (
+        ('termlabel(term)[lang="en"].text@lang', 'skos:prefLabel', False), ('termlabel(term).text@lang', 'skos:altLabel', False),
+        ('code', 'skos:notation', False)))),
+    'embedded' : (Record, 'ident', _create_embedded, lambda: _mapping(Record, 'record', 'ident', (
+        ('title', 'rdfs:label', False),), (
+        ('contact(record)', 'ex:contact', 'ex:name name ; ex:email email ; ex:role "{role}" ; ex:of <{$URI}>'),
+        ('contact(record)[role="author"]', 'ex:author', 'rdfs:label name ; ex:record "{^ident}"')))),
+}
+
+
+def op_build(ct, plan, store):
+    """ build_rdf into an rdflib Graph """
+    count = 0
+    for chunk in queryset_chunks(plan.prepare_queryset(ct.model_class().objects.all())) :
+        for obj in chunk :
+            build_graph(obj, plan)
+            count += 1
+    return (count, None)
+
+def op_turtle(ct, plan, store):
+    """ build and serialise as turtle - what to_rdf does """
+    (count, size) = (0, 0)
+    for chunk in queryset_chunks(plan.prepare_queryset(ct.model_class().objects.all())) :
+        for obj in chunk :
+            size += len(build_graph(obj, plan).serialize(format='turtle'))
+            count += 1
+    return (count, size)
+
+def op_export(ct, plan, store):
+    """ the N-Triples bulk export """
+    size = sum( len(lines) for lines in _export_lines([ (ct, plan) ], 'nt', None, 500) )
+    return (ct.model_class().objects.count(), size)
+
+def _sync(ct, store, api, url, resource):
+    binding = ServiceBinding.objects.create(title='bench', service_api=api, service_url=url, resource=resource, concurrency=4)
+    binding.object_mapping.add(*ObjectMapping.objects.filter(content_type=ct))
+    try:
+        summary = sync_model(ct)
+    finally:
+        binding.delete()
+    if summary.failed :
+        raise Exception("sync failed : %s" % summary.errors[:3])
+    return (summary.published, store.bytes_received)
+
+def op_sync_rdf4j(ct, plan, store):
+    """ sync_remote to an RDF4J repository, one named graph per object """
+    id_field = SCENARIOS[_scenario_for(ct)][1]
+    return _sync(ct, store, ServiceBinding.RDF4JREST, store.url + '/repositories/bench',
+        '/statements?context=<http://example.org/%s/{%s}>' % (ct.model, id_field))
+
+def op_sync_ldp(ct, plan, store):
+    """ sync_remote to an LDP container """
+    id_field = SCENARIOS[_scenario_for(ct)][1]
+    return _sync(ct, store, ServiceBinding.LDP, store.url + '/ldp', '/%s/{%s}' % (ct.model, id_field))
+
+OPERATIONS = (
+    ('build', op_build),
+    ('turtle', op_turtle),
+    ('export', op_export),
+    ('sync_rdf4j', op_sync_rdf4j),
+    ('sync_ldp', op_sync_ldp),
+)
+
+def _scenario_for(ct):
+    for (name, scenario) in SCENARIOS.items() :
+        if scenario[0] == ct.model_class() :
+            return name
+
+
+def _measure(fn, ct, plan, store):
+    store.reset()
+    if tracemalloc :
+        tracemalloc.start()
+    with CaptureQueriesContext(connection) as queries :
+        started = time.time()
+        (count, size) = fn(ct, plan, store)
+        elapsed = time.time() - started
+    if tracemalloc :
+        peak = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+    else:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    count = count or 1
+    return {
+        'objects' : count,
+        'elapsed' : round(elapsed, 4),
+        'objects_per_sec' : round(count / elapsed, 1) if elapsed else None,
+        'queries_per_object' : round(len(queries) / float(count), 2),
+        'bytes_per_object' : round(size / float(count), 1) if size is not None else None,
+        'requests_per_object' : round(store.requests / float(count), 3),
+        'peak_memory_kb' : peak,
+    }
+
+
+def run(scales, scenarios, operations, latency):
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    for (prefix, uri) in NAMESPACES :
+        Namespace.objects.create(prefix=prefix, uri=uri)
+    results = []
+    with FakeStore(latency=latency) as store :
+        for name in scenarios :
+            (model, id_field, create, setup) = SCENARIOS[name]
+            setup()
+            ct = ContentType.objects.get_for_model(model)
+            plan = get_mapping_plan(ct)
+            for scale in sorted(scales) :
+                existing = model.objects.count()
+                for start in range(existing, scale, 1000) :
+                    create(start, min(1000, scale - start))
+                # warm up - compile the plan and its paths so small scales dont just measure that
+                plan.related_lookups()
+                build_graph(model.objects.first(), plan)
+                for (opname, fn) in operations :
+                    result = dict(scenario=name, operation=opname, scale=scale)
+                    result.update(_measure(fn, ct, plan, store))
+                    results.append(result)
+                    print("%-9s %-11s %7d  %10s obj/s %7s q/obj %9s B/obj %6s req/obj %9s KB peak" % (name, opname, scale,
+                        result['objects_per_sec'], result['queries_per_object'], result['bytes_per_object'],
+                        result['requests_per_object'], result['peak_memory_kb']))
+    return results
+
+
+def _meta(latency):
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE).decode('ascii').strip()
+    except Exception :
+        commit = None
+    return {
+        'commit' : commit,
+        'date' : datetime.datetime.utcnow().isoformat(),
+        'python' : platform.python_version(),
+        'django' : django.get_version(),
+        'latency' : latency,
+        'memory' : 'tracemalloc peak KB' if tracemalloc else 'process peak RSS KB',
+    }
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f :
+        baseline = json.load(f)
+    previous = dict( ((r['scenario'], r['operation'], r['scale']), r) for r in baseline['results'] )
+    print("\nchange from %s (commit %s)" % (baseline_path, baseline['meta'].get('commit')))
+    for r in results :
+        old = previous.get((r['scenario'], r['operation'], r['scale']))
+        if not old or not old['objects_per_sec'] or not r['objects_per_sec'] :
+            continue
+        print("%-9s %-11s %7d  %+7.1f%% obj/s  queries/object %s -> %s" % (r['scenario'], r['operation'], r['scale'],
+            (r['objects_per_sec'] / old['objects_per_sec'] - 1) * 100, old['queries_per_object'], r['queries_per_object']))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='rdf_io benchmarks')
+    parser.add_argument('--scales', default='1,100,1000', help='comma separated numbers of objects (up to 100000 or more)')
+    parser.add_argument('--scenarios', default=','.join(sorted(SCENARIOS)), help='comma separated: %s' % ','.join(sorted(SCENARIOS)))
+    parser.add_argument('--operations', default=','.join(name for (name, fn) in OPERATIONS),
+        help='comma separated: %s' % ','.join(name for (name, fn) in OPERATIONS))
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds the fake store waits before each response')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    parser.add_argument('--compare', help='compare with results saved by --output')
+    args = parser.parse_args(argv)
+
+    operations = [ op for op in OPERATIONS if op[0] in args.operations.split(',') ]
+    results = run([ int(s) for s in args.scales.split(',') ], args.scenarios.split(','), operations, args.latency)
+    if args.output :
+        with open(args.output, 'w') as f :
+            json.dump({'meta' : _meta(args.latency), 'results' : results}, f, indent=2, sort_keys=True)
+    if args.compare :
+        compare(results, args.compare)
+    return results
+
+if __name__ == '__main__' :
+    main()
@@ -0,0 +1,50 @@
+"""
+    Synthetic models for the rdf_io benchmarks - one family per mapping shape measured by bench_rdf.py
+"""
+from django.db import models
+
+
+# flat - every mapped value is a field of the object itself
+class Item(models.Model):
+    code = models.CharField(max_length=20)
+    title = models.CharField(max_length=200)
+    description = models.TextField()
+    quantity = models.IntegerField(default=0)
+
+
+# FK heavy - values reached through chains of foreign keys
+class Publisher(models.Model):
+    name = models.CharField(max_length=200)
+    country = models.CharField(max_length=50)
+
+class Author(models.Model):
+    name = models.CharField(max_length=200)
+    publisher = models.ForeignKey(Publisher, on_delete=models.CASCADE)
+
+class Book(models.Model):
+    isbn = models.CharField(max_length=20)
+    title = models.CharField(max_length=200)
+    author = models.ForeignKey(Author, on_delete=models.CASCADE)
+    publisher = models.ForeignKey(Publisher, on_delete=models.CASCADE)
+
+
+# reverse relations - values held by objects that point back at the mapped object
+class Term(models.Model):
+    code = models.CharField(max_length=20)
+
+class TermLabel(models.Model):
+    term = models.ForeignKey(Term, on_delete=models.CASCADE)
+    text = models.CharField(max_length=200)
+    lang = models.CharField(max_length=5)
+
+
+# embedded - structured values wrapped in blank nodes
+class Record(models.Model):
+    ident = models.CharField(max_length=20)
+    title = models.CharField(max_length=200)
+
+class Contact(models.Model):
+    record = models.ForeignKey(Record, on_delete=models.CASCADE)
+    name = models.CharField(max_length=200)
+    email = models.CharField(max_length=200)
+    role = models.CharField(max_length=20)
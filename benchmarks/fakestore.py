@@ -0,0 +1,120 @@
+"""
+    An in-process stand in for an RDF4J or LDP server, for benchmarking publishing without a real store
+
+    Accepts anything: statements PUTs, RDF4J transactions (POST .../transactions answers with a Location),
+    LDP PUTs and HEADs (which get an ETag) and SPARQL updates. Each request waits latency seconds before answering.
+    Counts requests and bytes received - and with log set keeps the (method, path, body) of each, for tests.
+    Requests to a path containing one of the strings in fail are answered with a 500, standing in for an outage or a
+    rejected graph.
+"""
+import threading
+import time
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, status=204, headers=None):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        store = self.server.store
+        store.record(self.command, self.path, body)
+        if store.latency :
+            time.sleep(store.latency)
+        if any( f in self.path for f in store.fail ) :
+            (status, headers) = (500, None)
+        self.send_response(status)
+        for (k,v) in (headers or {}).items() :
+            self.send_header(k, v)
+        self.send_header('ETag', '"%d"' % store.requests)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        if self.path.rstrip('/').endswith('/transactions') :
+            self._reply(201, {'Location': 'http://%s:%d%s/tx%d' % (self.server.server_name, self.server.server_port,
+                self.path.rstrip('/'), self.server.store.requests)})
+        else:
+            self._reply()
+
+    def do_PUT(self):
+        self._reply()
+
+    def do_DELETE(self):
+        self._reply()
+
+    def do_HEAD(self):
+        self._reply(200)
+
+    def do_GET(self):
+        self._reply(200)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeStore(object):
+    """
+        with FakeStore(latency=0.02) as store:
+            ... publish to store.url ...
+        print store.requests, store.bytes_received
+    """
+    def __init__(self, latency=0.0, port=0, log=False):
+        self.latency = latency
+        self.logging = log
+        self.requests = 0
+        self.bytes_received = 0
+        self.log = []
+        self.fail = ()
+        self._lock = threading.Lock()
+        self._server = _Server(('127.0.0.1', port), _Handler)
+        self._server.store = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self._server.server_port
+
+    def record(self, method, path, body):
+        with self._lock:
+            self.requests += 1
+            self.bytes_received += len(body)
+            if self.logging :
+                self.log.append( (method, path, body) )
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes_received = 0
+            self.log = []
+
+    def paths(self, method=None):
+        """ the paths requested (with method, if given) in the order they arrived """
+        with self._lock:
+            return [ path for (m, path, body) in self.log if method is None or m == method ]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
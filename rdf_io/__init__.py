@@ -4,3 +4,5 @@ except:
     import signals
 
 __version__ = (0, 1)
+
+default_app_config = 'rdf_io.apps.RdfIoConfig'
@@ -53,6 +53,21 @@ class NamespaceAdmin(admin.ModelAdmin):
 class ImportedResourceAdmin(admin.ModelAdmin):
     pass
 
+class PublishOutboxAdmin(admin.ModelAdmin) :
+    list_display = ('content_type', 'object_id', 'queued_at', 'attempts', 'next_attempt')
+    list_filter = ('content_type',)
+
+class PublishLedgerAdmin(admin.ModelAdmin) :
+    list_display = ('content_type', 'object_id', 'binding', 'published_at', 'status')
+    list_filter = ('content_type', 'binding')
+
+class SyncCheckpointAdmin(admin.ModelAdmin) :
+    list_display = ('content_type', 'binding', 'last_pk', 'published', 'failed', 'skipped', 'updated_at', 'finished_at')
+
+class MaterializedRDFAdmin(admin.ModelAdmin) :
+    list_display = ('content_type', 'object_id', 'format', 'updated_at', 'stale')
+    list_filter = ('content_type', 'format', 'stale')
+
 class ServiceBindingAdmin(admin.ModelAdmin) :
     list_display = ('title', 'binding_type')
     pass
@@ -65,4 +80,8 @@ admin.site.register(AttributeMapping, AttributeMappingAdmin)
 admin.site.register(EmbeddedMapping, EmbeddedMappingAdmin)
 admin.site.register(ImportedResource, ImportedResourceAdmin)
 
-admin.site.register(ServiceBinding, ServiceBindingAdmin)
\ No newline at end of file
+admin.site.register(ServiceBinding, ServiceBindingAdmin)
+admin.site.register(PublishOutbox, PublishOutboxAdmin)
+admin.site.register(PublishLedger, PublishLedgerAdmin)
+admin.site.register(SyncCheckpoint, SyncCheckpointAdmin)
+admin.site.register(MaterializedRDF, MaterializedRDFAdmin)
\ No newline at end of file
@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+
+
+class RdfIoConfig(AppConfig):
+    name = 'rdf_io'
+
+    def ready(self):
+        from rdf_io.relations import relation_index
+        # every model is loaded now - index their relations before the first path needs them
+        relation_index.build()
+        from rdf_io import materialize
+        # in every process, whether or not the auto push signals are set up
+        materialize.connect()
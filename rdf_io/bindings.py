@@ -0,0 +1,132 @@
+"""
+    Process wide index of ServiceBindings and ConfigVars
+
+    Publishing an object needs its binding (found through the ObjectMappings for its ContentType) and the ConfigVars its
+    url templates refer to. Both are loaded from the database on first use - in three queries - and discarded whenever a
+    ServiceBinding, ConfigVar or ObjectMapping is saved or deleted, so resolving where an object goes costs no queries.
+
+    Bindings are also kept by pk, so chains (next_service etc - see rdf_io.chains) can be followed without queries.
+
+    Binding object_filters are compiled once into predicates. A filter is either a path filter (path1=a,b AND path2!=c,
+    as for ObjectMappings) or a python dict literal {path : value or [values]}. A binding whose filter cannot be parsed
+    applies to no objects (and the error is logged) - ServiceBinding.clean rejects such filters when saved in the admin.
+"""
+from django.db.models import signals
+
+import ast
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def compile_object_filter(expr):
+    """ the parsed clauses (see parse_pathfilter) for a binding object_filter, or None if there is no filter """
+    from rdf_io.models import parse_pathfilter
+    if not expr or not expr.strip() :
+        return None
+    expr = expr.strip()
+    if expr.startswith('{') :
+        clauses = []
+        for (path,vals) in ast.literal_eval(expr).items() :
+            if not isinstance(vals, (list, tuple)) :
+                vals = [vals]
+            clauses.append( (path, False, [ v if isinstance(v, basestring) else unicode(v) for v in vals ]) )
+        return clauses
+    return parse_pathfilter(expr)
+
+
+class IndexedBinding(object):
+    """ a ServiceBinding with its compiled object_filter """
+    __slots__ = ('binding', 'filter', 'valid')
+
+    def __init__(self, binding):
+        self.binding = binding
+        self.valid = True
+        try:
+            self.filter = compile_object_filter(binding.object_filter)
+        except Exception as e:
+            # never publish through it - falling back to all objects could send them to the wrong store
+            logger.error("Invalid object filter on service binding %s - it will not be used : %s" % (binding, e))
+            self.filter = None
+            self.valid = False
+
+    def applies_to(self, obj):
+        from rdf_io.models import apply_pathfilter
+        if not self.valid :
+            return False
+        return self.filter is None or obj is None or apply_pathfilter(obj, self.filter)
+
+
+class BindingIndex(object):
+    """ thread safe lookup of ServiceBindings by (model name, binding type), and of ConfigVar values """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+
+    def _get_state(self):
+        state = self._state
+        if state is None :
+            with self._lock:
+                if self._state is None :
+                    self._state = self._load()
+                state = self._state
+        return state
+
+    def _load(self):
+        from django.contrib.contenttypes.models import ContentType
+        from rdf_io.models import ServiceBinding, ConfigVar
+        bindings = dict( (b.pk, IndexedBinding(b)) for b in ServiceBinding.objects.all() )
+        index = {}
+        pairs = ServiceBinding.object_mapping.through.objects.values_list('servicebinding_id', 'objectmapping__content_type_id').distinct()
+        for (binding_id,ct_id) in sorted(pairs) :
+            # same content type lookup (and order, by binding pk) as the query this replaces
+            model = ContentType.objects.get_for_id(ct_id).model
+            ib = bindings[binding_id]
+            index.setdefault( (model, ib.binding.binding_type), []).append(ib)
+        configvars = {}
+        for (var,value) in ConfigVar.objects.order_by('-pk').values_list('var','value') :
+            # the first defined wins, as for ConfigVar.objects.filter(var=var).first()
+            configvars[var] = value
+        logger.debug("indexed %d service bindings and %d config variables" % (len(bindings), len(configvars)))
+        return (index, configvars, bindings)
+
+    def invalidate(self, **kwargs):
+        """ signal handler - reload from the database on next use """
+        with self._lock:
+            self._state = None
+
+    def get(self, model, bindingtypes, obj=None):
+        """
+            the first ServiceBinding (by pk) of one of bindingtypes for the model name - if obj is given, the first whose
+            object_filter it matches. None if there is no such binding
+        """
+        index = self._get_state()[0]
+        candidates = []
+        for bindingtype in bindingtypes :
+            candidates.extend(index.get( (model, bindingtype), () ))
+        for ib in sorted(candidates, key=lambda ib: ib.binding.pk) :
+            if ib.applies_to(obj) :
+                return ib.binding
+        return None
+
+    def for_model(self, model):
+        """ the IndexedBindings of every type for a model name, by pk """
+        index = self._get_state()[0]
+        return sorted( [ ib for ((m,bindingtype),ibs) in index.items() if m == model for ib in ibs ], key=lambda ib: ib.binding.pk)
+
+    def binding(self, pk):
+        """ the IndexedBinding of any ServiceBinding by pk - e.g. to follow next_service_id without a query """
+        return self._get_state()[2].get(pk)
+
+    def configvar(self, var):
+        """ the value of a ConfigVar, or None if it isnt set """
+        return self._get_state()[1].get(var)
+
+
+binding_index = BindingIndex()
+
+for _sender in ('rdf_io.ServiceBinding', 'rdf_io.ConfigVar', 'rdf_io.ObjectMapping') :
+    signals.post_save.connect(binding_index.invalidate, sender=_sender, dispatch_uid='rdf_io_binding_index_%s' % _sender)
+    signals.post_delete.connect(binding_index.invalidate, sender=_sender, dispatch_uid='rdf_io_binding_index_%s' % _sender)
+signals.m2m_changed.connect(binding_index.invalidate, sender='rdf_io.ServiceBinding_object_mapping', dispatch_uid='rdf_io_binding_index_mappings')
@@ -0,0 +1,354 @@
+"""
+    Running ServiceBinding chains
+
+    The bindings attached to a model's ObjectMappings that are not the next_service, on_fail_service or on_delete_service
+    of another of them start its chains. Each binding is a stage, by binding type:
+        VALIDATION      the graph is POSTed to the service - a response status >= 400, or a SHACL report that doesnt
+                        conform, fails it
+        INFERENCE       the graph is POSTed to the service and the entailed graph returned replaces it for the stages after
+        PERSIST_*       the graph is published as push_to_store would, PERSIST_PURGE deletes the resource instead
+    A stage that succeeds hands its graph on to its next_service, one that fails to its on_fail_service (otherwise the
+    failure is reported). A PERSIST_REPLACE binding with an on_delete_service runs that first, for stores that cant
+    replace a resource themselves.
+
+    Every stage has its own BoundedPool of ServiceBinding.concurrency workers, so during a bulk run objects are in all
+    the stages at once with a bounded number waiting at each, and separate chains (e.g. two stores) run side by side.
+    Urls are resolved and graphs built on the calling thread - the only one that uses the database.
+
+    Used instead of the single persistence binding when settings.RDF_IO_SERVICE_CHAINS is set.
+"""
+from django.conf import settings
+from django.utils import timezone
+
+from rdf_io.models import ServiceBinding, RDFConfigException, RDFConfigNotFoundException, RDFStoreException, StorePush, \
+    resolve_target, _sparql_target, _etags
+from rdf_io.bindings import binding_index
+from rdf_io.plans import get_mapping_plan
+from rdf_io.sync import SyncSummary, MAX_ERRORS
+from rdf_io.utils import BoundedPool, queryset_chunks
+from rdf_io.metrics import metrics, enabled as metrics_enabled
+from rdf_io import ledger
+
+from functools import partial
+import rdflib
+import requests
+import threading
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+PERSIST_BINDINGS = (ServiceBinding.PERSIST_CREATE,ServiceBinding.PERSIST_UPDATE,ServiceBinding.PERSIST_REPLACE)
+
+SH_CONFORMS = rdflib.URIRef('http://www.w3.org/ns/shacl#conforms')
+SH_MESSAGE = rdflib.URIRef('http://www.w3.org/ns/shacl#resultMessage')
+
+# rdflib parser for the Content-Type of an inference service response
+_RESPONSE_FORMATS = { 'text/turtle' : 'turtle', 'application/x-turtle' : 'turtle', 'application/n-triples' : 'nt',
+    'text/plain' : 'nt', 'application/rdf+xml' : 'xml', 'application/ld+json' : 'json-ld', 'text/n3' : 'n3' }
+
+
+def enabled():
+    return getattr(settings, 'RDF_IO_SERVICE_CHAINS', False)
+
+
+class Chain(object):
+    """ the bindings that start the chains for a model and every binding reachable from them """
+    def __init__(self, model):
+        self.model = model
+        # bindings that run as stages, and those only used as an on_delete_service pre-step
+        self.stages = {}
+        self.targets = {}
+        # stages in an order where each comes before those it hands on to - the order their pools are shut down
+        self.order = []
+        ibs = binding_index.for_model(model)
+        linked = set()
+        for ib in ibs :
+            b = ib.binding
+            linked.update( pk for pk in (b.next_service_id, b.on_fail_service_id, b.on_delete_service_id) if pk )
+        self.roots = [ ib for ib in ibs if ib.binding.pk not in linked ]
+        if not self.roots :
+            raise RDFConfigNotFoundException("No service bindings configured for %s" % model)
+        for ib in self.roots :
+            self._walk(ib.binding, ())
+        self.order.reverse()
+
+    def _walk(self, binding, path):
+        if binding.pk in path :
+            raise RDFConfigException("Service binding chain loops back to %s" % binding)
+        if binding.on_delete_service_id :
+            self.targets[binding.on_delete_service_id] = _get_binding(binding.on_delete_service_id)
+        if binding.pk in self.stages :
+            return
+        self.stages[binding.pk] = self.targets[binding.pk] = binding
+        for pk in (binding.next_service_id, binding.on_fail_service_id) :
+            if pk :
+                self._walk(_get_binding(pk), path + (binding.pk,))
+        self.order.append(binding.pk)
+
+    def roots_for(self, obj):
+        return [ ib.binding for ib in self.roots if ib.applies_to(obj) ]
+
+    def persist_bindings(self):
+        return [ b for b in self.stages.values() if b.binding_type in PERSIST_BINDINGS ]
+
+def _get_binding(pk):
+    ib = binding_index.binding(pk)
+    if ib is None :
+        raise RDFConfigNotFoundException("Service binding %s not found" % pk)
+    return ib.binding
+
+
+class ChainSummary(object):
+    """ a SyncSummary for each stage, and the failures no on_fail_service handled - failures has the errors of each object """
+    def __init__(self, model):
+        self.model = model
+        self.stages = {}
+        self.objects = 0
+        self.failed = 0
+        self.errors = []
+        self.failures = {}
+        self.started = time.time()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def stage(self, binding):
+        with self._lock:
+            summary = self.stages.get(binding.pk)
+            if summary is None :
+                summary = self.stages[binding.pk] = SyncSummary("%s via %s" % (self.model, binding.title), binding.concurrency)
+            return summary
+
+    def record_failure(self, pk, binding, error):
+        """ binding is the stage that failed - None if the object never got to one """
+        logger.error("chain for %s %s failed : %s" % (self.model, pk, error))
+        with self._lock:
+            self.failed += 1
+            self.failures.setdefault(pk, []).append(error)
+            if len(self.errors) < MAX_ERRORS :
+                self.errors.append("%s at %s : %s" % (pk, binding.title, error) if binding else "%s : %s" % (pk, error))
+
+    def finish(self):
+        self.finished = time.time()
+        return self
+
+    def as_dict(self):
+        elapsed = (self.finished or time.time()) - self.started
+        return {
+            'model' : self.model,
+            'objects' : self.objects,
+            'failed' : self.failed,
+            'errors' : self.errors,
+            'stages' : [ dict(s.as_dict(), binding=pk) for (pk,s) in sorted(self.stages.items()) ],
+            'elapsed' : round(elapsed, 3),
+            'objects_per_sec' : round(self.objects / elapsed, 2) if elapsed else None,
+        }
+
+
+class _Item(object):
+    """ an object on its way through the stages - everything needed about it, resolved on the calling thread """
+    __slots__ = ('pk', 'targets', 'built', 'previous')
+
+    def __init__(self, pk, targets, built, previous):
+        self.pk = pk
+        self.targets = targets
+        self.built = built
+        self.previous = previous
+
+
+class ChainRun(object):
+    """
+        runs objects through the chains of a model - submit each object with its graph, then close() to wait for them all
+    """
+    def __init__(self, chain, summary=None, concurrency=None):
+        self.chain = chain
+        self.summary = summary or ChainSummary(chain.model)
+        self.pools = dict( (pk, BoundedPool(concurrency or b.concurrency or 1)) for (pk,b) in chain.stages.items() )
+
+    def submit(self, obj, gr, previous=None):
+        """ send obj along every chain whose first binding applies to it - previous is the published triples per SPARQL binding pk """
+        roots = self.chain.roots_for(obj)
+        if not roots :
+            return
+        targets = dict( (pk, resolve_target(b, self.chain.model, obj)) for (pk,b) in self.chain.targets.items() )
+        item = _Item(obj.pk, targets, timezone.now(), previous or {})
+        self.summary.objects += 1
+        for binding in roots :
+            self._submit(binding, item, gr)
+
+    def _submit(self, binding, item, gr):
+        self.pools[binding.pk].submit(partial(self._run, binding, item, gr))
+
+    def _run(self, binding, item, gr):
+        summary = self.summary.stage(binding)
+        try:
+            if binding.binding_type == ServiceBinding.PERSIST_REPLACE and binding.on_delete_service_id :
+                purge = self.chain.targets[binding.on_delete_service_id]
+                _purge(self._push(purge, item, gr))
+            push = self._push(binding, item, gr)
+            (gr, result) = _STAGES.get(binding.binding_type, _persist)(push)
+        except Exception as e:
+            summary.record_failure(item.pk, e)
+            if binding.on_fail_service_id :
+                self._submit(self.chain.stages[binding.on_fail_service_id], item, gr)
+            else:
+                self.summary.record_failure(item.pk, binding, e)
+            return
+        ledger_record = (ledger.graph_hash(gr), item.built) if binding.binding_type in PERSIST_BINDINGS else None
+        summary.record_success(item.pk, push, result, ledger_record)
+        if binding.next_service_id :
+            self._submit(self.chain.stages[binding.next_service_id], item, gr)
+
+    def _push(self, binding, item, gr):
+        (url, headers, auth) = item.targets[binding.pk]
+        return StorePush(binding, url, gr, headers, auth, item.previous.get(binding.pk))
+
+    def record_ledger(self, ct):
+        """ record what the persistence stages have published since the last call - on the calling thread """
+        for binding in self.chain.persist_bindings() :
+            ledger.record(binding, ct, self.summary.stage(binding).take_published())
+
+    def close(self):
+        """ wait for every object submitted to get through its chains """
+        for pk in self.chain.order :
+            self.pools[pk].join()
+        return self.summary.finish()
+
+
+def _post(push, accept=None):
+    """ POST the graph as turtle to a validation or inference service """
+    headers = {'Content-Type': 'text/turtle'}
+    if accept :
+        headers['Accept'] = accept
+    headers.update(push.headers)
+    data = push.data
+    started = time.time()
+    try:
+        result = requests.post(push.url, headers=headers, data=data, auth=push.auth)
+    except Exception as e:
+        if metrics_enabled() :
+            metrics.request(push.binding, time.time() - started, len(data), error=True)
+        raise
+    if metrics_enabled() :
+        metrics.request(push.binding, time.time() - started, len(data), result.status_code, error=result.status_code >= 400)
+    if result.status_code >= 400 :
+        raise RDFStoreException("{} rejected by {} {} : {}".format(push.url, push.binding.title, result.status_code, result.content), result.status_code)
+    return result
+
+def _response_graph(result):
+    """ the RDF in a response body as a graph, or None if it has none """
+    if not result.content or not result.content.strip() :
+        return None
+    content_type = result.headers.get('Content-Type', '').split(';')[0].strip()
+    gr = rdflib.Graph()
+    return gr.parse(data=result.content, format=_RESPONSE_FORMATS.get(content_type, 'turtle'))
+
+def _validate(push):
+    result = _post(push, 'text/turtle')
+    try:
+        report = _response_graph(result)
+    except Exception :
+        # not an RDF report - the status is all there is to go on
+        report = None
+    if report is not None and (None, SH_CONFORMS, rdflib.Literal(False)) in report :
+        messages = sorted( unicode(m) for m in report.objects(None, SH_MESSAGE) )
+        raise RDFStoreException("Failed validation by %s : %s" % (push.binding.title, "; ".join(messages) or "does not conform"), result.status_code)
+    return (push.graph, result)
+
+def _infer(push):
+    result = _post(push, 'text/turtle')
+    entailed = _response_graph(result)
+    return (push.graph if entailed is None else entailed, result)
+
+def _persist(push):
+    return (push.graph, push.send())
+
+def _purge(push):
+    """ remove the resource - a SPARQL binding clears its named graph, or the statements about the resources in the graph """
+    if push.binding.service_api == ServiceBinding.SPARQL :
+        (endpoint, graph) = _sparql_target(push.url)
+        if graph :
+            update = "CLEAR SILENT GRAPH <%s>" % graph
+        else:
+            update = " ;\n".join( "DELETE WHERE { %s ?p ?o }" % s.n3() for s in sorted(set(push.graph.subjects())) if isinstance(s, rdflib.URIRef) )
+        if not update :
+            return (push.graph, None)
+        result = requests.post(endpoint, headers=dict(push.headers, **{'Content-Type': 'application/sparql-update; charset=UTF-8'}), data=update.encode('utf-8'), auth=push.auth)
+    else:
+        result = requests.delete(push.url, headers=push.headers, auth=push.auth)
+        _etags.discard(push.url)
+    # already gone is as good as deleted
+    if result.status_code >= 400 and result.status_code != 404 :
+        raise RDFStoreException("Failed to delete resource {} {}".format(push.url, result.status_code), result.status_code)
+    return (push.graph, result)
+
+_STAGES = { ServiceBinding.VALIDATION : _validate, ServiceBinding.INFERENCE : _infer, ServiceBinding.PERSIST_PURGE : _purge }
+
+
+def _previous(chain, ct, object_ids):
+    """ the triples last published through each SPARQL persistence binding of the chain, as {object id : {binding pk : lines}} """
+    previous = {}
+    for binding in chain.persist_bindings() :
+        if binding.service_api != ServiceBinding.SPARQL :
+            continue
+        for (object_id,entry) in ledger.lookup(binding, ct, object_ids, with_triples=True).items() :
+            previous.setdefault(object_id, {})[binding.pk] = entry.triples.splitlines()
+    return previous
+
+def publish_chain(obj, model, gr):
+    """
+        run the chains for a single object - its branches concurrently - and return the ChainSummary.
+        raises RDFStoreException if a stage failed without an on_fail_service to handle it
+    """
+    from django.contrib.contenttypes.models import ContentType
+    ct = ContentType.objects.get_for_model(obj)
+    chain = Chain(ct.model)
+    run = ChainRun(chain)
+    run.submit(obj, gr, _previous(chain, ct, [obj.pk]).get(str(obj.pk)) if obj.pk is not None else None)
+    summary = run.close()
+    if obj.pk is not None :
+        run.record_ledger(ct)
+    if summary.failed :
+        raise RDFStoreException("; ".join(summary.errors))
+    return summary
+
+def unpublish_chain(obj, model, gr):
+    """ run the on_delete_service of the stages in the chains that apply to a deleted object - gr is its graph, if it can still be built """
+    chain = Chain(model)
+    if not chain.roots_for(obj) :
+        return
+    for binding in sorted(chain.stages.values(), key=lambda b: b.pk) :
+        if binding.on_delete_service_id :
+            purge = chain.targets[binding.on_delete_service_id]
+            (url, headers, auth) = resolve_target(purge, model, obj)
+            _purge(StorePush(purge, url, gr if gr is not None else rdflib.Graph(), headers, auth))
+
+def sync_chains(ct, model=None, concurrency=None, chunk_size=None, queryset=None):
+    """
+        run every mapped object of a content type through its chains, with every stage working at once -
+        concurrency overrides the concurrency of every binding. Returns a ChainSummary
+    """
+    # import here to avoid a circular import - the views import this module
+    from rdf_io.views.serialize import build_graph
+
+    model = model or ct.model
+    oml = get_mapping_plan(ct)
+    chain = Chain(model)
+    chunk_size = chunk_size or getattr(settings, 'RDF_IO_SYNC_CHUNK_SIZE', 500)
+    if queryset is None :
+        queryset = ct.model_class().objects.all()
+    run = ChainRun(chain, concurrency=concurrency)
+    try:
+        for chunk in queryset_chunks(oml.prepare_queryset(oml.filter_queryset(queryset)), chunk_size) :
+            previous = _previous(chain, ct, [ obj.pk for obj in chunk ])
+            for obj in chunk :
+                try:
+                    gr = build_graph(obj, oml)
+                    run.submit(obj, gr, previous.get(str(obj.pk)))
+                except Exception as e:
+                    run.summary.record_failure(obj.pk, None, e)
+            run.record_ledger(ct)
+    finally:
+        run.close()
+    run.record_ledger(ct)
+    return run.summary
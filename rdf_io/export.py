@@ -0,0 +1,180 @@
+"""
+    Offline export of the whole mapped dataset as sharded N-Quads (or N-Triples) files
+
+    Each model is split into primary key ranges of at most RDF_IO_EXPORT_SHARD_SIZE (default 10000) objects, and the
+    shards are serialised by a pool of worker processes - each with its own database connection - into one file each,
+    optionally gzip compressed. A manifest.json in the same directory lists every file with its primary key range,
+    object and statement counts and SHA-256 checksum, so a loader can check it has the complete dataset.
+
+    Used by the rdf_export management command.
+"""
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections
+
+from rdf_io.models import ObjectMapping
+from rdf_io.plans import get_mapping_plan
+from rdf_io.sinks import NTriplesSink
+from rdf_io.sync import MAX_ERRORS
+from rdf_io.utils import queryset_chunks
+
+import datetime
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = { 'nt' : '.nt', 'nquads' : '.nq' }
+
+MANIFEST = 'manifest.json'
+
+
+def shard_size():
+    return getattr(settings, 'RDF_IO_EXPORT_SHARD_SIZE', 10000)
+
+def exported_models():
+    """ the ContentTypes with at least one ObjectMapping """
+    return [ ContentType.objects.get_for_id(ct_id) for ct_id in
+        ObjectMapping.objects.order_by('content_type').values_list('content_type', flat=True).distinct() ]
+
+def shards(ct, size=None):
+    """ the (first pk, last pk, objects) ranges splitting the mapped objects of a model into shards of at most size objects """
+    size = size or shard_size()
+    oml = get_mapping_plan(ct)
+    pks = oml.filter_queryset(ct.model_class().objects.all()).order_by('pk').values_list('pk', flat=True)
+    ranges = []
+    (first, last, count) = (None, None, 0)
+    for pk in pks.iterator() :
+        if count == size :
+            ranges.append( (first, last, count) )
+            (first, count) = (None, 0)
+        if first is None :
+            first = pk
+        last = pk
+        count += 1
+    if count :
+        ranges.append( (first, last, count) )
+    return ranges
+
+
+class ShardTask(object):
+    """ one file to write - picklable, so it can be sent to a worker process """
+    def __init__(self, ct_id, first, last, path, format='nquads', graph=None, compress=False, chunk_size=500):
+        self.ct_id = ct_id
+        self.first = first
+        self.last = last
+        self.path = path
+        self.format = format
+        self.graph = graph
+        self.compress = compress
+        self.chunk_size = chunk_size
+
+
+def export_shard(task):
+    """ write one shard file - returns its manifest entry """
+    from rdf_io.views.serialize import build_rdf, resource_uri
+    started = time.time()
+    ct = ContentType.objects.get_for_id(task.ct_id)
+    oml = get_mapping_plan(ct)
+    queryset = oml.prepare_queryset(oml.filter_queryset(ct.model_class().objects.filter(pk__gte=task.first, pk__lte=task.last)))
+    entry = { 'file' : os.path.basename(task.path), 'model' : "%s.%s" % (ct.app_label, ct.model), 'first_pk' : task.first,
+        'last_pk' : task.last, 'objects' : 0, 'statements' : 0, 'failed' : 0, 'errors' : [] }
+    raw = open(task.path, 'wb')
+    # mtime 0 so the same data always gives the same file and checksum
+    out = gzip.GzipFile(filename='', mode='wb', fileobj=raw, mtime=0) if task.compress else raw
+    try:
+        for chunk in queryset_chunks(queryset, task.chunk_size) :
+            for obj in chunk :
+                try:
+                    if task.format == 'nquads' :
+                        sink = NTriplesSink(task.graph or resource_uri(obj, oml))
+                    else:
+                        sink = NTriplesSink()
+                    lines = build_rdf(sink, obj, oml, False).lines()
+                except Exception as e:
+                    entry['failed'] += 1
+                    if len(entry['errors']) < MAX_ERRORS :
+                        entry['errors'].append("%s : %s" % (obj.pk, e))
+                    logger.error("Could not serialise %s %s : %s" % (ct.model, obj.pk, e))
+                    continue
+                out.write("".join(lines))
+                entry['objects'] += 1
+                entry['statements'] += len(lines)
+    finally:
+        if out is not raw :
+            out.close()
+        raw.close()
+    entry['bytes'] = os.path.getsize(task.path)
+    entry['sha256'] = _file_hash(task.path)
+    entry['seconds'] = round(time.time() - started, 3)
+    return entry
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b'') :
+            digest.update(block)
+    return digest.hexdigest()
+
+def _init_worker():
+    # the parent's connections were closed before forking, so each worker opens its own on first use
+    connections.close_all()
+
+
+def export_dataset(directory, cts=None, format='nquads', graph=None, compress=False, processes=None, size=None, chunk_size=None):
+    """
+        export the mapped objects of the models (ContentTypes - by default every mapped model) into shard files in
+        directory, using processes worker processes (default one per CPU, 1 to export in this process).
+
+        Writes and returns the manifest.
+    """
+    if format not in EXTENSIONS :
+        raise ValueError("Unsupported export format %s - use one of %s" % (format, ",".join(EXTENSIONS)))
+    if not os.path.isdir(directory) :
+        os.makedirs(directory)
+    cts = cts or exported_models()
+    chunk_size = chunk_size or getattr(settings, 'RDF_IO_EXPORT_CHUNK_SIZE', 500)
+    extension = EXTENSIONS[format] + ('.gz' if compress else '')
+    started = time.time()
+    tasks = []
+    for ct in cts :
+        for (index, (first, last, count)) in enumerate(shards(ct, size)) :
+            path = os.path.join(directory, "%s.%s-%05d%s" % (ct.app_label, ct.model, index, extension))
+            tasks.append(ShardTask(ct.id, first, last, path, format, graph, compress, chunk_size))
+    processes = processes or multiprocessing.cpu_count()
+    processes = min(processes, len(tasks)) or 1
+    logger.info("exporting %d shards of %d models with %d processes" % (len(tasks), len(cts), processes))
+    if processes == 1 :
+        entries = [ export_shard(task) for task in tasks ]
+    else:
+        # never share a connection with the workers
+        connections.close_all()
+        pool = multiprocessing.Pool(processes, initializer=_init_worker)
+        try:
+            entries = pool.map(export_shard, tasks, chunksize=1)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    manifest = {
+        'created' : datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'format' : format,
+        'compressed' : compress,
+        'graph' : graph,
+        'processes' : processes,
+        'seconds' : round(time.time() - started, 3),
+        'objects' : sum( e['objects'] for e in entries ),
+        'statements' : sum( e['statements'] for e in entries ),
+        'failed' : sum( e['failed'] for e in entries ),
+        'files' : entries,
+    }
+    with open(os.path.join(directory, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
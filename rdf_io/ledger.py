@@ -0,0 +1,41 @@
+"""
+    The publish ledger - a hash of the graph last published for each object through each ServiceBinding
+
+    Graphs are hashed in a canonical form (sorted N-Triples - blank nodes generated by build_rdf have stable ids),
+    so an incremental sync can build an object's graph locally and skip the push when nothing in it has changed.
+"""
+from django.db import transaction
+
+from rdf_io.models import PublishLedger
+
+from collections import namedtuple
+import hashlib
+
+LedgerEntry = namedtuple('LedgerEntry', ('graph_hash', 'published_at', 'status', 'triples'))
+
+
+def graph_hash(gr):
+    """ SHA1 of the canonical (sorted N-Triples) form of a graph """
+    lines = sorted( line for line in gr.serialize(format='nt').splitlines() if line.strip() )
+    return hashlib.sha1("\n".join(lines)).hexdigest()
+
+def lookup(binding, ct, object_ids, with_triples=False):
+    """
+        the LedgerEntry for each of object_ids that has been published through binding, keyed by object id.
+        The published triples are only loaded if with_triples is set.
+    """
+    entries = PublishLedger.objects.filter(binding=binding, content_type=ct, object_id__in=[ str(i) for i in object_ids ])
+    fields = ['object_id', 'graph_hash', 'published_at', 'status']
+    if with_triples :
+        fields.append('triples')
+    return dict( (row[0], LedgerEntry(*(row[1:] + (None,) * (5 - len(row))))) for row in entries.values_list(*fields) )
+
+def record(binding, ct, published):
+    """ record a list of (object id, graph hash, built at, status, triples) for objects published through binding """
+    if not published :
+        return
+    object_ids = [ str(p[0]) for p in published ]
+    with transaction.atomic():
+        PublishLedger.objects.filter(binding=binding, content_type=ct, object_id__in=object_ids).delete()
+        PublishLedger.objects.bulk_create([ PublishLedger(binding=binding, content_type=ct, object_id=str(object_id),
+            graph_hash=h, published_at=built, status=status, triples=triples or '') for (object_id, h, built, status, triples) in published ])
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.contenttypes.models import ContentType
+
+from rdf_io import export
+
+
+class Command(BaseCommand):
+    help = 'Export the RDF for every mapped object (or those of the given models) as sharded files with a manifest, using a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help='models to export as app.model or model - default every mapped model')
+        parser.add_argument('--output', '-o', default='rdf_export', help='directory for the shard files and manifest.json')
+        parser.add_argument('--format', choices=sorted(export.EXTENSIONS), default='nquads', help='nquads puts each resource in its own named graph unless --graph is given')
+        parser.add_argument('--graph', default=None, help='named graph for all N-Quads')
+        parser.add_argument('--gzip', action='store_true', help='gzip compress the shard files')
+        parser.add_argument('--processes', '-j', type=int, default=None, help='worker processes - default one per CPU')
+        parser.add_argument('--shard-size', type=int, default=None, help='maximum objects per shard - default RDF_IO_EXPORT_SHARD_SIZE')
+
+    def handle(self, *args, **options):
+        cts = []
+        for model in options['models'] :
+            try:
+                try:
+                    (app,model) = model.split('.')
+                    ct = ContentType.objects.get(app_label=app,model=model)
+                except ValueError:
+                    ct = ContentType.objects.get(model=model)
+            except ContentType.DoesNotExist:
+                raise CommandError("No such model found %s" % model)
+            cts.append(ct)
+        try:
+            manifest = export.export_dataset(options['output'], cts, format=options['format'], graph=options['graph'],
+                compress=options['gzip'], processes=options['processes'], size=options['shard_size'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write("%d objects, %d statements in %d files (%d failed) in %ss - see %s" % (manifest['objects'],
+            manifest['statements'], len(manifest['files']), manifest['failed'], manifest['seconds'], options['output']))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.contenttypes.models import ContentType
+
+from rdf_io.export import exported_models
+from rdf_io import materialize
+
+
+class Command(BaseCommand):
+    help = 'Render and store the materialized RDF (see RDF_IO_MATERIALIZED_RDF) for every mapped object, or those of the given models'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help='models to materialize as app.model or model - default every mapped model')
+        parser.add_argument('--stale', action='store_true', help='only objects whose stored RDF is missing or stale')
+        parser.add_argument('--chunk-size', type=int, default=None, help='objects read at a time - default RDF_IO_EXPORT_CHUNK_SIZE')
+
+    def handle(self, *args, **options):
+        if not materialize.enabled() :
+            self.stderr.write("RDF_IO_MATERIALIZED_RDF is not set - the stored RDF will not be kept up to date or used")
+        cts = []
+        for model in options['models'] :
+            try:
+                try:
+                    (app,model) = model.split('.')
+                    ct = ContentType.objects.get(app_label=app,model=model)
+                except ValueError:
+                    ct = ContentType.objects.get(model=model)
+            except ContentType.DoesNotExist:
+                raise CommandError("No such model found %s" % model)
+            cts.append(ct)
+        for ct in cts or exported_models() :
+            (stored, failed) = materialize.backfill(ct, stale_only=options['stale'], chunk_size=options['chunk_size'])
+            self.stdout.write("%s.%s : %d stored, %d failed" % (ct.app_label, ct.model, stored, failed))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from rdf_io.models import PublishOutbox
+from rdf_io import outbox
+
+import time
+
+
+class Command(BaseCommand):
+    help = 'Publish objects waiting in the RDF publish outbox, retrying failures - runs until stopped unless --once is given'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='drain the entries that are due and exit')
+        parser.add_argument('--interval', type=float, default=5, help='seconds to wait between polls when the outbox is empty')
+        parser.add_argument('--limit', type=int, default=None, help='maximum number of entries to try per poll')
+        parser.add_argument('--retry-failed', action='store_true', help='reset entries that have used up RDF_IO_OUTBOX_MAX_ATTEMPTS so they are tried again')
+
+    def handle(self, *args, **options):
+        if options['retry_failed'] :
+            reset = PublishOutbox.objects.filter(attempts__gte=outbox.max_attempts()).update(attempts=0, next_attempt=timezone.now())
+            self.stdout.write("%d failed entries queued again" % reset)
+        while True :
+            summary = outbox.drain(limit=options['limit'])
+            if summary.published or summary.failed or summary.dropped :
+                self.stdout.write(str(summary))
+            if options['once'] :
+                return
+            if not (summary.published or summary.failed) :
+                time.sleep(options['interval'])
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.contenttypes.models import ContentType
+
+from rdf_io.models import SyncCheckpoint
+from rdf_io.sync import sync_model, check_modified_field
+from rdf_io import chains
+
+import json
+
+
+class Command(BaseCommand):
+    help = 'Publish every mapped object of the models (in the order given) to their RDF stores, recording a checkpoint after each chunk - --resume continues an interrupted sync'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help='models to sync as app.model or model')
+        parser.add_argument('--resume', action='store_true', help='continue from the checkpoint of a sync that did not finish')
+        parser.add_argument('--status', action='store_true', help='show the checkpoints of the models (or all) and exit')
+        parser.add_argument('--concurrency', type=int, default=None, help='concurrent requests - default the ServiceBinding concurrency')
+        parser.add_argument('--batch-size', type=int, default=None, help='objects sent per request where the store API allows it - default RDF_IO_SYNC_BATCH_SIZE')
+        parser.add_argument('--chunk-size', type=int, default=None, help='objects read (and checkpointed) at a time - default RDF_IO_SYNC_CHUNK_SIZE')
+        parser.add_argument('--incremental', action='store_true', help='skip objects whose RDF is unchanged since they were last published')
+        parser.add_argument('--modified-field', default=None, help='with --incremental, a DateTimeField of the model to skip unmodified objects without serialising them')
+
+    def handle(self, *args, **options):
+        cts = [ self._content_type(model) for model in options['models'] ]
+        if options['status'] :
+            checkpoints = SyncCheckpoint.objects.select_related('content_type', 'binding')
+            if cts :
+                checkpoints = checkpoints.filter(content_type__in=cts)
+            for cp in checkpoints.order_by('content_type', 'binding') :
+                self.stdout.write("%s : %s after pk '%s' - %d published, %d failed, %d skipped, updated %s" % (cp,
+                    "finished %s" % cp.finished_at if cp.finished_at else "not finished", cp.last_pk, cp.published, cp.failed, cp.skipped, cp.updated_at))
+            return
+        if not cts :
+            raise CommandError("Give the models to sync")
+        if chains.enabled() :
+            raise CommandError("RDF_IO_SERVICE_CHAINS is set - service chains are synced with the sync_remote view, which cannot be resumed")
+        if options['modified_field'] :
+            for ct in cts :
+                try:
+                    check_modified_field(ct.model_class(), options['modified_field'])
+                except ValueError as e:
+                    raise CommandError(str(e))
+        failed = False
+        for ct in cts :
+            summary = sync_model(ct, concurrency=options['concurrency'], chunk_size=options['chunk_size'], batch_size=options['batch_size'],
+                incremental=options['incremental'], modified_field=options['modified_field'], resume=options['resume'])
+            self.stdout.write(json.dumps(summary.as_dict()))
+            failed = failed or summary.failed
+        if failed :
+            raise CommandError("Some objects could not be published - run again with --resume to retry from the last checkpoint")
+
+    def _content_type(self, model):
+        try:
+            try:
+                (app,model) = model.split('.')
+                return ContentType.objects.get(app_label=app,model=model)
+            except ValueError:
+                return ContentType.objects.get(model=model)
+        except ContentType.DoesNotExist:
+            raise CommandError("No such model found %s" % model)
@@ -0,0 +1,132 @@
+"""
+    Materialized RDF - the serialised Turtle and JSON-LD of every mapped object kept in the MaterializedRDF table
+
+    Set RDF_IO_MATERIALIZED_RDF = True to turn it on. Objects of mapped models are rendered again when they are saved
+    and their rows removed when they are deleted - the handlers are connected for every model when the app is loaded
+    (see rdf_io.apps), in every process, so the stored RDF cant be left behind by one that didnt set them up. Any change to
+    a mapping, object type or namespace marks every row stale in a single update; a stale or missing row is rendered
+    again the first time it is asked for, or by the rdf_materialize command (which also fills the table for existing data).
+
+    The to_rdf views then answer with the stored content - a lookup on the (content type, object, format) index -
+    rather than building and serialising a graph. As with the render cache, changes to related objects that dont
+    save the mapped object itself are only seen once it is rendered again.
+"""
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import signals
+
+from rdf_io.models import MaterializedRDF, ObjectMapping, AttributeMapping, EmbeddedMapping, ObjectType, Namespace
+from rdf_io.render_cache import FORMATS, Rendered
+from rdf_io.utils import queryset_chunks
+
+import calendar
+import hashlib
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def enabled():
+    return getattr(settings, 'RDF_IO_MATERIALIZED_RDF', False)
+
+def _etag(content):
+    return '"%s"' % hashlib.md5(content).hexdigest()
+
+def _rendered(row):
+    return Rendered(row.content.encode('utf-8'), row.etag, calendar.timegm(row.updated_at.utctimetuple()))
+
+def get(ct, pk, format):
+    """ the stored Rendered output for an object, or None if there is none or it is stale """
+    row = MaterializedRDF.objects.filter(content_type=ct, object_id=str(pk), format=format, stale=False).first()
+    return _rendered(row) if row else None
+
+def store(ct, pk, format, content):
+    """ store the serialised content for an object - returns it as Rendered """
+    (row, created) = MaterializedRDF.objects.update_or_create(content_type=ct, object_id=str(pk), format=format,
+        defaults={ 'content' : content.decode('utf-8'), 'etag' : _etag(content), 'stale' : False })
+    return _rendered(row)
+
+def materialize(obj, ct=None, oml=None):
+    """ render obj in every format and store the results - if it cant be rendered any rows for it are removed """
+    from rdf_io.plans import get_mapping_plan
+    from rdf_io.views.serialize import render_rdf
+    ct = ct or ContentType.objects.get_for_model(obj)
+    oml = oml or get_mapping_plan(ct)
+    try:
+        contents = [ (format, render_rdf(obj, oml, format)) for format in FORMATS ]
+    except Exception as e:
+        logger.error("Could not materialize RDF for %s %s : %s" % (ct.model, obj.pk, e))
+        drop(ct, obj.pk)
+        return False
+    for (format, content) in contents :
+        store(ct, obj.pk, format, content)
+    return True
+
+def drop(ct, pk):
+    MaterializedRDF.objects.filter(content_type=ct, object_id=str(pk)).delete()
+
+def backfill(ct, stale_only=False, chunk_size=None):
+    """
+        render and store every mapped object of a content type - or only those with stale or missing rows.
+        Returns (objects stored, objects failed)
+    """
+    from rdf_io.plans import get_mapping_plan
+    oml = get_mapping_plan(ct)
+    chunk_size = chunk_size or getattr(settings, 'RDF_IO_EXPORT_CHUNK_SIZE', 500)
+    queryset = oml.filter_queryset(ct.model_class().objects.all())
+    (stored, failed) = (0, 0)
+    for chunk in queryset_chunks(oml.prepare_queryset(queryset), chunk_size) :
+        if stale_only :
+            current = {}
+            for (object_id, format) in MaterializedRDF.objects.filter(content_type=ct, stale=False,
+                    object_id__in=[ str(obj.pk) for obj in chunk ]).values_list('object_id', 'format') :
+                current[object_id] = current.get(object_id, 0) + 1
+            chunk = [ obj for obj in chunk if current.get(str(obj.pk), 0) < len(FORMATS) ]
+        for obj in chunk :
+            if materialize(obj, ct, oml) :
+                stored += 1
+            else:
+                failed += 1
+    return (stored, failed)
+
+
+def mark_stale(**kwargs):
+    """ signal handler - a mapping has changed so everything stored needs rendering again """
+    if enabled() :
+        MaterializedRDF.objects.filter(stale=False).update(stale=True)
+
+def _mapped(sender):
+    """ the (ContentType, plan) of a mapped model - or None """
+    from rdf_io.plans import get_mapping_plan
+    if sender._meta.app_label in ('rdf_io', 'contenttypes', 'sessions', 'admin') :
+        return None
+    ct = ContentType.objects.get_for_model(sender)
+    plan = get_mapping_plan(ct)
+    return (ct, plan) if plan else None
+
+def materialize_saved(sender, instance, **kwargs):
+    """ post_save handler - render a saved object of a mapped model """
+    if not enabled() :
+        return
+    mapped = _mapped(sender)
+    if mapped :
+        materialize(instance, *mapped)
+
+def drop_deleted(sender, instance, **kwargs):
+    """ post_delete handler - remove the rows of a deleted object of a mapped model """
+    if not enabled() :
+        return
+    mapped = _mapped(sender)
+    if mapped :
+        drop(mapped[0], instance.pk)
+
+def connect():
+    """ connect the save and delete handlers for every model - called once the app registry is ready """
+    signals.post_save.connect(materialize_saved, dispatch_uid='rdf_io_materialize_saved')
+    signals.post_delete.connect(drop_deleted, dispatch_uid='rdf_io_materialize_deleted')
+
+
+for _sender in (ObjectMapping, AttributeMapping, EmbeddedMapping, ObjectType, Namespace) :
+    signals.post_save.connect(mark_stale, sender=_sender, dispatch_uid='rdf_io_materialize')
+    signals.post_delete.connect(mark_stale, sender=_sender, dispatch_uid='rdf_io_materialize')
+signals.m2m_changed.connect(mark_stale, sender=ObjectMapping.obj_type.through, dispatch_uid='rdf_io_materialize')
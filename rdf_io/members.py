@@ -0,0 +1,100 @@
+"""
+    Paged listing of the members of a container resource
+
+    The members of an object are the objects of mapped models that refer to it through a foreign key, one to one or
+    many to many field - the concepts of a scheme, say. A container with many members is served a page at a time:
+    each page holds at most RDF_IO_MEMBER_PAGE_SIZE (default 100) members, with their own mapped RDF, linked from the
+    container by hydra:member. The page is described as a hydra:PartialCollectionView with hydra:first and (unless it
+    is the last) hydra:next links.
+
+    Pages are read with keyset queries (pk > the last member of the previous page) on each member relation in turn, so
+    any page costs the same whatever its position. The cursor naming where a page starts is "{relation}.{pk}".
+"""
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+
+from rdf_io.plans import get_mapping_plan
+from rdf_io.relations import relation_index
+
+from rdflib import Namespace, URIRef, RDF
+
+import logging
+logger = logging.getLogger(__name__)
+
+HYDRA = Namespace('http://www.w3.org/ns/hydra/core#')
+
+
+def page_size():
+    return getattr(settings, 'RDF_IO_MEMBER_PAGE_SIZE', 100)
+
+def member_relations(model):
+    """ the (Relation, plan) for each mapped model referring to model, in a fixed order """
+    found = []
+    for relation in sorted(relation_index.to(model), key=lambda r: (r.model._meta.label_lower, r.field_name)) :
+        plan = get_mapping_plan(ContentType.objects.get_for_model(relation.model))
+        if plan :
+            found.append( (relation, plan) )
+    return found
+
+def parse_cursor(cursor):
+    """ (relation index, pk after or None) for a page cursor - the first page if cursor is empty """
+    if not cursor :
+        return (0, None)
+    (index, sep, after) = cursor.partition('.')
+    try:
+        return (int(index), after or None)
+    except ValueError:
+        raise ValueError("Invalid page %s" % cursor)
+
+
+class MemberPage(object):
+    """ one page of the members of obj, starting at cursor - fetch() reads it """
+    def __init__(self, obj, cursor=None, size=None):
+        self.obj = obj
+        self.cursor = cursor or ''
+        self.size = size or page_size()
+        self.members = []
+        self.next = None
+
+    def fetch(self):
+        """ read the (member, plan) pairs of the page, and the cursor of the next page (None if this is the last) """
+        (start, after) = parse_cursor(self.cursor)
+        relations = member_relations(type(self.obj))
+        # read one more than the page holds to find where (and whether) the next page starts
+        wanted = self.size + 1
+        found = []
+        for index in range(start, len(relations)) :
+            (relation, plan) = relations[index]
+            queryset = plan.filter_queryset(relation.model.objects.filter(**{ relation.field_name : self.obj }))
+            if index == start and after is not None :
+                queryset = queryset.filter(pk__gt=after)
+            for member in plan.prepare_queryset(queryset.order_by('pk'))[:wanted - len(found)] :
+                found.append( (index, member, plan) )
+            if len(found) >= wanted :
+                break
+        if len(found) > self.size :
+            (index, member, plan) = found.pop()
+            (last_index, last, last_plan) = found[-1] if found else (None, None, None)
+            self.next = "%d.%s" % (index, last.pk if last_index == index else '')
+        self.members = [ (member, plan) for (index, member, plan) in found ]
+        return self
+
+    def add_to(self, gr, uri, page_url, first_url, next_url=None):
+        """ add the members, with their RDF, and the hydra paging links for the container uri to graph gr """
+        from rdf_io.views.serialize import build_rdf, resource_uri
+        container = URIRef(uri)
+        view = URIRef(page_url)
+        gr.bind('hydra', HYDRA)
+        gr.add( (container, HYDRA.view, view) )
+        gr.add( (view, RDF.type, HYDRA.PartialCollectionView) )
+        gr.add( (view, HYDRA.first, URIRef(first_url)) )
+        if next_url :
+            gr.add( (view, HYDRA.next, URIRef(next_url)) )
+        for (member, plan) in self.members :
+            member_uri = resource_uri(member, plan)
+            if not member_uri :
+                # none of its mappings apply
+                continue
+            gr.add( (container, HYDRA.member, URIRef(member_uri)) )
+            build_rdf(gr, member, plan, False)
+        return gr
@@ -0,0 +1,187 @@
+"""
+    Runtime instrumentation for building and publishing RDF
+
+    Collects, per process:
+        mappings  - time spent building the RDF for each ObjectMapping, and (if RDF_IO_METRICS_QUERIES is set) the
+                    database queries issued doing it
+        serialize - time spent serialising graphs, and the bytes produced, per format
+        bindings  - requests sent through each ServiceBinding: time, objects, bytes sent, errors and response statuses
+
+    Each event is a couple of clock reads and a dict update under a lock, so it is cheap enough to leave on.
+    Set RDF_IO_METRICS = False to turn collection off. The show_metrics view returns a snapshot as JSON,
+    or in the Prometheus text format with ?format=prometheus.
+
+    Counting queries wraps the cursors of the connection around each mapping of each object (or uses Django's
+    execute_wrapper, from 2.0), which costs more than the rest - so it is off unless RDF_IO_METRICS_QUERIES = True,
+    and query counts are reported as null.
+"""
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.backends.utils import CursorWrapper
+
+from contextlib import contextmanager
+import threading
+import time
+
+
+def enabled():
+    return getattr(settings, 'RDF_IO_METRICS', True)
+
+def queries_enabled():
+    return enabled() and getattr(settings, 'RDF_IO_METRICS_QUERIES', False)
+
+
+class _Stat(object):
+    __slots__ = ('count', 'seconds', 'max_seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.seconds += seconds
+        if seconds > self.max_seconds :
+            self.max_seconds = seconds
+
+    def as_dict(self):
+        return { 'count' : self.count, 'seconds' : round(self.seconds, 6), 'max_seconds' : round(self.max_seconds, 6) }
+
+
+class Metrics(object):
+    """ thread safe counters and timers """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self._mappings = {}
+            self._serialize = {}
+            self._bindings = {}
+
+    def mapping(self, name, seconds, queries=None):
+        """ record building the RDF for one object with the ObjectMapping name """
+        with self._lock:
+            entry = self._mappings.get(name)
+            if entry is None :
+                entry = self._mappings[name] = { 'time' : _Stat(), 'queries' : None }
+            entry['time'].add(seconds)
+            if queries is not None :
+                entry['queries'] = (entry['queries'] or 0) + queries
+
+    def serialized(self, format, seconds, size):
+        with self._lock:
+            entry = self._serialize.get(format)
+            if entry is None :
+                entry = self._serialize[format] = { 'time' : _Stat(), 'bytes' : 0 }
+            entry['time'].add(seconds)
+            entry['bytes'] += size
+
+    def request(self, binding, seconds, size, status=None, objects=1, error=False):
+        """ record a request to a store - status is the HTTP status if there was a response """
+        label = binding_label(binding)
+        with self._lock:
+            entry = self._bindings.get(label)
+            if entry is None :
+                entry = self._bindings[label] = { 'api' : binding.service_api, 'time' : _Stat(), 'objects' : 0,
+                    'bytes_sent' : 0, 'errors' : 0, 'statuses' : {} }
+            entry['time'].add(seconds)
+            entry['objects'] += objects
+            entry['bytes_sent'] += size
+            if error :
+                entry['errors'] += 1
+            if status is not None :
+                entry['statuses'][status] = entry['statuses'].get(status, 0) + 1
+
+    def snapshot(self):
+        """ the current values as a JSON serialisable dict """
+        with self._lock:
+            return {
+                'since' : round(self.started, 3),
+                'mappings' : dict( (name, dict(e['time'].as_dict(), queries=e['queries'])) for (name,e) in self._mappings.items() ),
+                'serialize' : dict( (format, dict(e['time'].as_dict(), bytes=e['bytes'])) for (format,e) in self._serialize.items() ),
+                'bindings' : dict( (label, dict(e['time'].as_dict(), api=e['api'], objects=e['objects'], bytes_sent=e['bytes_sent'],
+                    errors=e['errors'], statuses=dict( (str(k),v) for (k,v) in e['statuses'].items() ))) for (label,e) in self._bindings.items() ),
+            }
+
+    def prometheus(self):
+        """ the current values in the Prometheus text exposition format """
+        snapshot = self.snapshot()
+        lines = []
+        def metric(name, kind, help, samples):
+            lines.append("# HELP rdf_io_%s %s" % (name, help))
+            lines.append("# TYPE rdf_io_%s %s" % (name, kind))
+            for (labels, value) in samples :
+                if value is None :
+                    continue
+                lines.append("rdf_io_%s{%s} %s" % (name, ",".join( '%s="%s"' % (k, _escape(v)) for (k,v) in labels ), value))
+        mappings = sorted(snapshot['mappings'].items())
+        metric('mapping_objects_total', 'counter', 'Objects built per ObjectMapping', [ ((('mapping',n),), e['count']) for (n,e) in mappings ])
+        metric('mapping_seconds_total', 'counter', 'Time building RDF per ObjectMapping', [ ((('mapping',n),), e['seconds']) for (n,e) in mappings ])
+        metric('mapping_queries_total', 'counter', 'Database queries while building RDF per ObjectMapping', [ ((('mapping',n),), e['queries']) for (n,e) in mappings ])
+        formats = sorted(snapshot['serialize'].items())
+        metric('serialize_seconds_total', 'counter', 'Time serialising graphs per format', [ ((('format',f),), e['seconds']) for (f,e) in formats ])
+        metric('serialize_bytes_total', 'counter', 'Bytes of serialised RDF per format', [ ((('format',f),), e['bytes']) for (f,e) in formats ])
+        bindings = sorted(snapshot['bindings'].items())
+        metric('binding_requests_total', 'counter', 'Requests sent per ServiceBinding', [ ((('binding',b),), e['count']) for (b,e) in bindings ])
+        metric('binding_seconds_total', 'counter', 'Time waiting on requests per ServiceBinding', [ ((('binding',b),), e['seconds']) for (b,e) in bindings ])
+        metric('binding_objects_total', 'counter', 'Objects published per ServiceBinding', [ ((('binding',b),), e['objects']) for (b,e) in bindings ])
+        metric('binding_bytes_sent_total', 'counter', 'Bytes sent per ServiceBinding', [ ((('binding',b),), e['bytes_sent']) for (b,e) in bindings ])
+        metric('binding_errors_total', 'counter', 'Failed requests per ServiceBinding', [ ((('binding',b),), e['errors']) for (b,e) in bindings ])
+        metric('binding_responses_total', 'counter', 'Responses per ServiceBinding and HTTP status',
+            [ ((('binding',b),('status',s)), n) for (b,e) in bindings for (s,n) in sorted(e['statuses'].items()) ])
+        return "\n".join(lines) + "\n"
+
+
+def binding_label(binding):
+    return "%s (%s)" % (binding.title, binding.pk)
+
+def _escape(value):
+    return unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _CountingCursor(CursorWrapper):
+    """ counts the statements run through a cursor - for Django versions without execute_wrapper """
+    def __init__(self, cursor, db, counter):
+        super(_CountingCursor, self).__init__(cursor, db)
+        self.counter = counter
+
+    def execute(self, sql, params=None):
+        self.counter[0] += 1
+        return self.cursor.execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        self.counter[0] += 1
+        return self.cursor.executemany(sql, param_list)
+
+
+@contextmanager
+def count_queries():
+    """ counts the queries run on this thread's default connection inside the block """
+    counter = [0]
+    db = connections[DEFAULT_DB_ALIAS]
+    if hasattr(db, 'execute_wrapper') :
+        def wrapper(execute, sql, params, many, context):
+            counter[0] += 1
+            return execute(sql, params, many, context)
+        with db.execute_wrapper(wrapper):
+            yield counter
+        return
+    # every cursor (chunked or not) is made by _prepare_cursor - wrap what it returns, and put back whatever was
+    # there before so nested blocks each get their own count
+    patched = db.__dict__.get('_prepare_cursor')
+    prepare = db._prepare_cursor
+    db._prepare_cursor = lambda cursor: _CountingCursor(prepare(cursor), db, counter)
+    try:
+        yield counter
+    finally:
+        if patched is None :
+            del db._prepare_cursor
+        else:
+            db._prepare_cursor = patched
+
+
+metrics = Metrics()
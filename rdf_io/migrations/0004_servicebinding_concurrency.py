@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:08
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rdf_io', '0002_auto_20170810_2351'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConfigVar',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('var', models.CharField(max_length=16, verbose_name=b'Variable name')),
+                ('value', models.CharField(blank=True, max_length=255, verbose_name=b'Variable value')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ImportedResource',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource_type', models.CharField(choices=[(b'RULE', b'Rule (SPIN, SHACL, SKWRL etc)'), (b'CLASS', b'Class model - RDFS or OWL'), (b'INSTANCE', b'Instance data - SKOS etc'), (b'QUERY', b'Query template - SPARQL - for future use'), (b'VALID', b'Validation rule - for future use')], help_text=b'Determines the post processing applied to the uploaded file', max_length=10)),
+                ('description', models.CharField(blank=True, max_length=255)),
+                ('file', models.FileField(blank=True, upload_to=b'resources/')),
+                ('remote', models.URLField(blank=True, max_length=2000, verbose_name=b'Remote RDF source URI')),
+                ('uploaded_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ServiceBinding',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(default=b'', max_length=255)),
+                ('description', models.TextField(blank=True, max_length=1000, null=True)),
+                ('binding_type', models.CharField(choices=[(b'VALIDATION', b'VALIDATION - Performs validation check'), (b'INFERENCE', b'INFERENCE - The entailed response replaces the default encoding in downstream services'), (b'PERSIST_CREATE', b'PERSIST_CREATE - A new resource is created only if not present in the persistence store'), (b'PERSIST_REPLACE', b'PERSIST_REPLACE -The resource and its properties are replaced in the persistence store'), (b'PERSIST_UPDATE', b'PERSIST_UPDATE - The resource and its properties are added to the persistence store'), (b'PERSIST_PURGE', b'PERSIST_PURGE - The resource and its properties are deleted from the persistence store')], default=b'PERSIST_REPLACE', help_text=b'Choose the role of service', max_length=16)),
+                ('service_api', models.CharField(choices=[(b'RDF4JREST', b'RDF4JREST - a.k.a Sesame'), (b'LDP', b'LDP: Linked Data Platform'), (b'GIT', b'GIT'), (b'SHACLAPI', b'SHACL service'), (b'SPARQL', b'SPARQL endpoint')], help_text=b'Choose the API type of service', max_length=16)),
+                ('service_url', models.CharField(help_text=b'Parameterised service url - {var} where var is an attribute of the object type being mapped (including django nested attributes using a__b syntax) or $model for the short model name', max_length=1000, verbose_name=b'service url template')),
+                ('resource', models.CharField(help_text=b'Parameterised path to target resource - using the target service API syntax', max_length=1000, verbose_name=b'resource path')),
+                ('concurrency', models.PositiveSmallIntegerField(default=1, help_text=b'Maximum number of requests sent to the service at the same time during bulk operations such as sync_remote', verbose_name=b'concurrent requests')),
+                ('object_filter', models.TextField(blank=True, help_text=b'A (python dict) filter on the objects that this binding applies to', max_length=2000, null=True, verbose_name=b'filter expression')),
+                ('next_service', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='rdf_io.ServiceBinding', verbose_name=b'Next service')),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='objectmapping',
+            name='obj_type',
+            field=models.ManyToManyField(help_text='set this to generate a object rdf:type X statement', to='rdf_io.ObjectType'),
+        ),
+        migrations.AddField(
+            model_name='servicebinding',
+            name='object_mapping',
+            field=models.ManyToManyField(to='rdf_io.ObjectMapping', verbose_name=b'Object mappings service applies to'),
+        ),
+        migrations.AddField(
+            model_name='servicebinding',
+            name='on_delete_service',
+            field=models.ForeignKey(blank=True, help_text=b'This will be invoked on object deletion if specified, and also if the binding is "replace" - which allows for a specific pre-deletion step if not supported by the repository API natively', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='on_delete', to='rdf_io.ServiceBinding', verbose_name=b'Deletion service'),
+        ),
+        migrations.AddField(
+            model_name='servicebinding',
+            name='on_fail_service',
+            field=models.ForeignKey(blank=True, help_text=b'Overrides default failure reporting', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='on_fail', to='rdf_io.ServiceBinding', verbose_name=b'On fail service'),
+        ),
+        migrations.AddField(
+            model_name='importedresource',
+            name='target_repo',
+            field=models.ForeignKey(blank=True, help_text=b'choose binding to optional RDF repository', null=True, on_delete=django.db.models.deletion.CASCADE, to='rdf_io.ServiceBinding'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:13
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('rdf_io', '0004_servicebinding_concurrency'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PublishOutbox',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.CharField(max_length=255)),
+                ('version', models.PositiveIntegerField(default=1, help_text=b'incremented each time the object is saved while waiting')),
+                ('queued_at', models.DateTimeField(auto_now_add=True)),
+                ('next_attempt', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+            ],
+            options={
+                'verbose_name_plural': 'publish outbox',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='publishoutbox',
+            unique_together=set([('content_type', 'object_id')]),
+        ),
+    ]
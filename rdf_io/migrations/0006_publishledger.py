@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:14
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('rdf_io', '0005_publishoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PublishLedger',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.CharField(max_length=255)),
+                ('graph_hash', models.CharField(help_text=b'SHA1 of the sorted N-Triples of the published graph', max_length=40)),
+                ('published_at', models.DateTimeField(help_text=b'when the published graph was built')),
+                ('status', models.PositiveSmallIntegerField(blank=True, help_text=b'HTTP status returned by the store', null=True)),
+                ('binding', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='rdf_io.ServiceBinding')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='publishledger',
+            unique_together=set([('content_type', 'object_id', 'binding')]),
+        ),
+    ]
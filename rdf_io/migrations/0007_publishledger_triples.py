@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:16
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rdf_io', '0006_publishledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='publishledger',
+            name='triples',
+            field=models.TextField(blank=True, help_text=b'the published N-Triples - only kept for SPARQL bindings, which send the difference'),
+        ),
+    ]
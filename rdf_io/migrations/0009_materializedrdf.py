@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 17:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('rdf_io', '0008_synccheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaterializedRDF',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.CharField(max_length=255)),
+                ('format', models.CharField(max_length=20)),
+                ('content', models.TextField()),
+                ('etag', models.CharField(max_length=34)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('stale', models.BooleanField(db_index=True, default=False, help_text=b'a mapping has changed since this was rendered')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+            ],
+            options={
+                'verbose_name_plural': 'materialized RDF',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='materializedrdf',
+            unique_together=set([('content_type', 'object_id', 'format')]),
+        ),
+    ]
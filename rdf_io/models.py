@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 from django.utils.translation import ugettext_lazy as _
 # for django 1.7 +
@@ -8,26 +9,35 @@ from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator, URLValidator
-try:
-    from django.db.models.fields.related import ReverseSingleRelatedObjectDescriptor
-except:
-    from django.db.models.fields.related_descriptors import ForwardManyToOneDescriptor as ReverseSingleRelatedObjectDescriptor
 
 import requests
-import itertools
 import os
 import rdflib
+import time
+import urllib
+import urlparse
+
+import logging
+logger = logging.getLogger(__name__)
+
+from rdf_io.utils import LRUCache
+from rdf_io.namespaces import registry
+from rdf_io.bindings import binding_index, compile_object_filter
+from rdf_io.relations import relation_index
+from rdf_io.metrics import metrics, enabled as metrics_enabled
 
 from string import Formatter
 
 
 # helpers
 def getattr_path(obj,path) :
+    """
+        get the list of values at the end of a path expression - see compile_path for syntax
+    """
     try :
-        return _getattr_related(obj,obj, path.replace('__','.').replace("/",".").split('.'))
+        return compile_path(path).evaluate(obj)
         
     except ValueError as e:
-        import traceback
 #        import pdb; pdb.set_trace()
         raise ValueError("Failed to map '{}' on '{}' (cause {})".format(path, obj, e))
  
@@ -41,39 +51,31 @@ def dequote(s):
         return s[1:-1]
     return s
     
-def _apply_filter(val, filter,localobj, rootobj) :
+def parse_pathfilter(filter_expr):
     """
-        Apply a simple filter to a specific property, with a list of possible values
+        parse a filter expression  path1=a,b AND path2!=c,d  into a list of (path, negate, values) clauses
     """
-    for targetval in filter.replace(" OR ",",").split(",") :
-        tval = dequote(targetval)
-        if tval.startswith('^') :
-            tval = getattr(rootobj,tval[1:])
-        elif tval.startswith('.') :
-            tval = getattr(localobj,tval[1:])
-        if tval == 'None' :
-            return bool(val)
-        elif tval == 'NotNone' :
-            return not bool(val)
-        elif val == tval :
-            return True
-    return False
+    clauses = []
+    for clause in filter_expr.split(" AND "):
+        (path,vallist) = clause.split("=",1)
+        if path[-1:] == '!' :
+            negate = True
+            path = path[0:-1]
+        else:
+            negate = False
+        clauses.append( (path, negate, vallist.split(",")) )
+    return clauses
 
 def apply_pathfilter(obj, filter_expr ):
     """
         apply a filter based on a list of path expressions  path1=a,b AND path2=c,db
+        
+        filter_expr may be the raw expression or the clauses already parsed by parse_pathfilter
     """
-    and_clauses = filter_expr.split(" AND ")
+    if isinstance(filter_expr, basestring) :
+        filter_expr = parse_pathfilter(filter_expr)
     
-    for clause in and_clauses:
-
-        (path,vallist) = clause.split("=")
-        if path[:-1] == '!' :
-            negate = True
-            path = path[0:-1]
-        else:
-            negate = False
-        or_vals = vallist.split(",")
+    for (path,negate,or_vals) in filter_expr:
         # if multiple values - only one needs to match
         matched = False
         for val in getattr_path(obj,path):
@@ -96,163 +98,268 @@ def apply_pathfilter(obj, filter_expr ):
             
     return True
     
-def _getattr_related(rootobj,obj, fields):
+class _PathStep(object):
     """
-        get an attribute - if multi-valued will be a list object!
-        fields may include filters.  
-    """
-    # print obj, fields
-    if not len(fields):
-        return [obj]
+        one element of a compiled path:  field(relprop)[filter]@lang^^type
         
-    field = fields.pop(0)
-    filter = None
-    # try to get - then check for django 1.7+ manager for related field
-    try:
+        lang and datatype are either literal values or compiled sub paths - a sub path consumes the rest of the path
+    """
+    __slots__ = ('field', 'relprop', 'valfilter', 'relfilter', 'lang', 'lang_path', 'datatype', 'datatype_path', 'cache_attr')
+    
+    def __init__(self, tokens):
+        field = tokens[0]
+        self.lang = self.lang_path = self.datatype = self.datatype_path = None
         # check for lang 
-        try:
+        if field.count('@') == 1 :
             (field,langfield) = field.split('@')
-            if langfield[0] in ["'" , '"'] :
-                lang = langfield[1:-1]
-            else:
-                lang = _getattr_related(rootobj,obj, [langfield,] + fields).pop(0)
-                fields = []
-        except:
-            lang = None
+            if langfield[:1] in ["'" , '"'] :
+                self.lang = langfield[1:-1]
+            elif langfield :
+                self.lang_path = _compile_steps([langfield,] + tokens[1:])
         # check for datatype ^^type
-        try:
+        if field.count('^^') == 1 :
             (field,typefield) = field.split('^^')
-            if typefield[0] in ["'" , '"'] :
-                typeuri = typefield[1:-1]
-            else:
-                try:
-                    typeuri = _getattr_related(rootobj,obj, [typefield,] + fields).pop(0)
-                except Exception as e :
-                    raise ValueError("error accessing data type field '{}' in field '{}' : {}".format(typefield, field, e) )
-                #have reached end of chain and have used up field list after we hit ^^
-                fields = []
-        except:
-            typeuri = None
-        # check for filt
+            if typefield[:1] in ["'" , '"'] :
+                self.datatype = typefield[1:-1]
+            elif typefield :
+                self.datatype_path = _compile_steps([typefield,] + tokens[1:])
         # check for filter 
+        filter = None
         if "[" in field :
             filter = field[ field.index("[") +1 : -1 ]
             field = field[0:field.index("[")]
-        
-        val = getattr(obj, field)
-        if not val :
-            return []
-        # import pdb; pdb.set_trace()
-        try:
-            # slice the list for fields[:] to force a copy so each iteration starts from top of list in spite of pop()
-            return itertools.chain(*(_getattr_related(rootobj,xx, fields[:]) for xx in val.all()))
-        except Exception as e:
-            pass
-        if filter and not _apply_filter(val, filter, obj, rootobj) :
-            return []
-        if lang:
-            val = "@".join((val,lang))
-        elif typeuri :
-            val = "^^".join((val,typeuri))
-    except AttributeError:
+        self.field = field
+        # a related model expression  model(property)
+        if field.endswith(")") and "(" in field :
+            (self.field, self.relprop) = str(field[0:-1]).split("(",1)
+        else:
+            self.relprop = None
+        self.valfilter = _compile_valfilter(filter) if filter else None
+        self.relfilter = _compile_relfilter(filter) if filter else None
+        # attribute a bulk query may prefetch related objects for this element into - see rdf_io.plans
+        self.cache_attr = "_rdfio_%x" % (hash((self.field, self.relprop, filter)) & 0xffffffff)
 
-        # import pdb; pdb.set_trace()
-        filters=_makefilters(filter, obj, rootobj)
-        relobjs = _get_relobjs(obj,field,filters)
+    def static_filters(self):
+        """ the related object filter as django lookups, or None if it depends on the object being serialised """
+        filters = {}
+        for (fc,kind,fval) in self.relfilter or () :
+            if kind :
+                return None
+            filters[fc] = fval
+        return filters
 
-        # will still throw an exception if val is not set!     
-    try:
-        # slice the list fo fields[:] to force a copy so each iteration starts from top of list in spite of pop()
-        return itertools.chain(*(_getattr_related(rootobj,xx, fields[:]) for xx in relobjs.all()))
-#        !list(itertools.chain(*([[1],[2]])))
-    except:
-        return _getattr_related(obj,val, fields)
 
-def _get_relobjs(obj,field,filters):
-    """Find related objects that match
-    
-    Could be linked using a "related_name" or as <type>_set
-    
-    django versions have changed this around so somewhat tricky..
+class CompiledPath(object):
     """
-    # then try to find objects of this type with a foreign key property using either (name) supplied or target object type
-    
-    if field.endswith(")") :
-        (field, relprop ) = str(field[0:-1]).split("(")
-    else :
-        relprop = None
-                   
-    try:
-        reltype = ContentType.objects.get(model=field)
-    except ContentType.DoesNotExist as e :
-        raise ValueError("Could not locate attribute or related model '{}' in element '{}'".format(field, type(obj)) )
+        A path expression parsed once into a chain of _PathSteps - evaluation only walks attributes and querysets
+    """
+    def __init__(self, path):
+        self.path = path
+        self.steps = _compile_steps(_split_path(path))
+        
+    def evaluate(self, obj):
+        """ returns the list of values found by following the path from obj """
+        return _eval_steps(obj, obj, self.steps, 0)
 
-    # if no related_name set in related model then only one candidate and djanog creates X_set attribute we can use
-    try:
-        return get_attr(obj, "".join((field,"_set"))).filter(**filters)
-    except:
-        pass
-    
-    # trickier then - need to look at models of the named type
-    claz = reltype.model_class()
-    for prop,val in claz.__dict__.items() :
-        # skip related property names if set   
-        if relprop and prop != relprop :
-            continue
-        if relprop or type(val) is ReverseSingleRelatedObjectDescriptor and val.field.related.model == type(obj) :
-            filters.update({prop:obj})
-            return claz.objects.filter(**filters)        
+_compiled_paths = LRUCache(getattr(settings, 'RDF_IO_PATH_CACHE_SIZE', 2048))
+
+def compile_path(path):
+    """
+        get the (cached) CompiledPath for a path expression
         
-def _makefilters(filter, obj, rootobj):
-    """Makes a django filter syntax from provided filter
-    
-    allow for filter clauses with references relative to the object being serialised, the root of the path being encoded or the element in the path specifying the filter""" 
-    if not filter :
-        return {}
-    filterclauses = dict( [fc.split("=") for fc in filter.replace(" AND ",",").split(",")])
-    extrafilterclauses = {}
-    for fc in filterclauses :
-        fval = filterclauses[fc]
+        path = element([./]element)*  where element = (property|model(property))([filter])?(@lang)?(^^type)?  and __ is the same as .
+    """
+    compiled = _compiled_paths.get(path)
+    if compiled is None :
+        compiled = CompiledPath(path)
+        _compiled_paths.set(path, compiled)
+    return compiled
+
+def _split_path(path):
+    """ split a path into elements on . / or __ - but not inside [filter] clauses or quoted literals """
+    tokens = []
+    start = 0
+    depth = 0
+    quote = None
+    i = 0
+    while i < len(path) :
+        c = path[i]
+        if quote :
+            if c == quote :
+                quote = None
+        elif c in '\'"' :
+            quote = c
+        elif c == '[' :
+            depth += 1
+        elif c == ']' :
+            depth -= 1
+        elif depth == 0 and (c in './' or path.startswith('__', i)) :
+            tokens.append(path[start:i])
+            if c == '_' :
+                i += 1
+            start = i + 1
+        i += 1
+    tokens.append(path[start:])
+    return tokens
+
+def _compile_steps(tokens):
+    return tuple( _PathStep(tokens[i:]) for i in range(len(tokens)) )
+
+def _compile_valfilter(filter):
+    """ a simple filter on a property value - a list of possible values, of the form ('^'|'.'|'', value) """
+    clauses = []
+    for targetval in filter.replace(" OR ",",").split(",") :
+        tval = dequote(targetval)
+        if tval.startswith(('^','.')) :
+            clauses.append( (tval[0], tval[1:]) )
+        else:
+            clauses.append( ('', tval) )
+    return clauses
+
+def _compile_relfilter(filter):
+    """ a django filter on related objects - a list of (lookup, kind, value) """
+    clauses = []
+    for fc in filter.replace(" AND ",",").split(",") :
+        try:
+            (fc,fval) = fc.split("=",1)
+        except ValueError:
+            # a simple value list - only usable as a filter on property values
+            return None
+        # allow django lookups to be written as paths too
+        fc = fc.replace(".","__").replace("/","__")
         if not fval :                            
-            extrafilterclauses[ "".join((fc,"__isnull"))] = False
+            clauses.append( ("".join((fc,"__isnull")), None, False) )
         elif fval == 'None' :                            
-            extrafilterclauses[ "".join((fc,"__isnull"))] = True
+            clauses.append( ("".join((fc,"__isnull")), None, True) )
         elif fval.startswith('^'): # property value via path from root object being serialised
-            try:
-                objvals = getattr_path(rootobj,fval[1:])
-                if len(objvals) == 0 :
-                    return [] # non null match against null source fails
-                extrafilterclauses[fc] = objvals.pop()
-            except Exception as e:
-                raise ValueError ("Error in filter clause %s on field %s " % (fc,prop))
-            
+            clauses.append( (fc, '^', fval[1:]) )
         elif fval.startswith('.'): # property value via path from current path object
-            try:
-                objvals = getattr_path(obj,fval[1:])
-                if len(objvals) == 0 :
-                    return [] # non null match against null source fails
-                extrafilterclauses[fc] = objvals.pop()
-            except Exception as e:
-                raise ValueError ("Error in filter clause %s on field %s " % (fc,prop))
+            clauses.append( (fc, '.', fval[1:]) )
         elif fval.startswith(("'", '"', '<')) :
-            extrafilterclauses[fc] = dequote(fval)
-        elif not filterclauses[fc].isnumeric() :
+            clauses.append( (fc, None, dequote(fval)) )
+        elif not fval.isdigit() :
             # look for a value
-            extrafilterclauses[fc] = getattr(obj, fval)
+            clauses.append( (fc, 'attr', fval) )
         else:
-            extrafilterclauses[fc] = fval
-       
-    return extrafilterclauses
-   
-def expand_curie(value):
+            clauses.append( (fc, None, fval) )
+    return clauses
+
+def _apply_filter(val, valfilter, localobj, rootobj) :
+    """
+        Apply a simple filter to a specific property, with a list of possible values
+    """
+    for (ref,tval) in valfilter :
+        if ref == '^' :
+            tval = getattr(rootobj,tval)
+        elif ref == '.' :
+            tval = getattr(localobj,tval)
+        if tval == 'None' :
+            return bool(val)
+        elif tval == 'NotNone' :
+            return not bool(val)
+        elif val == tval :
+            return True
+    return False
+
+def _makefilters(relfilter, obj, rootobj):
+    """Makes a django filter syntax from a compiled filter
+    
+    allow for filter clauses with references relative to the object being serialised, the root of the path being encoded or the element in the path specifying the filter
+    
+    returns None if the filter can never match (a reference to a null value)""" 
+    filters = {}
+    for (fc,kind,fval) in relfilter or () :
+        if kind in ('^','.') :
+            try:
+                objvals = getattr_path(rootobj if kind == '^' else obj, fval)
+            except Exception as e:
+                raise ValueError ("Error in filter clause %s on field %s " % (fc,fval))
+            if len(objvals) == 0 :
+                return None # non null match against null source fails
+            filters[fc] = objvals[-1]
+        elif kind == 'attr' :
+            filters[fc] = getattr(obj, fval)
+        else:
+            filters[fc] = fval
+    return filters
+
+def _first_value(rootobj, obj, steps):
+    """ the first value of a sub path, or None if it cant be evaluated """
     try:
-        parts = value.split(":")
-        if len(parts) == 2 :
-            ns = Namespace.objects.get(prefix=parts[0])
-            return "".join((ns.uri,parts[1]))
-    except:
-        pass
-    return value
+        return _eval_steps(rootobj, obj, steps, 0)[0]
+    except Exception :
+        return None
+
+def _eval_steps(rootobj, obj, steps, i):
+    """
+        get an attribute - if multi-valued will be a list of all values
+        rootobj is the object being serialised, obj the current element of the path
+    """
+    if i == len(steps) :
+        return [obj]
+    step = steps[i]
+    lang = step.lang
+    typeuri = step.datatype
+    # lang or datatype taken from another attribute use up the rest of the path
+    consumed = False
+    if step.lang_path :
+        lang = _first_value(rootobj, obj, step.lang_path)
+        consumed = lang is not None
+    if step.datatype_path :
+        typeuri = _first_value(rootobj, obj, step.datatype_path)
+        consumed = consumed or typeuri is not None
+    try:
+        val = getattr(obj, step.field)
+    except AttributeError:
+        # not an attribute - look for related objects of the named model type
+        relobjs = getattr(obj, step.cache_attr, None)
+        if relobjs is not None :
+            # already fetched in bulk
+            return [ v for relobj in relobjs for v in _eval_steps(rootobj, relobj, steps, i+1) ]
+        filters = _makefilters(step.relfilter, obj, rootobj)
+        if filters is None :
+            return []
+        relobjs = _get_relobjs(obj, step.field, step.relprop, filters)
+        if relobjs is None :
+            raise ValueError("Could not locate attribute or related model '{}' in element '{}'".format(step.field, type(obj)) )
+        return [ v for relobj in relobjs.all() for v in _eval_steps(rootobj, relobj, steps, i+1) ]
+    
+    if not val :
+        return []
+    # check for django 1.7+ manager for related field
+    if hasattr(val, 'all') and callable(val.all) :
+        return [ v for relobj in val.all() for v in _eval_steps(rootobj, relobj, steps, i+1) ]
+    if step.valfilter and not _apply_filter(val, step.valfilter, obj, rootobj) :
+        return []
+    if lang:
+        val = "@".join((val,lang))
+    elif typeuri :
+        val = "^^".join((val,typeuri))
+    if consumed :
+        return [val]
+    return _eval_steps(rootobj, val, steps, i+1)
+
+def _get_relobjs(obj,model,relprop,filters):
+    """Find related objects that match
+    
+    objects of the named model type that refer to obj - through relprop if given, otherwise through the foreign key
+    behind the default <type>_set accessor or their first foreign key to obj's model (see rdf_io.relations)
+    """
+    relation = relation_index.get(type(obj)._meta.concrete_model, model, relprop)
+    if relation is not None :
+        filters[relation.field_name] = obj
+        return relation.model._default_manager.filter(**filters)
+    candidates = relation_index.models(model)
+    if not candidates :
+        raise ValueError("Could not locate attribute or related model '{}' in element '{}'".format(model, type(obj)) )
+    if relprop :
+        # not a relation to obj's model - but the property may still be comparable with it
+        filters[relprop] = obj
+        return candidates[0]._default_manager.filter(**filters)
+    return None
+        
+def expand_curie(value):
+    return registry.expand_curie(value)
     
 def validate_urisyntax(value):
 
@@ -262,7 +369,8 @@ def validate_urisyntax(value):
         parts = value.split(":")
         if len(parts) != 2 :
             raise ValidationError('invalid syntax')
-        ns = Namespace.objects.get(prefix=parts[0])
+        if registry.expand(parts[0]) is None :
+            raise ValidationError('namespace prefix %s is not registered' % parts[0])
 
 class RDFConfigNotFoundException(Exception):
     """ Cannot find a RDF publish configuration matching object """
@@ -273,74 +381,397 @@ class RDFConfigException(Exception):
     pass
 
 class RDFStoreException(Exception):
-    """ RDF store response exception """
-    pass
+    """ RDF store response exception - status_code is the HTTP status of the response, if there was one """
+    def __init__(self, message, status_code=None):
+        super(RDFStoreException, self).__init__(message)
+        self.status_code = status_code
     
 def push_to_store(binding,  model, obj, gr ):
     """ push an object via its serialisation rules to a store via a ServiceBinding """
     if not binding:
-        try:
+        binding = _persist_binding(model, obj)
+    if binding.service_api != ServiceBinding.SPARQL or obj.pk is None :
+        return prepare_push(binding, model, obj, gr).send()
+    # SPARQL updates are the difference from what was last published, so that has to be kept up to date
+    from rdf_io import ledger
+    ct = ContentType.objects.get_for_model(obj)
+    last = ledger.lookup(binding, ct, [obj.pk], with_triples=True).get(str(obj.pk))
+    built = timezone.now()
+    push = prepare_push(binding, model, obj, gr, previous=last.triples.splitlines() if last else None)
+    result = push.send()
+    ledger.record(binding, ct, [ (obj.pk, ledger.graph_hash(gr), built, getattr(result, 'status_code', None), push.ledger_triples()) ])
+    return result
 
-            binding = ServiceBinding.get_service_binding(model,(ServiceBinding.PERSIST_CREATE,ServiceBinding.PERSIST_UPDATE,ServiceBinding.PERSIST_REPLACE))
-        except:
-            raise  RDFConfigNotFoundException("Cant locate appropriate repository configuration"  )
+push_to_store.RDFConfigException = RDFConfigException
+push_to_store.RDFConfigNotFoundException = RDFConfigNotFoundException
+push_to_store.RDFStoreException = RDFStoreException
+
+def _persist_binding(model, obj=None):
+    binding = ServiceBinding.get_service_binding(model,(ServiceBinding.PERSIST_CREATE,ServiceBinding.PERSIST_UPDATE,ServiceBinding.PERSIST_REPLACE), obj)
+    if not binding :
+        raise  RDFConfigNotFoundException("Cant locate appropriate repository configuration"  )
+    return binding
+
+def prepare_push(binding,  model, obj, gr, previous=None ):
+    """ 
+        resolve the target resource and serialise the graph for an object - everything that needs the object or the database -
+        returning a StorePush that can be sent later, from any thread
+
+        previous is the list of N-Triples last published for the object (see rdf_io.ledger), used by SPARQL bindings
+        to send only what has changed
+    """
+    if not binding:
+        binding = _persist_binding(model, obj)
+    if binding.service_api not in _PUSH_APIS :
+        raise RDFConfigException("Unknown server API %s" % binding.service_api  )
+    (resttgt, headers, auth) = resolve_target(binding, model, obj)
+    return StorePush(binding, resttgt, gr, headers, auth, previous)
+
+def resolve_target(binding, model, obj):
+    """ the (url, headers, auth) of the resource a binding's templates give for an object """
     rdfstore = { 'server_api' : binding.service_api , 'server' : binding.service_url , 'target' : binding.resource }
  
     resttgt = _resolveTemplate("".join( ( rdfstore['server'],rdfstore['target'])), model, obj )   
 
-    if binding.service_api == "RDF4JREST" :
-        return _rdf4j_push(rdfstore, resttgt, model, obj, gr )
-    elif binding.service_api == "LDP" :
-        return _ldp_push(rdfstore, resttgt, model, obj, gr )
-    else:
-        raise RDFConfigException("Unknown server API %s" % binding.service_api  )
-
-push_to_store.RDFConfigException = RDFConfigException
-push_to_store.RDFConfigNotFoundException = RDFConfigNotFoundException
-push_to_store.RDFStoreException = RDFStoreException
-        
-def _ldp_push(rdfstore, resttgt, model, obj, gr ):
-    etag = _get_etag(resttgt)
-    headers = {'Content-Type': 'text/turtle'} 
-    if etag :
-        headers['If-Match'] = etag
-       
+    headers = {}
     for h in rdfstore.get('headers') or [] :
         headers[h] = _resolveTemplate( rdfstore['headers'][h], model, obj )
     
-    result = requests.put( resttgt, headers=headers , data=gr.serialize(format="turtle"), auth=rdfstore.get('auth'))
-    #logger.info ( "Updating resource {} {}".format(resttgt,result.status_code) )
+    return (resttgt, headers, rdfstore.get('auth'))
+
+class StorePush(object):
+    """ a graph ready to be sent to the resource in the store a ServiceBinding points to """
+    def __init__(self, binding, url, gr, headers=None, auth=None, previous=None):
+        self.binding = binding
+        self.url = url
+        self.graph = gr
+        self.headers = headers or {}
+        self.auth = auth
+        self.previous = previous
+        self._data = None
+        self._triples = None
+
+    @property
+    def data(self):
+        """ the graph serialised as turtle - or for SPARQL bindings the update from the previous graph to this one """
+        if self._data is None :
+            started = time.time()
+            if self.binding.service_api == ServiceBinding.SPARQL :
+                (format, self._data) = ('sparql-update', _sparql_update(self))
+            else:
+                (format, self._data) = ('turtle', self.graph.serialize(format="turtle"))
+            if metrics_enabled() :
+                metrics.serialized(format, time.time() - started, len(self._data))
+        return self._data
+
+    @property
+    def triples(self):
+        """ the graph as sorted N-Triples lines, with blank nodes skolemized """
+        if self._triples is None :
+            self._triples = skolem_triples(self.graph)
+        return self._triples
+
+    def ledger_triples(self):
+        """ the triples to keep in the publish ledger - only needed to compute the next SPARQL update """
+        if self.binding.service_api == ServiceBinding.SPARQL :
+            return "\n".join(self.triples)
+        return ''
+
+    def send(self):
+        """ send to the store - returns the response or raises RDFStoreException """
+        if not metrics_enabled() :
+            return _PUSH_APIS[self.binding.service_api](self)
+        size = len(self.data)
+        started = time.time()
+        try:
+            result = _PUSH_APIS[self.binding.service_api](self)
+        except Exception as e:
+            metrics.request(self.binding, time.time() - started, size, getattr(e, 'status_code', None), error=True)
+            raise
+        if result is not None :
+            metrics.request(self.binding, time.time() - started, size, result.status_code)
+        return result
+
+def graph_nquads(gr, context):
+    """ serialise a graph as N-Quads with every statement in the named graph context (a URI string) """
+    ctx = rdflib.URIRef(context).n3()
+    return "".join( "".join((line.rstrip()[:-1], ctx, " .\n")) for line in gr.serialize(format='nt').splitlines() if line.strip() )
+
+def push_batch(pushes):
+    """
+        send a list of StorePushes, combining those that can be into a single request per target
+
+        Pushes to RDF4J named graphs (a statements?context=<uri> target) are sent as one transaction per repository that
+        replaces every graph in the batch. Anything else - or a batch the store rejects - is sent one push at a time,
+        so a failure is reported against the push that caused it.
+
+        returns a list of (response, exception) in the same order as pushes
+    """
+    outcomes = [None] * len(pushes)
+    groups = {}
+    for (i,push) in enumerate(pushes) :
+        target = _rdf4j_context(push) if push.binding.service_api == ServiceBinding.RDF4JREST else None
+        if target :
+            groups.setdefault(target[0], []).append( (i, target[1]) )
+        else:
+            outcomes[i] = _send_one(push)
+    for (repository,members) in groups.items() :
+        if len(members) > 1 :
+            try:
+                result = _rdf4j_transaction(repository, [ (pushes[i], context) for (i,context) in members ])
+                for (i,context) in members :
+                    outcomes[i] = (result, None)
+                continue
+            except Exception as e:
+                logger.warning("RDF4J batch transaction to %s failed, sending individually : %s" % (repository, e))
+        for (i,context) in members :
+            outcomes[i] = _send_one(pushes[i])
+    return outcomes
+
+def _send_one(push):
+    try:
+        return (push.send(), None)
+    except Exception as e:
+        return (None, e)
+
+def _rdf4j_context(push):
+    """ (repository url, context uri) if a push replaces a single named graph through the RDF4J statements API, else None """
+    (scheme, netloc, path, query, fragment) = urlparse.urlsplit(push.url)
+    params = urlparse.parse_qs(query)
+    if not path.endswith('/statements') or push.headers or params.keys() != ['context'] or len(params['context']) != 1 :
+        return None
+    context = params['context'][0]
+    if not (context.startswith('<') and context.endswith('>')) :
+        return None
+    return ( urlparse.urlunsplit((scheme, netloc, path[:-len('/statements')], '', '')), context[1:-1] )
+
+def _rdf4j_transaction(repository, members):
+    """ replace a set of named graphs in one RDF4J transaction - members is a list of (StorePush, context) """
+    data = "".join( graph_nquads(push.graph, context) for (push,context) in members )
+    if not metrics_enabled() :
+        return _rdf4j_transaction_requests(repository, members, data)
+    binding = members[0][0].binding
+    started = time.time()
+    try:
+        result = _rdf4j_transaction_requests(repository, members, data)
+    except Exception as e:
+        metrics.request(binding, time.time() - started, len(data), getattr(e, 'status_code', None), objects=len(members), error=True)
+        raise
+    metrics.request(binding, time.time() - started, len(data), result.status_code, objects=len(members))
+    return result
+
+def _rdf4j_transaction_requests(repository, members, data):
+    auth = members[0][0].auth
+    result = requests.post( repository + '/transactions', auth=auth)
+    if result.status_code != 201 :
+        raise RDFStoreException("Could not start transaction on {} {}".format(repository, result.status_code), result.status_code)
+    txn = result.headers['Location']
+    try:
+        update = "; ".join( "CLEAR SILENT GRAPH <%s>" % context for (push,context) in members )
+        # as the request body - servlet containers dont parse form parameters on a PUT, so the update could arrive empty
+        result = requests.put( txn, params={'action' : 'UPDATE'}, data=update.encode('utf-8'),
+            headers={'Content-Type' : 'application/sparql-update; charset=UTF-8'}, auth=auth)
+        if result.status_code >= 400 :
+            raise RDFStoreException("Failed to clear graphs in transaction {} {}".format(txn, result.status_code), result.status_code)
+        result = requests.put( txn, params={'action' : 'ADD'}, data=data, headers={'Content-Type' : 'application/n-quads'}, auth=auth)
+        if result.status_code >= 400 :
+            raise RDFStoreException("Failed to add statements in transaction {} {}".format(txn, result.status_code), result.status_code)
+        result = requests.put( txn, params={'action' : 'COMMIT'}, auth=auth)
+        if result.status_code >= 400 :
+            raise RDFStoreException("Failed to commit transaction {} {}".format(txn, result.status_code), result.status_code)
+        return result
+    except Exception :
+        try:
+            requests.delete(txn, auth=auth)
+        except Exception :
+            pass
+        raise
+        
+def _ldp_push(push):
+    etag = _get_etag(push.url)
+    result = _ldp_put(push, etag)
+    if result.status_code == 412 :
+        # changed since we last saw it - get the current ETag and try once more
+        result = _ldp_put(push, _get_etag(push.url, refresh=True))
+    #logger.info ( "Updating resource {} {}".format(push.url,result.status_code) )
     if result.status_code > 400 :
 #         print "Posting new resource"
-#         result = requests.post( resttgt, headers=headers , data=gr.serialize(format="turtle"))
-#        logger.error ( "Failed to publish resource {} {}".format(resttgt,result.status_code) )
-        raise RDFStoreException("Failed to publish resource {} {} : {} ".format(resttgt,result.status_code, result.content) )
+#         result = requests.post( push.url, headers=headers , data=push.data)
+#        logger.error ( "Failed to publish resource {} {}".format(push.url,result.status_code) )
+        _etags.discard(push.url)
+        raise RDFStoreException("Failed to publish resource {} {} : {} ".format(push.url,result.status_code, result.content), result.status_code)
+    _remember_etag(push.url, result)
     return result 
 
-def _get_etag(uri):
+def _ldp_put(push, etag):
+    headers = {'Content-Type': 'text/turtle'} 
+    if etag :
+        headers['If-Match'] = etag
+    headers.update(push.headers)
+    return requests.put( push.url, headers=headers , data=push.data, auth=push.auth)
+
+# ETags of LDP resources by URL, as last returned by the store - None if the resource had none
+_etags = LRUCache(getattr(settings, 'RDF_IO_ETAG_CACHE_SIZE', 4096))
+_NOT_CACHED = object()
+
+def _remember_etag(uri, result):
+    """ keep the ETag from a HEAD, GET or PUT response for the next update of the resource """
+    etag = result.headers.get('ETag')
+    if etag or (result.request.method == 'HEAD' and result.status_code < 500) :
+        _etags.set(uri, etag)
+    else:
+        # a PUT that doesnt report the new ETag leaves us not knowing it
+        _etags.discard(uri)
+
+def _get_etag(uri, refresh=False):
     """
-        Gets the LDP Etag for a resource if it exists
+        Gets the LDP Etag for a resource if it exists - from the cache unless refresh is set, otherwise with a HEAD request
     """
-    # could put in cache here - but for now just issue a HEAD
+    if not refresh :
+        etag = _etags.get(uri, _NOT_CACHED)
+        if etag is not _NOT_CACHED :
+            return etag
     result = requests.head(uri)
+    _remember_etag(uri, result)
     return result.headers.get('ETag')
         
-def _rdf4j_push(rdfstore, resttgt, model, obj, gr ):
+def _rdf4j_push(push):
     #import pdb; pdb.set_trace()
     headers = {'Content-Type': 'application/x-turtle;charset=UTF-8'} 
-  
-    for h in rdfstore.get('headers') or [] :
-        headers[h] = _resolveTemplate( rdfstore['headers'][h], model, obj )
+    headers.update(push.headers)
     
-    result = requests.put( resttgt, headers=headers , data=gr.serialize(format="turtle"))
-#    logger.info ( "Updating resource {} {}".format(resttgt,result.status_code) )
+    result = requests.put( push.url, headers=headers , data=push.data, auth=push.auth)
+#    logger.info ( "Updating resource {} {}".format(push.url,result.status_code) )
     if result.status_code > 400 :
 #         print "Posting new resource"
-#         result = requests.post( resttgt, headers=headers , data=gr.serialize(format="turtle"))
-#        logger.error ( "Failed to publish resource {} {}".format(resttgt,result.status_code) )
-         raise RDFStoreException ("Failed to publish resource {} {}".format(resttgt,result.status_code ) )
+#         result = requests.post( push.url, headers=headers , data=push.data)
+#        logger.error ( "Failed to publish resource {} {}".format(push.url,result.status_code) )
+         raise RDFStoreException ("Failed to publish resource {} {}".format(push.url,result.status_code ), result.status_code)
     return result 
 
+def skolem_triples(gr):
+    """
+        the sorted N-Triples lines of a graph with blank nodes replaced by skolem IRIs (RDF_IO_SKOLEM_AUTHORITY) -
+        build_rdf gives blank nodes stable ids, so the same graph always gives the same lines
+    """
+    authority = getattr(settings, 'RDF_IO_SKOLEM_AUTHORITY', None)
+    def skolemize(term):
+        if isinstance(term, rdflib.BNode) :
+            return term.skolemize(authority) if authority else term.skolemize()
+        return term
+    skolemized = rdflib.Graph()
+    for (s,p,o) in gr :
+        skolemized.add( (skolemize(s), p, skolemize(o)) )
+    return sorted( line.strip().decode('utf-8') for line in skolemized.serialize(format='nt').splitlines() if line.strip() )
+
+def _sparql_target(url):
+    """ (update endpoint, named graph uri or None) - a graph=<uri> parameter in the resolved url selects a named graph """
+    (scheme, netloc, path, query, fragment) = urlparse.urlsplit(url)
+    params = urlparse.parse_qsl(query)
+    graphs = [ v for (k,v) in params if k == 'graph' ]
+    if not graphs :
+        return (url, None)
+    endpoint = urlparse.urlunsplit((scheme, netloc, path, urllib.urlencode([ (k,v) for (k,v) in params if k != 'graph' ]), fragment))
+    return (endpoint, graphs[0].strip('<>'))
+
+def _sparql_update(push):
+    """
+        the SPARQL 1.1 Update taking the store from the previously published triples to the current ones -
+        DELETE DATA for the triples that have gone, INSERT DATA for the new ones. With nothing previously published a
+        PERSIST_REPLACE binding first removes whatever the store holds about the resources in the graph.
+    """
+    (endpoint, graph) = _sparql_target(push.url)
+    current = push.triples
+    if push.previous is None :
+        (deleted, inserted) = ([], current)
+    else:
+        previous = set(push.previous)
+        current_set = set(current)
+        deleted = [ t for t in push.previous if t not in current_set ]
+        inserted = [ t for t in current if t not in previous ]
+    def data(triples):
+        block = "\n".join(triples)
+        if graph :
+            block = "GRAPH <%s> {\n%s\n}" % (graph, block)
+        return block
+    ops = []
+    if push.previous is None and push.binding.binding_type == ServiceBinding.PERSIST_REPLACE :
+        for subject in sorted(set( s for s in push.graph.subjects() if isinstance(s, rdflib.URIRef) )) :
+            where = "%s ?p ?o" % subject.n3()
+            if graph :
+                where = "GRAPH <%s> { %s }" % (graph, where)
+            ops.append("DELETE WHERE { %s }" % where)
+    if deleted :
+        ops.append("DELETE DATA {\n%s\n}" % data(deleted))
+    if inserted :
+        ops.append("INSERT DATA {\n%s\n}" % data(inserted))
+    return " ;\n".join(ops)
+
+def _sparql_push(push):
+    update = push.data
+    if not update :
+        # nothing has changed
+        return None
+    (endpoint, graph) = _sparql_target(push.url)
+    headers = {'Content-Type': 'application/sparql-update; charset=UTF-8'}
+    headers.update(push.headers)
+    if isinstance(update, unicode) :
+        update = update.encode('utf-8')
+    result = requests.post( endpoint, headers=headers, data=update, auth=push.auth)
+    if result.status_code >= 400 :
+        raise RDFStoreException ("Failed to update resource {} {} : {}".format(push.url,result.status_code, result.content ), result.status_code)
+    return result
+
+_PUSH_APIS = { 'RDF4JREST' : _rdf4j_push, 'LDP' : _ldp_push, 'SPARQL' : _sparql_push }
+
+# rdflib format names of the documents each API will take as they are, and the Content-Type to send them with.
+# N-Triples is a subset of Turtle, so an LDP server can take it as text/turtle. SPARQL updates need the triples themselves.
+_UPLOAD_FORMATS = {
+    'RDF4JREST' : { 'turtle' : 'text/turtle', 'nt' : 'application/n-triples', 'xml' : 'application/rdf+xml',
+        'n3' : 'text/n3', 'nquads' : 'application/n-quads', 'trig' : 'application/trig', 'trix' : 'application/trix',
+        'json-ld' : 'application/ld+json' },
+    'LDP' : { 'turtle' : 'text/turtle', 'nt' : 'text/turtle', 'json-ld' : 'application/ld+json' },
+}
+
+def upload_content_type(binding, format):
+    """ the Content-Type to send a document in the rdflib format to binding without parsing it - None if it must be converted """
+    return _UPLOAD_FORMATS.get(binding.service_api, {}).get(format)
+
+def push_document(push, chunks, content_type):
+    """
+        send an RDF document to the target of a StorePush as it is - chunks is an iterable of byte strings, sent as they
+        are read (chunked transfer encoding), so the document is never held in memory or parsed.
+        returns the response or raises RDFStoreException
+    """
+    sent = [0]
+    def counted():
+        for chunk in chunks :
+            sent[0] += len(chunk)
+            yield chunk
+    headers = {'Content-Type': content_type}
+    api = push.binding.service_api
+    if api == ServiceBinding.LDP :
+        etag = _get_etag(push.url)
+        if etag :
+            headers['If-Match'] = etag
+    headers.update(push.headers)
+    started = time.time()
+    try:
+        result = requests.put( push.url, headers=headers, data=counted(), auth=push.auth)
+        if result.status_code > 400 :
+            # the stream is spent, so unlike _ldp_push there is no retry on a stale ETag
+            if api == ServiceBinding.LDP :
+                _etags.discard(push.url)
+            raise RDFStoreException("Failed to upload document to {} {} : {}".format(push.url, result.status_code, result.content), result.status_code)
+    except Exception as e:
+        if metrics_enabled() :
+            metrics.request(push.binding, time.time() - started, sent[0], getattr(e, 'status_code', None), error=True)
+        raise
+    if api == ServiceBinding.LDP :
+        _remember_etag(push.url, result)
+    if metrics_enabled() :
+        metrics.request(push.binding, time.time() - started, sent[0], result.status_code)
+    return result
     
 def _resolveTemplate(template, model, obj) :
     
@@ -525,10 +956,8 @@ class ConfigVar(models.Model):
     
     @staticmethod
     def getval(var):
-        try:
-            return ConfigVar.objects.filter(var=var).first().value
-        except:
-            return None
+        """ the value of a variable, or None if it isnt set - from the binding index, so no query """
+        return binding_index.configvar(var)
 
 class ServiceBinding(models.Model):
     """ Binds object mappings to a RDF handling service 
@@ -584,6 +1013,7 @@ class ServiceBinding(models.Model):
     object_mapping = models.ManyToManyField(ObjectMapping, verbose_name='Object mappings service applies to')
     # use_as_default = models.BooleanField(verbose_name='Use by default', help_text='Set this flag to use this by default')
 
+    concurrency=models.PositiveSmallIntegerField(default=1, verbose_name='concurrent requests', help_text='Maximum number of requests sent to the service at the same time during bulk operations such as sync_remote')
     object_filter=models.TextField(max_length=2000, verbose_name='filter expression', help_text='A (python dict) filter on the objects that this binding applies to', blank=True, null=True)
     next_service=models.ForeignKey('ServiceBinding', verbose_name='Next service', blank=True, null=True)
     on_delete_service=models.ForeignKey('ServiceBinding', related_name='on_delete',verbose_name='Deletion service', blank=True, null=True, help_text='This will be invoked on object deletion if specified, and also if the binding is "replace" - which allows for a specific pre-deletion step if not supported by the repository API natively')
@@ -591,11 +1021,17 @@ class ServiceBinding(models.Model):
 
     def __unicode__(self):
         return self.title + "(" + self.service_api + " : " + self.service_url + ")"
+
+    def clean(self):
+        try:
+            compile_object_filter(self.object_filter)
+        except Exception as e:
+            raise ValidationError({ 'object_filter' : 'invalid filter expression : %s' % e })
      
     @staticmethod 
-    def get_service_binding(model,bindingtypes):
-        ct = ContentType.objects.get(model=model)
-        return ServiceBinding.objects.filter(object_mapping__content_type=ct, binding_type__in=bindingtypes).first()
+    def get_service_binding(model,bindingtypes,obj=None):
+        """ the first binding of one of bindingtypes for a model name (and if given, whose object_filter obj matches) - see rdf_io.bindings """
+        return binding_index.get(model, bindingtypes, obj)
     
 class ImportedResource(models.Model):
     TYPE_RULE='RULE'
@@ -633,16 +1069,47 @@ class ImportedResource(models.Model):
     
     def save(self,*args,**kwargs):  
         if self.target_repo :
-            push_to_store(self.target_repo, 'ImportedResource', self, self.get_graph())
+            self.publish()
         super(ImportedResource, self).save(*args,**kwargs)
     
+    def publish(self):
+        """
+            send the resource to target_repo - streamed as it is if the store takes its format, 
+            otherwise parsed and sent as any other graph
+        """
+        content_type = upload_content_type(self.target_repo, self.get_format())
+        if content_type :
+            push = prepare_push(self.target_repo, 'ImportedResource', self, None)
+            return push_document(push, self.chunks(), content_type)
+        return push_to_store(self.target_repo, 'ImportedResource', self, self.get_graph())
+    
+    def get_format(self):
+        """ the rdflib format name of the resource, from its file extension """
+        if self.file :
+            return rdflib.util.guess_format(self.file.name)
+        elif self.remote :
+            return rdflib.util.guess_format(self.remote)
+        return None
+    
+    def chunks(self):
+        """ the content of the file, or the remote source, as a sequence of byte strings """
+        chunk_size = getattr(settings, 'RDF_IO_UPLOAD_CHUNK_SIZE', 1024 * 1024)
+        if self.file :
+            self.file.open('rb')
+            return self.file.chunks(chunk_size)
+        result = requests.get(self.remote, stream=True)
+        if result.status_code >= 400 :
+            raise RDFStoreException("Failed to read {} {}".format(self.remote, result.status_code), result.status_code)
+        return result.iter_content(chunk_size)
+    
     def get_graph(self):
         graph = rdflib.Graph()
+        format = self.get_format()
         if self.file :
-            format = rdflib.util.guess_format(self.file.name)
-            return  graph.parse(self.file.name,  format=format )
+            # not file=self.file - some rdflib parsers close the stream, and the file is still to be saved
+            self.file.open('rb')
+            return  graph.parse(data=self.file.read(),  format=format )
         elif self.remote :
-            format = rdflib.util.guess_format(self.remote)
             return  graph.parse(self.remote,  format=format )
         return None
         
@@ -653,4 +1120,82 @@ class ImportedResource(models.Model):
     
     
     
-    
\ No newline at end of file
+    
+class PublishOutbox(models.Model):
+    """
+        An object waiting to be published to its RDF store (see rdf_io.outbox).
+        There is only ever one entry per object - saving it again before it is published just bumps the version.
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.CharField(max_length=255)
+    version = models.PositiveIntegerField(default=1, help_text='incremented each time the object is saved while waiting')
+    queued_at = models.DateTimeField(auto_now_add=True)
+    next_attempt = models.DateTimeField(default=timezone.now, db_index=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        unique_together = (('content_type','object_id'),)
+        verbose_name_plural = 'publish outbox'
+
+    def __unicode__(self):
+        return "%s %s" % (self.content_type, self.object_id)
+
+class PublishLedger(models.Model):
+    """
+        What was last published for an object through a ServiceBinding - used to skip objects whose RDF hasnt changed (see rdf_io.ledger)
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.CharField(max_length=255)
+    binding = models.ForeignKey(ServiceBinding, on_delete=models.CASCADE)
+    graph_hash = models.CharField(max_length=40, help_text='SHA1 of the sorted N-Triples of the published graph')
+    published_at = models.DateTimeField(help_text='when the published graph was built')
+    status = models.PositiveSmallIntegerField(null=True, blank=True, help_text='HTTP status returned by the store')
+    triples = models.TextField(blank=True, help_text='the published N-Triples - only kept for SPARQL bindings, which send the difference')
+
+    class Meta:
+        unique_together = (('content_type','object_id','binding'),)
+
+    def __unicode__(self):
+        return "%s %s -> %s" % (self.content_type, self.object_id, self.binding)
+
+class SyncCheckpoint(models.Model):
+    """
+        How far the last sync of a model through a ServiceBinding got (see rdf_io.sync) - every object up to last_pk
+        has been published, so an interrupted sync can be resumed from there
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    binding = models.ForeignKey(ServiceBinding, on_delete=models.CASCADE)
+    last_pk = models.CharField(max_length=255, blank=True, help_text='primary key of the last object in the completed part of the sync - blank if none')
+    published = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True, help_text='blank while the sync is running or if it was interrupted')
+
+    class Meta:
+        unique_together = (('content_type','binding'),)
+
+    def __unicode__(self):
+        return "%s -> %s" % (self.content_type, self.binding)
+
+class MaterializedRDF(models.Model):
+    """
+        The serialised RDF of a mapped object in one format, kept up to date as it is saved so the to_rdf views can
+        return it without building a graph (see rdf_io.materialize)
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.CharField(max_length=255)
+    format = models.CharField(max_length=20)
+    content = models.TextField()
+    etag = models.CharField(max_length=34)
+    updated_at = models.DateTimeField(auto_now=True)
+    stale = models.BooleanField(default=False, db_index=True, help_text='a mapping has changed since this was rendered')
+
+    class Meta:
+        unique_together = (('content_type','object_id','format'),)
+        verbose_name_plural = 'materialized RDF'
+
+    def __unicode__(self):
+        return "%s %s (%s)" % (self.content_type, self.object_id, self.format)
@@ -0,0 +1,86 @@
+"""
+    Process wide registry of the Namespaces defined in rdf_io
+
+    Loaded from the database on first use and discarded whenever a Namespace is saved or deleted.
+    Provides prefix to URI expansion of CURIEs and longest match compaction of URIs back to CURIEs.
+"""
+from django.db.models import signals
+
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+# marks the end of a namespace URI in the trie
+_PREFIX = object()
+
+
+class NamespaceRegistry(object):
+    """ thread safe prefix <-> namespace URI lookups """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+
+    def _get_state(self):
+        state = self._state
+        if state is None :
+            with self._lock:
+                if self._state is None :
+                    self._state = self._load()
+                state = self._state
+        return state
+
+    def _load(self):
+        from rdf_io.models import Namespace
+        prefixes = {}
+        trie = {}
+        for (prefix,uri) in Namespace.objects.values_list('prefix','uri') :
+            prefixes[prefix] = uri
+            node = trie
+            for c in uri :
+                node = node.setdefault(c, {})
+            node[_PREFIX] = prefix
+        logger.debug("loaded %d RDF namespaces" % len(prefixes))
+        return (prefixes, trie)
+
+    def invalidate(self, **kwargs):
+        """ signal handler - reload from the database on next use """
+        with self._lock:
+            self._state = None
+
+    def prefixes(self):
+        """ a dict of prefix : namespace URI """
+        return dict(self._get_state()[0])
+
+    def expand(self, prefix):
+        """ the namespace URI for a prefix, or None if not registered """
+        return self._get_state()[0].get(prefix)
+
+    def expand_curie(self, value):
+        """ expand prefix:term to a full URI - anything that isnt a CURIE with a registered prefix is returned unchanged """
+        parts = value.split(":")
+        if len(parts) == 2 :
+            uri = self.expand(parts[0])
+            if uri is not None :
+                return "".join((uri,parts[1]))
+        return value
+
+    def compact(self, uri):
+        """ the CURIE for a URI using the longest matching registered namespace, or the URI unchanged if none match """
+        node = self._get_state()[1]
+        match = None
+        for (i,c) in enumerate(uri) :
+            node = node.get(c)
+            if node is None :
+                break
+            if _PREFIX in node :
+                match = (node[_PREFIX], i + 1)
+        if match is None :
+            return uri
+        return ":".join((match[0], uri[match[1]:]))
+
+
+registry = NamespaceRegistry()
+
+signals.post_save.connect(registry.invalidate, sender='rdf_io.Namespace', dispatch_uid='rdf_io_namespace_registry')
+signals.post_delete.connect(registry.invalidate, sender='rdf_io.Namespace', dispatch_uid='rdf_io_namespace_registry')
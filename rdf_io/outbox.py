@@ -0,0 +1,239 @@
+"""
+    Deferred publishing of saved objects through the PublishOutbox table
+
+    With settings.RDF_IO_PUBLISH_OUTBOX set, the auto-push post_save handler only records the object in the outbox -
+    in the same transaction as the save - instead of building its graph and sending it to the store while the save waits.
+    Entries are published by drain(), either from a background thread started once the saving transaction commits
+    (unless RDF_IO_OUTBOX_DISPATCH is False) or by the rdf_outbox management command, which also retries failures.
+
+    An object saved several times before it is published has a single entry, so it is only pushed once.
+    Pushes replace the resource in the store, so an object published twice by competing workers comes to no harm.
+    With RDF_IO_SERVICE_CHAINS set each object is run through its service chains (see rdf_io.chains), as when it is
+    published directly - the entries of a drain batch go through together, each stage working on several at once.
+"""
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction, connection, IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from rdf_io.models import PublishOutbox, ServiceBinding, prepare_push, push_batch
+from rdf_io.plans import get_mapping_plan
+from rdf_io.sinks import NTriplesSink
+from rdf_io.bindings import binding_index
+from rdf_io import ledger
+from rdf_io import chains
+
+from datetime import timedelta
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+PERSIST_BINDINGS = (ServiceBinding.PERSIST_CREATE,ServiceBinding.PERSIST_UPDATE,ServiceBinding.PERSIST_REPLACE)
+
+
+def enabled():
+    return getattr(settings, 'RDF_IO_PUBLISH_OUTBOX', False)
+
+def max_attempts():
+    return getattr(settings, 'RDF_IO_OUTBOX_MAX_ATTEMPTS', 10)
+
+def retry_delay(attempts):
+    """ seconds to wait before the next attempt - doubling from RDF_IO_OUTBOX_RETRY_DELAY (default 30) up to an hour """
+    return min(getattr(settings, 'RDF_IO_OUTBOX_RETRY_DELAY', 30) * 2 ** (attempts - 1), 3600)
+
+def enqueue(obj):
+    """ record that obj needs publishing - coalesced with any entry already waiting for it """
+    ct = ContentType.objects.get_for_model(obj)
+    queued = dict(version=F('version') + 1, attempts=0, next_attempt=timezone.now(), last_error='')
+    entries = PublishOutbox.objects.filter(content_type=ct, object_id=str(obj.pk))
+    if entries.update(**queued) :
+        return
+    try:
+        with transaction.atomic():
+            PublishOutbox.objects.create(content_type=ct, object_id=str(obj.pk))
+    except IntegrityError:
+        # queued by a concurrent save
+        entries.update(**queued)
+
+class DrainSummary(object):
+    def __init__(self):
+        self.published = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def __unicode__(self):
+        return "published %d, failed %d, dropped %d" % (self.published, self.failed, self.dropped)
+
+    __str__ = __unicode__
+
+def drain(limit=None, batch_size=None):
+    """
+        publish the outbox entries that are due, oldest first, until none are left (or limit have been tried).
+        Returns a DrainSummary.
+    """
+    batch_size = batch_size or getattr(settings, 'RDF_IO_SYNC_BATCH_SIZE', 100)
+    summary = DrainSummary()
+    # entries queued again or retried after this point are left for the next drain
+    cutoff = timezone.now()
+    tried = 0
+    while limit is None or tried < limit :
+        due = PublishOutbox.objects.filter(next_attempt__lte=cutoff, attempts__lt=max_attempts()).order_by('next_attempt')
+        entries = list(due[:batch_size if limit is None else min(batch_size, limit - tried)])
+        if not entries :
+            break
+        tried += len(entries)
+        bytype = {}
+        for entry in entries :
+            bytype.setdefault(entry.content_type_id, []).append(entry)
+        for (ct_id, cts_entries) in bytype.items() :
+            _publish_entries(ContentType.objects.get_for_id(ct_id), cts_entries, summary)
+    return summary
+
+def _publish_entries(ct, entries, summary):
+    oml = get_mapping_plan(ct)
+    model = ct.model_class()
+    objs = dict( (str(obj.pk), obj) for obj in oml.prepare_queryset(model._default_manager.filter(pk__in=[ e.object_id for e in entries ])) )
+    if chains.enabled() :
+        return _publish_chains(ct, oml, objs, entries, summary)
+    # each object goes to the first binding whose object_filter it matches, as when it is published on save
+    bybinding = {}
+    for entry in entries :
+        obj = objs.get(entry.object_id)
+        if obj is None :
+            # deleted since it was saved - deletions are not published
+            _done(entry)
+            summary.dropped += 1
+            continue
+        binding = binding_index.get(ct.model, PERSIST_BINDINGS, obj)
+        if binding is None :
+            _failed(entry, Exception("Cant locate appropriate repository configuration for %s" % ct.model ))
+            summary.failed += 1
+            continue
+        bybinding.setdefault(binding.pk, (binding, []))[1].append( (entry, obj) )
+    for pk in sorted(bybinding) :
+        _publish_binding(ct, oml, bybinding[pk][0], bybinding[pk][1], summary)
+
+def _publish_binding(ct, oml, binding, entries, summary):
+    """ publish the (entry, object) pairs to binding """
+    # import here to avoid a circular import - the views import the signal handlers that use this module
+    from rdf_io.views.serialize import build_graph
+
+    # SPARQL bindings send the difference from the last published graph
+    sparql = binding.service_api == ServiceBinding.SPARQL
+    published = ledger.lookup(binding, ct, [ e.object_id for (e,obj) in entries ], with_triples=True) if sparql else {}
+
+    pending = []
+    for (entry,obj) in entries :
+        try:
+            built = timezone.now()
+            gr = build_graph(obj, oml, None if sparql else NTriplesSink())
+            last = published.get(entry.object_id)
+            push = prepare_push(binding, ct.model, obj, gr, previous=last.triples.splitlines() if last else None)
+            pending.append( (entry, push, ledger.graph_hash(gr), built) )
+        except Exception as e:
+            _failed(entry, e)
+            summary.failed += 1
+
+    records = []
+    for ((entry,push,graph_hash,built),(result,error)) in zip(pending, push_batch([ p[1] for p in pending ])) :
+        if error is None :
+            _done(entry)
+            records.append( (entry.object_id, graph_hash, built, getattr(result, 'status_code', None), push.ledger_triples()) )
+            summary.published += 1
+        else:
+            _failed(entry, error)
+            summary.failed += 1
+    ledger.record(binding, ct, records)
+
+def _publish_chains(ct, oml, objs, entries, summary):
+    """
+        run the objects through their chains together, so every stage is busy at once - an entry fails if any stage
+        did without an on_fail_service to handle it
+    """
+    from rdf_io.views.serialize import build_graph
+    try:
+        chain = chains.Chain(ct.model)
+    except Exception as e:
+        for entry in entries :
+            _failed(entry, e)
+            summary.failed += 1
+        return
+    run = chains.ChainRun(chain)
+    previous = chains._previous(chain, ct, list(objs))
+    submitted = []
+    try:
+        for entry in entries :
+            obj = objs.get(entry.object_id)
+            if obj is None :
+                _done(entry)
+                summary.dropped += 1
+                continue
+            try:
+                run.submit(obj, build_graph(obj, oml), previous.get(entry.object_id))
+            except Exception as e:
+                _failed(entry, e)
+                summary.failed += 1
+                continue
+            submitted.append( (entry, obj) )
+    finally:
+        run.close()
+    run.record_ledger(ct)
+    for (entry, obj) in submitted :
+        errors = run.summary.failures.get(obj.pk)
+        if errors :
+            _failed(entry, "; ".join( str(e) for e in errors ))
+            summary.failed += 1
+        else:
+            _done(entry)
+            summary.published += 1
+
+def _done(entry):
+    # an entry saved again while it was being published stays queued
+    PublishOutbox.objects.filter(pk=entry.pk, version=entry.version).delete()
+
+def _failed(entry, error):
+    attempts = entry.attempts + 1
+    logger.warning("publishing %s %s failed (attempt %d) : %s" % (entry.content_type, entry.object_id, attempts, error))
+    PublishOutbox.objects.filter(pk=entry.pk, version=entry.version).update(
+        attempts=attempts, last_error=str(error)[:2000], next_attempt=timezone.now() + timedelta(seconds=retry_delay(attempts)))
+
+
+# in process dispatch - at most one background drain per process, rerun if more is queued while it works
+_dispatch_lock = threading.Lock()
+_dispatch_state = { 'running' : False, 'again' : False }
+
+def dispatch():
+    """ start draining the outbox in the background - called once the transaction that queued entries has committed """
+    if not getattr(settings, 'RDF_IO_OUTBOX_DISPATCH', True) :
+        return
+    with _dispatch_lock:
+        if _dispatch_state['running'] :
+            _dispatch_state['again'] = True
+            return
+        _dispatch_state['running'] = True
+        _dispatch_state['again'] = False
+    t = threading.Thread(target=_dispatch_worker, name='rdf_io_outbox')
+    t.daemon = True
+    t.start()
+
+def _dispatch_worker():
+    try:
+        while True :
+            try:
+                drain()
+            except Exception as e:
+                logger.exception("background publishing of the RDF outbox failed : %s" % e)
+            with _dispatch_lock:
+                if not _dispatch_state['again'] :
+                    _dispatch_state['running'] = False
+                    return
+                _dispatch_state['again'] = False
+    finally:
+        connection.close()
+
+def publish_later(obj):
+    """ queue obj for publishing in the current transaction and dispatch once it commits """
+    enqueue(obj)
+    transaction.on_commit(dispatch)
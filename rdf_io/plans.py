@@ -0,0 +1,503 @@
+# # -*- coding:utf-8 -*-
+"""
+    Compiled mapping plans.
+
+    A MappingPlan holds everything build_rdf needs to know about the ObjectMappings for a model -
+    predicates and types already resolved to URIRefs, filters already parsed and embedded structures already split -
+    so serialising an object does not have to go back to the database for mapping metadata.
+
+    Plans are compiled once per process for each ContentType and thrown away whenever any of the mapping
+    models (or the namespaces used to resolve them) are saved or deleted.
+"""
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import signals
+from django.db.models import Prefetch, Q
+from django.db import models
+from django.core.exceptions import FieldDoesNotExist
+from rdflib.term import URIRef
+
+from rdf_io.relations import relation_index
+from rdf_io.models import ObjectMapping,AttributeMapping,EmbeddedMapping,ObjectType,Namespace, parse_pathfilter, getattr_path, expand_curie, compile_path
+
+from string import Formatter
+import re
+import threading
+import urllib
+from collections import OrderedDict
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _resolve(curie):
+    # deferred to avoid a circular import - the views import the plans
+    from rdf_io.views.serialize import _as_resource
+    return _as_resource(None, curie)
+
+def _literal_term(expr, is_resource):
+    from rdf_io.views.serialize import _literal_term
+    return _literal_term(expr, is_resource)
+
+
+class AttributePlan(object):
+    """ an AttributeMapping with its predicate resolved """
+    def __init__(self, am):
+        self.predicate = _resolve(am.predicate)
+        self.attr = am.attr
+        self.is_resource = am.is_resource
+
+
+class EmbeddedPlan(object):
+    """ an EmbeddedMapping with its predicates resolved and its struct split into (predicate, StructElement) elements """
+    def __init__(self, em):
+        self.predicate = _resolve(em.predicate)
+        # identifies the mapping in blank node ids - the predicate alone may be shared with other EmbeddedMappings
+        self.key = "%s.%s" % (em.scope_id, em.pk)
+        self.attr = em.attr
+        self.use_blank = em.use_blank
+        self.elements = []
+        for element in em.struct.split(";") :
+            try:
+                (predicate,expr) = element.split()
+            except ValueError:
+                predicate = None
+                expr = element
+            if predicate :
+                predicate = _resolve(predicate)
+            self.elements.append( (predicate, StructElement(expr)) )
+
+
+class _Slot(object):
+    """ a {variable} in a struct expression - {$URI}, a path from the embedded value, or ^path from the mapped object """
+    __slots__ = ('var', 'is_uri', 'from_root', 'path')
+
+    def __init__(self, var):
+        self.var = var
+        self.is_uri = var == '$URI'
+        self.from_root = var.startswith('^')
+        try:
+            self.path = compile_path(var[1:] if self.from_root else var)
+        except Exception :
+            # reported as not found when used, as it always was
+            self.path = None
+
+    def render(self, obj, value, uri, is_resource):
+        if self.is_uri :
+            return uri
+        try:
+            val = iter(self.path.evaluate(obj if self.from_root else value)).next()
+            if is_resource :
+                try:
+                    val = urllib.urlencode({ 'v' : val.encode('utf-8')})[2:]
+                except:
+                    #not a string, just pass
+                    pass
+            return str(val)
+        except:
+            return "{!variable not found : %s}" % self.var
+
+def _compile_segments(text):
+    """ split a struct expression into literal strings and _Slots for each {variable} """
+    names = []
+    for (lit,var,spec,conv) in Formatter().parse(text) :
+        if var and var not in names :
+            names.append(var)
+    if not names :
+        return [text]
+    slots = dict( (var.join(("{","}")), _Slot(var)) for var in names )
+    segments = []
+    start = 0
+    for match in re.finditer("|".join( re.escape(key) for key in slots ), text) :
+        if match.start() > start :
+            segments.append(text[start:match.start()])
+        segments.append(slots[match.group(0)])
+        start = match.end()
+    if start < len(text) :
+        segments.append(text[start:])
+    return segments
+
+
+class StructElement(object):
+    """
+        one expression of an EmbeddedMapping struct, compiled once - split into literal text and {variable} slots with
+        their paths compiled, and for a quoted literal or <resource> with no variables, the RDF term itself.
+
+        expression syntax:  "literal {var}"@lang | <uri {var}> | path | /path from the mapped object
+        {$URI} is the URI of the mapped object, {^path} a path from the mapped object, {path} a path from the embedded value
+    """
+    def __init__(self, expr):
+        self.expr = expr
+        self.is_resource = expr.startswith("<")
+        self.root_path = expr[1:] if expr.startswith("/") else None
+        self.term = None
+        self.error = None
+        self.segments = None
+        if self.root_path is not None :
+            # a value of the mapped object - only known per object
+            return
+        text = expr[1:-1].join(('"','"')) if self.is_resource else expr
+        try:
+            self.segments = _compile_segments(text)
+        except Exception as e:
+            self.error = e
+            return
+        if len(self.segments) == 1 and not isinstance(self.segments[0], _Slot) and _is_literal(text) :
+            try:
+                self.term = _literal_term(text, self.is_resource)
+            except Exception :
+                # raised again for each object, where it can be reported against the mapping
+                self.term = None
+
+    def render(self, obj, value, uri):
+        """ the expression with its variables filled in for one embedded value of obj """
+        if self.error is not None :
+            raise ValueError(self.error)
+        if self.root_path is not None :
+            path = self.root_path.replace("{$URI}", uri)
+            try:
+                expr = iter(getattr_path(obj,path)).next()
+                if type(expr) == str :
+                    expr = expr.join( ('"','"'))
+            except:
+                raise ValueError( "Could not access value of /%s from mapped object %s (/ is relative to the object being mapped" % (path,obj) )
+            segments = _compile_segments(expr)
+        else:
+            segments = self.segments
+        if len(segments) == 1 and not isinstance(segments[0], _Slot) :
+            return segments[0]
+        return "".join( seg if not isinstance(seg, _Slot) else seg.render(obj, value, uri, self.is_resource) for seg in segments )
+
+
+class ObjectMappingPlan(object):
+    """ compiled form of a single ObjectMapping """
+    def __init__(self, om):
+        self.mapping = om
+        self.name = om.name
+        self.id_attr = om.id_attr
+        self.filter = parse_pathfilter(om.filter) if om.filter else None
+        if om.target_uri_expr[0] == '"' :
+            self.uribase = om.target_uri_expr[1:-1]
+            self.uribase_expanded = expand_curie(self.uribase)
+            self.uribase_path = None
+        else:
+            self.uribase = None
+            self.uribase_path = om.target_uri_expr
+        self.types = [ _resolve(omt.uri) for omt in om.obj_type.all() ]
+        self.attributes = [ AttributePlan(am) for am in AttributeMapping.objects.filter(scope=om) ]
+        self.embedded = [ EmbeddedPlan(em) for em in EmbeddedMapping.objects.filter(scope=om) ]
+
+    def paths(self):
+        """ all the path expressions this mapping evaluates, relative to the object being mapped """
+        paths = [self.id_attr]
+        if self.uribase_path :
+            paths.append(self.uribase_path)
+        for (path,negate,vals) in self.filter or () :
+            paths.append(path)
+        for am in self.attributes :
+            if not _is_literal(am.attr) :
+                paths.append(am.attr)
+        for em in self.embedded :
+            paths.append(em.attr)
+            for (predicate,element) in em.elements :
+                expr = element.expr.strip()
+                if expr.startswith("/") :
+                    paths.append(expr[1:])
+                    continue
+                if _is_literal(expr) :
+                    for (lit,var,x,y) in Formatter().parse(expr) :
+                        if not var or var.startswith("$") :
+                            continue
+                        if var.startswith("^") :
+                            paths.append(var[1:])
+                        else:
+                            paths.append(".".join((em.attr,var)))
+                elif expr :
+                    paths.append(".".join((em.attr,expr)))
+        return paths
+
+    def uri_for(self, obj):
+        """ generate the URI of the resource this mapping produces for obj """
+        try:
+            tgt_id = getattr_path(obj,self.id_attr)[0]
+        except ValueError as e:
+            raise ValueError("target id attribute {} not found".format( (self.id_attr ,)))
+        if self.uribase_path :
+            uribase = getattr_path(obj,self.uribase_path)[0]
+            # strip uri base if present in tgt_id
+            tgt_id = str(tgt_id).replace(uribase,"")
+            uribase = expand_curie(uribase)
+        else:
+            tgt_id = str(tgt_id).replace(self.uribase,"")
+            uribase = self.uribase_expanded
+
+        if not tgt_id:
+            return uribase
+        elif uribase[-1] == '/' or uribase[-1] == '#' :
+            return "".join((uribase,tgt_id))
+        else :
+            return "/".join((uribase,tgt_id))
+
+
+def _is_literal(expr):
+    return expr[:1] in ('"', "'", '<')
+
+
+class MappingPlan(object):
+    """ the compiled ObjectMappings for a model - iterates over ObjectMappingPlans """
+    def __init__(self, oml, model=None):
+        self.model = model
+        self.mappings = [ ObjectMappingPlan(om) for om in oml ]
+        self._lookups = None
+        self._filter_q = None
+
+    def related_lookups(self):
+        """
+            the (select_related, prefetch_related) lookups that let all the mapping paths be followed
+            for a set of objects without a query per object per path
+        """
+        if self._lookups is None :
+            select = []
+            prefetch = OrderedDict()
+            if self.model :
+                for om in self.mappings :
+                    for path in om.paths() :
+                        try:
+                            steps = compile_path(path).steps
+                        except Exception :
+                            continue
+                        _plan_lookups(self.model, steps, [], True, select, prefetch)
+            # a select_related lookup that is a prefix of another is redundant
+            select = [ l for l in select if not any( o.startswith(l + "__") for o in select ) ]
+            self._lookups = (sorted(set(select)), list(prefetch.values()))
+        return self._lookups
+
+    def filter_queryset(self, queryset):
+        """
+            restrict a queryset of the mapped model to the objects at least one mapping's filter could apply to, as far as
+            the filters can be written as django lookups (see filter_q) - build_rdf still checks each object, so clauses
+            that cant be translated only cost fetching rows that are then skipped
+        """
+        if self._filter_q is None :
+            self._filter_q = (self._compile_filter_q(),)
+        (q,) = self._filter_q
+        if q is None :
+            return queryset
+        return queryset.filter(q)
+
+    def _compile_filter_q(self):
+        if not self.model or not self.mappings :
+            return None
+        combined = None
+        for om in self.mappings :
+            q = filter_q(self.model, om.filter)
+            if q is None :
+                # this mapping may apply to any object
+                return None
+            combined = q if combined is None else combined | q
+        return combined
+
+    def prepare_queryset(self, queryset):
+        """ add the select_related and prefetch_related calls the mappings need to a queryset of the mapped model """
+        (select, prefetch) = self.related_lookups()
+        if select :
+            queryset = queryset.select_related(*select)
+        if prefetch :
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
+
+    def __iter__(self):
+        return iter(self.mappings)
+
+    def __len__(self):
+        return len(self.mappings)
+
+
+def filter_q(model, clauses):
+    """
+        a Q object that every object of model a parsed path filter (see parse_pathfilter) accepts will match - or None if
+        no clause can be translated.
+
+        apply_pathfilter lets each clause on a many valued path match a different related object, whereas clauses in
+        one filter() have to match the same joined row - so those clauses are each matched in a subquery of their own.
+
+        Mirrors apply_pathfilter, which only sees values that are not empty or false and compares them as strings:
+            path=a,b        (text field)        path__in=[a,b]
+            path=True       (boolean field)     path=True
+            path!=a         (text field)        path is not empty and not a - only for single valued paths
+            path!=None                          path has a value that is not empty, zero or false
+        Anything else - filters in the path, model(property) elements, reverse relations, attributes that are not fields,
+        or other combinations of values - is left to apply_pathfilter.
+    """
+    combined = None
+    for (path,negate,vals) in clauses or () :
+        try:
+            q = _clause_q(model, path, negate, vals)
+        except Exception as e:
+            logger.debug("filter %s on %s left to python : %s" % (path, model, e))
+            q = None
+        if q is None :
+            continue
+        (q, many) = q
+        if many :
+            q = Q(pk__in=model._default_manager.filter(q).values('pk'))
+        combined = q if combined is None else combined & q
+    return combined
+
+def _clause_q(model, path, negate, vals):
+    resolved = _resolve_field_path(model, path)
+    if resolved is None :
+        return None
+    (lookup, field, single) = resolved
+    if 'None' in vals :
+        if negate and vals == ['None'] :
+            return (_truthy_q(lookup, field), not single)
+        return None
+    if field.is_relation :
+        return None
+    if isinstance(field, models.BooleanField) :
+        if negate :
+            return None
+        return (Q(**{lookup : vals[0] == 'True'}), not single)
+    if not isinstance(field, (models.CharField, models.TextField)) :
+        # apply_pathfilter compares the values with strings, which only text fields can equal
+        return None
+    if not negate :
+        return (Q(**{ lookup + "__in" : vals }), not single)
+    if single and len(set(vals)) == 1 :
+        return (_truthy_q(lookup, field) & ~Q(**{lookup : vals[0]}), False)
+    return None
+
+def _truthy_q(lookup, field):
+    q = Q(**{ lookup + "__isnull" : False })
+    if field.is_relation :
+        return q
+    if isinstance(field, (models.CharField, models.TextField)) :
+        return q & ~Q(**{lookup : ''})
+    if isinstance(field, models.BooleanField) :
+        return Q(**{lookup : True})
+    if isinstance(field, (models.IntegerField, models.FloatField, models.DecimalField)) :
+        return q & ~Q(**{lookup : 0})
+    return q
+
+def _resolve_field_path(model, path):
+    """ (django lookup, final field, single valued) for a path made only of forward relations and a field - else None """
+    steps = compile_path(path).steps
+    lookup = []
+    single = True
+    field = None
+    for step in steps :
+        if step.relprop or step.valfilter or step.lang or step.lang_path or step.datatype or step.datatype_path :
+            return None
+        if field is not None :
+            if not field.is_relation or field.related_model is None :
+                return None
+            model = field.related_model
+        try:
+            field = model._meta.get_field(step.field)
+        except FieldDoesNotExist :
+            return None
+        if field.auto_created and not field.concrete :
+            # a reverse relation - its lookup name is not the attribute name
+            return None
+        if field.is_relation and (field.related_model is None or not (field.many_to_one or field.one_to_one or field.many_to_many)) :
+            return None
+        if field.many_to_many :
+            single = False
+        lookup.append(step.field)
+    if field is None :
+        return None
+    return ("__".join(lookup), field, single)
+
+def _relation(model, name):
+    """ the relation field reached from model by attribute name name, and whether it is single valued """
+    for f in model._meta.get_fields() :
+        if not f.is_relation or f.related_model is None :
+            continue
+        if f.auto_created and not f.concrete :
+            # reverse relation - reverse one to one relations are prefetched, not joined
+            if f.get_accessor_name() == name :
+                return (f, False)
+        elif f.name == name :
+            return (f, f.many_to_one or f.one_to_one)
+    return (None, False)
+
+def _reverse_model_relation(model, modelname, relprop):
+    """ the reverse relation from model for a model(property) path element """
+    relation = relation_index.get(model._meta.concrete_model, modelname, relprop)
+    if relation is None or relation.rel.is_hidden() :
+        return None
+    return relation.rel
+
+def _plan_lookups(model, steps, prefix, single, select, prefetch):
+    """
+        walk compiled path steps over the model metadata collecting select_related lookups (while every hop from the mapped
+        object is single valued) and prefetch_related lookups (once any hop is multi valued)
+    """
+    for (i,step) in enumerate(steps) :
+        # language or datatype sub paths are evaluated from the same object
+        for subpath in (step.lang_path, step.datatype_path) :
+            if subpath :
+                _plan_lookups(model, subpath, prefix, single, select, prefetch)
+        (field, is_single) = _relation(model, step.field)
+        if field :
+            lookup = "__".join(prefix + [step.field])
+            if single and is_single :
+                select.append(lookup)
+            else:
+                single = False
+                prefetch.setdefault(lookup, lookup)
+            prefix = prefix + [step.field]
+            model = field.related_model
+            continue
+        if step.relprop or (not _has_field(model, step.field) and step.field != 'pk') :
+            # model(property) element - resolved through the reverse relation and kept in the step's cache attribute
+            field = _reverse_model_relation(model, step.field, step.relprop)
+            filters = step.static_filters()
+            if not field or filters is None :
+                return
+            lookup = "__".join(prefix + [field.get_accessor_name()])
+            key = "__".join(prefix + [step.cache_attr])
+            prefetch.setdefault(key, Prefetch(lookup, queryset=field.related_model._default_manager.filter(**filters), to_attr=step.cache_attr))
+            single = False
+            prefix = prefix + [step.cache_attr]
+            model = field.related_model
+            continue
+        # a plain value - nothing more to fetch
+        return
+
+def _has_field(model, name):
+    try:
+        model._meta.get_field(name)
+        return True
+    except Exception :
+        return hasattr(model, name)
+
+
+_plans = {}
+_generation = 0
+_lock = threading.Lock()
+
+def get_mapping_plan(ct):
+    """ get the (cached) MappingPlan for a ContentType """
+    plan = _plans.get(ct.id)
+    if plan is None :
+        generation = _generation
+        plan = MappingPlan(ObjectMapping.objects.filter(content_type=ct), ct.model_class())
+        with _lock:
+            # dont cache a plan if the mappings changed while it was being compiled
+            if generation == _generation :
+                _plans[ct.id] = plan
+    return plan
+
+def invalidate_plans(**kwargs):
+    """ signal handler - discard all compiled plans """
+    global _generation
+    with _lock:
+        _generation += 1
+        _plans.clear()
+    logger.debug("RDF mapping plans invalidated")
+
+for _model in (ObjectMapping, AttributeMapping, EmbeddedMapping, ObjectType, Namespace) :
+    signals.post_save.connect(invalidate_plans, sender=_model, dispatch_uid="rdf_io_plans_%s" % _model.__name__)
+    signals.post_delete.connect(invalidate_plans, sender=_model, dispatch_uid="rdf_io_plans_%s" % _model.__name__)
+signals.m2m_changed.connect(invalidate_plans, sender=ObjectMapping.obj_type.through, dispatch_uid="rdf_io_plans_obj_type")
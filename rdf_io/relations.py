@@ -0,0 +1,88 @@
+"""
+    Index of the relations a model(property) path element can follow
+
+    A path element naming another model - e.g. label(concept) - means the objects of that model which refer to the
+    object being serialised, through property if given, otherwise through their first foreign key to its model.
+    The index is built once from the _meta of every installed model (when the app registry is ready, and again if
+    another model class is created later), so following such an element is a dict lookup rather than a ContentType
+    query and a scan of the related model's attributes.
+"""
+from django.apps import apps
+from django.db.models import signals
+
+from collections import namedtuple
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+# the model with the property, the property (a foreign key or many to many field) and its reverse relation from the target
+Relation = namedtuple('Relation', ('model', 'field_name', 'rel'))
+
+
+class RelationIndex(object):
+    """ thread safe lookup of Relations by (target model, related model name, property or None) """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+
+    def _get_state(self):
+        state = self._state
+        if state is None :
+            with self._lock:
+                if self._state is None :
+                    self._state = self._build()
+                state = self._state
+        return state
+
+    def _build(self):
+        relations = {}
+        models = {}
+        targets = {}
+        for model in apps.get_models() :
+            name = model._meta.model_name
+            models.setdefault(name, []).append(model)
+            for f in model._meta.get_fields() :
+                if f.auto_created or not f.concrete or not f.is_relation or f.related_model is None :
+                    continue
+                if not (f.many_to_one or f.one_to_one or f.many_to_many) or isinstance(f.related_model, basestring) :
+                    continue
+                relation = Relation(model, f.name, f.remote_field)
+                target = f.related_model
+                relations[(target, name, f.name)] = relation
+                targets.setdefault(target, []).append(relation)
+                if f.many_to_many :
+                    # only followed when named
+                    continue
+                # unnamed - the foreign key behind the default <model>_set accessor wins, otherwise the first one
+                default = relations.get((target, name, None))
+                if default is None or (f.remote_field.get_accessor_name() == name + "_set" and default.rel.get_accessor_name() != name + "_set") :
+                    relations[(target, name, None)] = relation
+        logger.debug("indexed %d model relations" % len(relations))
+        return (relations, models, targets)
+
+    def build(self):
+        """ build the index now rather than on first use """
+        self._get_state()
+
+    def invalidate(self, **kwargs):
+        """ signal handler - rebuild on next use """
+        with self._lock:
+            self._state = None
+
+    def get(self, target, modelname, relprop=None):
+        """ the Relation from objects of model modelname to those of target (a model class), through relprop if given - or None """
+        return self._get_state()[0].get( (target, modelname, relprop or None) )
+
+    def models(self, modelname):
+        """ the installed model classes with a model name """
+        return self._get_state()[1].get(modelname, [])
+
+    def to(self, target):
+        """ every Relation to objects of target (a model class) """
+        return self._get_state()[2].get(target, [])
+
+
+relation_index = RelationIndex()
+
+signals.class_prepared.connect(relation_index.invalidate, dispatch_uid='rdf_io_relation_index')
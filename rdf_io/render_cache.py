@@ -0,0 +1,101 @@
+"""
+    Cache of rendered RDF for the to_rdf views, using the django cache framework
+
+    Entries are keyed by content type, object, format and a mapping version. Saving or deleting a mapped object discards
+    its entries, and any change to the mapping models bumps the mapping version so every entry rendered with the old
+    mappings is ignored.
+
+    Disabled unless settings.RDF_IO_RENDER_CACHE names a cache (e.g. 'default'). RDF_IO_RENDER_CACHE_TIMEOUT (seconds,
+    default 3600) bounds how long changes to related objects that dont save the mapped object itself can go unseen.
+"""
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import signals
+
+from rdf_io.models import ObjectMapping,AttributeMapping,EmbeddedMapping,ObjectType,Namespace
+
+from collections import namedtuple
+import hashlib
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+FORMATS = ('turtle', 'json-ld')
+
+_VERSION_KEY = 'rdf_io:mapping_version'
+
+Rendered = namedtuple('Rendered', ('content', 'etag', 'last_modified'))
+
+
+def _cache():
+    alias = getattr(settings, 'RDF_IO_RENDER_CACHE', None)
+    if not alias :
+        return None
+    from django.core.cache import caches
+    return caches[alias]
+
+def _timeout():
+    return getattr(settings, 'RDF_IO_RENDER_CACHE_TIMEOUT', 3600)
+
+def _mapping_version(cache):
+    version = cache.get(_VERSION_KEY)
+    if version is None :
+        # start from the clock so a lost version key doesnt bring old entries back to life
+        cache.add(_VERSION_KEY, int(time.time()), None)
+        version = cache.get(_VERSION_KEY)
+    return version
+
+def _key(ct_id, pk, format, version):
+    return "rdf_io:rdf:%s:%s:%s:%s" % (ct_id, pk, format, version)
+
+def get_rendered(ct, pk, format):
+    """ the cached Rendered output for an object, or None """
+    cache = _cache()
+    if cache is None :
+        return None
+    return cache.get(_key(ct.id, pk, format, _mapping_version(cache)))
+
+def store_rendered(ct, pk, format, content):
+    """ wrap rendered output with its validators and cache it if the cache is enabled """
+    etag = '"%s"' % hashlib.md5(content).hexdigest()
+    cache = _cache()
+    if cache is None :
+        return Rendered(content, etag, None)
+    rendered = Rendered(content, etag, int(time.time()))
+    cache.set(_key(ct.id, pk, format, _mapping_version(cache)), rendered, _timeout())
+    return rendered
+
+def invalidate_object(sender, instance, **kwargs):
+    """ signal handler - discard any rendered output for a saved or deleted object of a mapped model """
+    cache = _cache()
+    if cache is None :
+        return
+    from rdf_io.plans import get_mapping_plan
+    ct = ContentType.objects.get_for_model(sender)
+    if not get_mapping_plan(ct) :
+        return
+    version = _mapping_version(cache)
+    cache.delete_many([ _key(ct.id, instance.pk, format, version) for format in FORMATS ])
+
+def invalidate_mappings(**kwargs):
+    """ signal handler - a mapping has changed so nothing rendered so far can be used """
+    cache = _cache()
+    if cache is None :
+        return
+    try:
+        cache.incr(_VERSION_KEY)
+    except ValueError:
+        _mapping_version(cache)
+
+_MAPPING_MODELS = (ObjectMapping, AttributeMapping, EmbeddedMapping, ObjectType, Namespace)
+
+def _invalidate_saved(sender, **kwargs):
+    if sender in _MAPPING_MODELS :
+        invalidate_mappings()
+    elif sender._meta.app_label not in ('rdf_io', 'contenttypes', 'sessions', 'admin') :
+        invalidate_object(sender, **kwargs)
+
+signals.post_save.connect(_invalidate_saved, dispatch_uid='rdf_io_render_cache')
+signals.post_delete.connect(_invalidate_saved, dispatch_uid='rdf_io_render_cache')
+signals.m2m_changed.connect(invalidate_mappings, sender=ObjectMapping.obj_type.through, dispatch_uid='rdf_io_render_cache')
@@ -3,20 +3,45 @@ from django.db.models import signals
 
 from django.contrib.contenttypes.models import ContentType
 from rdf_io.models import ObjectMapping
-from rdf_io.views import publish
+from rdf_io.views import publish, build_graph
+from rdf_io.plans import get_mapping_plan
+from rdf_io import outbox
+from rdf_io import chains
 
 import logging
 logger = logging.getLogger(__name__)
 
 def publish_rdf( **kwargs) :
     obj = kwargs['instance']
+    if outbox.enabled() :
+        # published after the save commits - see rdf_io.outbox
+        outbox.publish_later(obj)
+        return
     ct = ContentType.objects.get_for_model(obj)
-    oml = ObjectMapping.objects.filter(content_type=ct)
+    oml = get_mapping_plan(ct)
     result = publish( obj, ct.name, oml, None) 
+    if result is None :
+        # nothing changed since it was last published
+        return
+    if isinstance(result, chains.ChainSummary) :
+        logger.debug("Published {} of type {} through service chains {}".format(obj, ct, result.as_dict()))
+        return
     logger.debug(
             "Persisting RDF for {} of type {} status {} body {}".format(obj,ct,result.status_code,result.content))
     print            "Persisting RDF for {} of type {} status {} body {}".format(obj,ct,result.status_code,result.content)
     
+def unpublish_rdf( **kwargs) :
+    """ post_delete handler - runs the on_delete_service of the object's service chains """
+    obj = kwargs['instance']
+    ct = ContentType.objects.get_for_model(obj)
+    try:
+        gr = build_graph(obj, get_mapping_plan(ct))
+    except Exception as e:
+        # related objects may already be gone
+        logger.debug("Could not build RDF for deleted {} : {}".format(obj, e))
+        gr = None
+    chains.unpublish_chain(obj, ct.model, gr)
+
 def setup_signals( **kwargs) :
     objmapping = kwargs['instance']
     #import pdb; pdb.set_trace()
@@ -34,6 +59,8 @@ def _setup(objmapping) :
         if objmapping.auto_push :
             ct = ContentType.objects.get(id = objmapping.content_type_id).model_class()
             signals.post_save.connect(publish_rdf, sender=ct, dispatch_uid=str(ct.__name__))
+            if chains.enabled() :
+                signals.post_delete.connect(unpublish_rdf, sender=ct, dispatch_uid=str(ct.__name__))
             print "RDF publishing configured for model {}".format((ct))
             logger.info(
                 "RDF publishing configured for model {}".format((ct)))
@@ -0,0 +1,67 @@
+"""
+    Triple sinks for build_rdf
+
+    build_rdf only ever calls add((s, p, o)) on the graph it is given, so anything with that method can receive the
+    triples. An rdflib Graph indexes every triple in its store and is then serialised in a separate pass - the sinks
+    here write each triple as an escaped N-Triples line as it arrives instead, which is all that bulk export and
+    publishing need.
+
+    The lines are exactly those the rdflib N-Triples serializer produces, so hashes of the output match those of
+    a Graph holding the same triples. N-Triples is also valid Turtle, so the output can be sent to stores expecting Turtle.
+"""
+import rdflib
+# registers the codec error handler that escapes non ascii characters as N-Triples requires
+from rdflib.plugins.serializers.nt import _nt_row
+
+
+class NTriplesSink(object):
+    """
+        collects the N-Triples (or with a context, N-Quads) lines for the triples added - duplicates are dropped.
+
+        Has the parts of the Graph interface the rest of rdf_io uses for published graphs (add, len, iteration, serialize).
+        graph() gives a real rdflib Graph for anything else.
+    """
+    def __init__(self, context=None):
+        self.context = rdflib.URIRef(context).n3() if context else None
+        self._lines = []
+        self._seen = set()
+
+    def add(self, triple):
+        line = _nt_row(triple).encode('ascii', '_rdflib_nt_escape')
+        if line in self._seen :
+            return
+        self._seen.add(line)
+        self._lines.append(line)
+
+    def __len__(self):
+        return len(self._lines)
+
+    def lines(self):
+        """ the serialised statements, in the order they were added """
+        if self.context :
+            return [ "".join((line[:-3], " ", self.context, " .\n")) for line in self._lines ]
+        return list(self._lines)
+
+    def getvalue(self):
+        return "".join(self.lines())
+
+    def serialize(self, format='nt', **kwargs):
+        """ the triples as N-Triples for 'nt' and 'turtle', N-Quads in the sink's context for 'nquads', otherwise via rdflib """
+        if format == 'nquads' and self.context :
+            return self.getvalue()
+        if format in ('nt', 'ntriples', 'turtle') :
+            return "".join(self._lines)
+        return self.graph().serialize(format=format, **kwargs)
+
+    def graph(self):
+        """ the triples as an rdflib Graph """
+        gr = rdflib.Graph()
+        if self._lines :
+            gr.parse(data="".join(self._lines), format='nt')
+        return gr
+
+    def __iter__(self):
+        return iter(self.graph())
+
+    def subjects(self, *args):
+        return self.graph().subjects(*args)
@@ -0,0 +1,345 @@
+"""
+    Bulk synchronisation of mapped objects to the RDF store bound to their model
+
+    Graphs are built and serialised on the calling thread - which is the only one that touches the database -
+    and the requests to the store are sent from a bounded pool of worker threads, so a sync spends its time
+    waiting on at most ServiceBinding.concurrency requests at once instead of on each object in turn.
+
+    Objects are read in primary key order a chunk at a time (keyset pagination), so memory use does not depend on
+    the size of the table. After each chunk the SyncCheckpoint for the model and binding is moved up to the last
+    primary key below which every object has been published (or skipped) - a sync interrupted by a crash or a store
+    outage can be resumed from there rather than started again.
+
+    Each object goes to the first persistence binding of its model whose object_filter it matches, as when it is
+    published on save - objects matching none are skipped.
+"""
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.utils import timezone
+
+from rdf_io.models import ServiceBinding, SyncCheckpoint, RDFConfigNotFoundException, prepare_push, push_batch
+from rdf_io.plans import get_mapping_plan
+from rdf_io.sinks import NTriplesSink
+from rdf_io.utils import BoundedPool, queryset_chunks
+from rdf_io.bindings import binding_index
+from rdf_io import ledger
+
+from functools import partial
+import threading
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+PERSIST_BINDINGS = (ServiceBinding.PERSIST_CREATE,ServiceBinding.PERSIST_UPDATE,ServiceBinding.PERSIST_REPLACE)
+
+# how many error messages a summary keeps
+MAX_ERRORS = 100
+
+
+class SyncSummary(object):
+    """ thread safe tally of the outcome of a sync """
+    def __init__(self, model, concurrency=1):
+        self.model = model
+        self.concurrency = concurrency
+        self.published = 0
+        self.failed = 0
+        self.skipped = 0
+        self.bytes_sent = 0
+        self.statuses = {}
+        self.errors = []
+        self.published_records = []
+        self.started = time.time()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def record_success(self, pk, push, result, ledger_record=None):
+        """ ledger_record is the (graph hash, built at) to record in the publish ledger for the object """
+        with self._lock:
+            self.published += 1
+            self.bytes_sent += len(push.data)
+            # no response if there was nothing to send
+            status = getattr(result, 'status_code', None)
+            if status :
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+            if ledger_record :
+                self.published_records.append( (push.binding, (pk, ledger_record[0], ledger_record[1], status, push.ledger_triples())) )
+
+    def record_skipped(self, pk):
+        with self._lock:
+            self.skipped += 1
+
+    def take_published(self):
+        """ the ledger records of objects published since the last call """
+        return [ record for (binding,records) in self.take_published_by_binding() for record in records ]
+
+    def take_published_by_binding(self):
+        """ the ledger records of objects published since the last call, as a list of (binding, records) """
+        with self._lock:
+            (published, self.published_records) = (self.published_records, [])
+        bybinding = {}
+        for (binding,record) in published :
+            bybinding.setdefault(binding.pk, (binding, []))[1].append(record)
+        return [ bybinding[pk] for pk in sorted(bybinding) ]
+
+    def record_failure(self, pk, error):
+        logger.error("sync of %s %s failed : %s" % (self.model, pk, error))
+        with self._lock:
+            self.failed += 1
+            if len(self.errors) < MAX_ERRORS :
+                self.errors.append("%s : %s" % (pk, error))
+
+    def finish(self):
+        self.finished = time.time()
+        return self
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    def as_dict(self):
+        elapsed = self.elapsed
+        return {
+            'model' : self.model,
+            'concurrency' : self.concurrency,
+            'published' : self.published,
+            'failed' : self.failed,
+            'skipped' : self.skipped,
+            'bytes_sent' : self.bytes_sent,
+            'statuses' : dict( (str(k),v) for (k,v) in self.statuses.items() ),
+            'errors' : self.errors,
+            'elapsed' : round(elapsed, 3),
+            'objects_per_sec' : round((self.published + self.failed + self.skipped) / elapsed, 2) if elapsed else None,
+        }
+
+
+class _Progress(object):
+    """
+        tracks which chunks of a sync are complete, to move its SyncCheckpoint on.
+
+        Sends are tagged with the chunk of their (first) object and report back from the worker threads -
+        the checkpoint itself is only saved from the calling thread.
+    """
+    def __init__(self, checkpoint, summary):
+        self.checkpoint = checkpoint
+        self.summary = summary
+        # counts from the run being resumed
+        self.base = (checkpoint.published, checkpoint.failed, checkpoint.skipped)
+        self._chunks = []
+        self._pending = {}
+        self._failed = set()
+        self._lock = threading.Lock()
+
+    def started(self, chunk):
+        with self._lock:
+            self._pending[chunk] = self._pending.get(chunk, 0) + 1
+
+    def done(self, chunk, ok=True):
+        with self._lock:
+            self._pending[chunk] -= 1
+            if not ok :
+                self._failed.add(chunk)
+
+    def failed(self, chunk):
+        with self._lock:
+            self._failed.add(chunk)
+
+    def read(self, chunk, last_pk):
+        """ every object of chunk (its index) has been skipped, failed or handed to the pool - last_pk is its last object """
+        self._chunks.append( (chunk, last_pk) )
+
+    def completed(self):
+        """ the last pk of the chunks read and completed without failures so far, in order - or None """
+        last_pk = None
+        with self._lock:
+            while self._chunks :
+                (chunk, pk) = self._chunks[0]
+                if self._pending.get(chunk) or chunk in self._failed :
+                    break
+                last_pk = pk
+                self._chunks.pop(0)
+        return last_pk
+
+    def save(self, last_pk=None, finished=False):
+        """ move the checkpoint on to last_pk (from completed()) """
+        if last_pk is not None :
+            self.checkpoint.last_pk = unicode(last_pk)
+        (published, failed, skipped) = self.base
+        self.checkpoint.published = published + self.summary.published
+        self.checkpoint.failed = failed + self.summary.failed
+        self.checkpoint.skipped = skipped + self.summary.skipped
+        if finished and not self._chunks :
+            self.checkpoint.finished_at = timezone.now()
+        self.checkpoint.save()
+
+
+def get_checkpoint(ct, binding, resume=False):
+    """
+        the SyncCheckpoint for a sync of ct through binding - if resume, as the last sync left it (unless that finished),
+        otherwise reset to start from the beginning
+    """
+    (checkpoint,created) = SyncCheckpoint.objects.get_or_create(content_type=ct, binding=binding)
+    if resume and not created and not checkpoint.finished_at :
+        return checkpoint
+    checkpoint.last_pk = ''
+    checkpoint.published = checkpoint.failed = checkpoint.skipped = 0
+    checkpoint.started_at = timezone.now()
+    checkpoint.finished_at = None
+    checkpoint.save()
+    return checkpoint
+
+
+def _send(push, pk, summary, ledger_record=None, progress=None, chunk=None):
+    ok = False
+    try:
+        result = push.send()
+    except Exception as e:
+        summary.record_failure(pk, e)
+    else:
+        summary.record_success(pk, push, result, ledger_record)
+        ok = True
+    finally:
+        if progress :
+            progress.done(chunk, ok)
+
+def _send_batch(batch, summary, progress=None, chunk=None):
+    ok = True
+    try:
+        for ((pk,push,ledger_record),(result,error)) in zip(batch, push_batch([ push for (pk,push,ledger_record) in batch ])) :
+            if error is None :
+                summary.record_success(pk, push, result, ledger_record)
+            else:
+                summary.record_failure(pk, error)
+                ok = False
+    except Exception:
+        ok = False
+        raise
+    finally:
+        if progress :
+            progress.done(chunk, ok)
+
+def check_modified_field(model_class, modified_field):
+    """ raise ValueError unless modified_field is a DateTimeField of model_class """
+    try:
+        field = model_class._meta.get_field(modified_field)
+    except FieldDoesNotExist:
+        raise ValueError("%s has no field %s" % (model_class.__name__, modified_field))
+    if not isinstance(field, models.DateTimeField) :
+        raise ValueError("modified_field %s of %s is not a DateTimeField" % (modified_field, model_class.__name__))
+
+def _unmodified(modified, published_at):
+    """ True if modified is no later than published_at - comparing naive and aware values in the current time zone """
+    if modified is None :
+        return False
+    if timezone.is_aware(modified) and timezone.is_naive(published_at) :
+        published_at = timezone.make_aware(published_at)
+    elif timezone.is_naive(modified) and timezone.is_aware(published_at) :
+        modified = timezone.make_aware(modified)
+    return modified <= published_at
+
+def sync_model(ct, model=None, concurrency=None, chunk_size=None, queryset=None, batch_size=None, incremental=False, modified_field=None, resume=False):
+    """
+        publish every mapped object of a content type to its persistence ServiceBinding - the first of the model's whose
+        object_filter it matches
+
+        concurrency overrides the binding's concurrency, queryset restricts the objects published.
+        batch_size objects are sent together where the store API allows it (see rdf_io.models.push_batch) -
+        RDF_IO_SYNC_BATCH_SIZE (default 100), 1 to send each object separately.
+        What is published is recorded in the publish ledger. If incremental is set (always for SPARQL bindings) objects whose
+        graph hash matches the ledger are skipped - and if modified_field names a DateTimeField of the model (ValueError if
+        not), objects not modified since they were last published are skipped without building their graph.
+        Progress is recorded in the SyncCheckpoint of the model and its first persistence binding - if resume is set and
+        the last sync didnt finish, only the objects after its checkpoint are published.
+        Returns a SyncSummary.
+    """
+    model = model or ct.model
+    oml = get_mapping_plan(ct)
+    bindings = [ ib.binding for ib in binding_index.for_model(model) if ib.binding.binding_type in PERSIST_BINDINGS ]
+    if not bindings :
+        raise RDFConfigNotFoundException("Cant locate appropriate repository configuration for %s" % model )
+    workers = concurrency or max( b.concurrency or 1 for b in bindings )
+    chunk_size = chunk_size or getattr(settings, 'RDF_IO_SYNC_CHUNK_SIZE', 500)
+    batch_size = batch_size or getattr(settings, 'RDF_IO_SYNC_BATCH_SIZE', 100)
+    if modified_field :
+        check_modified_field(ct.model_class(), modified_field)
+    if queryset is None :
+        queryset = ct.model_class().objects.all()
+
+    # import here to avoid a circular import - the views import this module
+    from rdf_io.views.serialize import build_graph
+
+    summary = SyncSummary(model, workers)
+    checkpoint = get_checkpoint(ct, bindings[0], resume)
+    if checkpoint.last_pk :
+        logger.info("resuming sync of %s after %s" % (model, checkpoint.last_pk))
+        queryset = queryset.filter(pk__gt=checkpoint.last_pk)
+    progress = _Progress(checkpoint, summary)
+    # the batch waiting to be sent for each binding, and the chunk that holds up the checkpoint for it
+    batches = {}
+    with BoundedPool(workers) as pool:
+        for (index,chunk) in enumerate(queryset_chunks(oml.prepare_queryset(oml.filter_queryset(queryset)), chunk_size)) :
+            pks = [ obj.pk for obj in chunk ]
+            # SPARQL bindings send the difference from the last published graph - so need the ledger whether incremental or not
+            published = dict( (b.pk, ledger.lookup(b, ct, pks, with_triples=_is_sparql(b)) if (incremental or _is_sparql(b)) else {})
+                for b in bindings )
+            unchanged = {}
+            for obj in chunk :
+                binding = binding_index.get(model, PERSIST_BINDINGS, obj)
+                if binding is None :
+                    # none of the model's bindings publish this object
+                    summary.record_skipped(obj.pk)
+                    continue
+                sparql = _is_sparql(binding)
+                last = published[binding.pk].get(str(obj.pk))
+                try:
+                    if last and incremental and modified_field and _unmodified(getattr(obj, modified_field), last.published_at) :
+                        summary.record_skipped(obj.pk)
+                        continue
+                    built = timezone.now()
+                    # a SPARQL diff needs the triples themselves, anything else is sent as N-Triples
+                    gr = build_graph(obj, oml, None if sparql else NTriplesSink())
+                    graph_hash = ledger.graph_hash(gr)
+                    if last and last.graph_hash == graph_hash :
+                        summary.record_skipped(obj.pk)
+                        if modified_field :
+                            # so the modification time check can skip it next time
+                            unchanged.setdefault(binding.pk, (binding, []))[1].append( (obj.pk, graph_hash, built, last.status, last.triples) )
+                        continue
+                    push = prepare_push(binding, model, obj, gr, previous=last.triples.splitlines() if (sparql and last) else None)
+                except Exception as e:
+                    summary.record_failure(obj.pk, e)
+                    progress.failed(index)
+                    continue
+                if batch_size <= 1 :
+                    progress.started(index)
+                    pool.submit(partial(_send, push, obj.pk, summary, (graph_hash, built), progress, index))
+                    continue
+                if binding.pk not in batches :
+                    # the batch holds up the checkpoint from the chunk of its first object
+                    batches[binding.pk] = (index, [])
+                    progress.started(index)
+                (batch_chunk, batch) = batches[binding.pk]
+                batch.append( (obj.pk, push, (graph_hash, built)) )
+                if len(batch) >= batch_size :
+                    pool.submit(partial(_send_batch, batch, summary, progress, batch_chunk))
+                    del batches[binding.pk]
+            progress.read(index, chunk[-1].pk)
+            # the ledger must hold everything the checkpoint moves past
+            completed = progress.completed()
+            _record_ledger(ct, summary, unchanged.values())
+            progress.save(completed)
+        for (batch_chunk, batch) in batches.values() :
+            pool.submit(partial(_send_batch, batch, summary, progress, batch_chunk))
+    completed = progress.completed()
+    _record_ledger(ct, summary)
+    progress.save(completed, finished=True)
+    return summary.finish()
+
+def _is_sparql(binding):
+    return binding.service_api == ServiceBinding.SPARQL
+
+def _record_ledger(ct, summary, unchanged=()):
+    """ record what has been published since the last call, and the (binding, records) of unchanged objects """
+    for (binding,records) in list(unchanged) + summary.take_published_by_binding() :
+        ledger.record(binding, ct, records)
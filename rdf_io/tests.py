@@ -0,0 +1,412 @@
+"""
+    Regression tests - the mappings are of rdf_io's own models so no other app is needed
+
+    run with the test runner of a project that has rdf_io installed:  python manage.py test rdf_io
+"""
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from rdf_io.bindings import binding_index
+from rdf_io import chains, outbox
+from rdf_io.sync import SyncSummary, sync_model, get_checkpoint, _Progress
+import rdf_io.views.serialize
+from rdf_io.metrics import metrics, count_queries
+from rdf_io.models import push_batch, Namespace, ObjectType, ObjectMapping, EmbeddedMapping, ServiceBinding, StorePush, PublishLedger, PublishOutbox, SyncCheckpoint, RDFConfigException, RDFStoreException, apply_pathfilter
+from rdf_io.plans import get_mapping_plan
+from rdf_io.views.serialize import build_graph
+
+from rdflib import BNode, URIRef
+
+from datetime import timedelta
+import os
+import sys
+
+# the in-process store the benchmarks publish to
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from fakestore import FakeStore
+
+
+class MappingTestCase(TestCase):
+    """ ObjectMappings mapped by an ObjectMapping - target has two ObjectTypes """
+    def setUp(self):
+        Namespace.objects.get_or_create(prefix='ex', defaults={ 'uri' : 'http://example.org/' })
+        Namespace.objects.get_or_create(prefix='rdfs', defaults={ 'uri' : 'http://www.w3.org/2000/01/rdf-schema#' })
+        self.ct = ContentType.objects.get_for_model(ObjectMapping)
+        self.mapping = ObjectMapping.objects.create(content_type=self.ct, name='mappings', auto_push=False,
+            id_attr='name', target_uri_expr='"http://example.org/mapping/"')
+        # of another model, so the only mapping of ObjectMappings is self.mapping
+        self.target = ObjectMapping.objects.create(content_type=ContentType.objects.get_for_model(ObjectType), name='target', auto_push=False,
+            id_attr='name', target_uri_expr='"http://example.org/mapping/"')
+        self.target.obj_type.add(ObjectType.objects.create(uri='http://x/a', label='A'),
+            ObjectType.objects.create(uri='http://x/b', label='B'))
+
+
+class EmbeddedMappingTests(MappingTestCase):
+
+    def test_shared_predicate_structs_not_merged(self):
+        """ two EmbeddedMappings with the same predicate each get their own blank node per value """
+        EmbeddedMapping.objects.create(scope=self.mapping, attr='obj_type', predicate='ex:type', struct='rdfs:label label', use_blank=True)
+        EmbeddedMapping.objects.create(scope=self.mapping, attr='obj_type', predicate='ex:type', struct='rdfs:comment uri', use_blank=True)
+        gr = build_graph(self.target, get_mapping_plan(self.ct))
+        nodes = list(gr.objects(URIRef('http://example.org/mapping/target'), URIRef('http://example.org/type')))
+        self.assertEqual(len(nodes), 4)
+        for node in nodes :
+            self.assertIsInstance(node, BNode)
+            self.assertEqual(len(list(gr.predicate_objects(node))), 1)
+
+
+class FilterQuerysetTests(MappingTestCase):
+
+    def assertMatchesPython(self, expr):
+        self.mapping.filter = expr
+        self.mapping.save()
+        plan = get_mapping_plan(self.ct)
+        selected = set(plan.filter_queryset(ObjectMapping.objects.all()).values_list('pk', flat=True))
+        accepted = set( om.pk for om in ObjectMapping.objects.all() if apply_pathfilter(om, expr) )
+        # the query may select more than python accepts, never less
+        self.assertTrue(accepted <= selected, "%s : %s not selected" % (expr, accepted - selected))
+        return (accepted, selected)
+
+    def test_clauses_on_different_related_objects(self):
+        """ each clause on a many to many path may be satisfied by a different related object """
+        (accepted, selected) = self.assertMatchesPython('obj_type.label=B AND obj_type.uri=http://x/a')
+        self.assertEqual(accepted, set([self.target.pk]))
+
+    def test_many_valued_clauses(self):
+        for expr in ('obj_type.label=A', 'obj_type.label=A,B AND name=target', 'obj_type.uri!=None', 'obj_type.label=C',
+                'name!=target AND obj_type.label=A') :
+            self.assertMatchesPython(expr)
+
+
+class CountQueriesTests(TestCase):
+
+    def assertCounts(self):
+        with count_queries() as outer :
+            with count_queries() as queries :
+                list(ObjectType.objects.all())
+                list(ObjectType.objects.all().iterator())
+            list(Namespace.objects.all())
+        self.assertEqual(queries[0], 2)
+        self.assertEqual(outer[0], 3)
+
+    def test_counts_without_debug(self):
+        self.assertCounts()
+
+    def test_mapping_queries_opt_in(self):
+        Namespace.objects.get_or_create(prefix='ex', defaults={ 'uri' : 'http://example.org/' })
+        ct = ContentType.objects.get_for_model(ObjectType)
+        ObjectMapping.objects.create(content_type=ct, name='types', auto_push=False, id_attr='label', target_uri_expr='"ex:type/"')
+        obj = ObjectType.objects.create(uri='http://x/a', label='A')
+        metrics.reset()
+        build_graph(obj, get_mapping_plan(ct))
+        self.assertEqual(metrics.snapshot()['mappings']['types']['queries'], None)
+        with override_settings(RDF_IO_METRICS_QUERIES=True):
+            build_graph(obj, get_mapping_plan(ct))
+        self.assertEqual(metrics.snapshot()['mappings']['types']['count'], 2)
+        self.assertTrue(metrics.snapshot()['mappings']['types']['queries'] is not None)
+
+    @override_settings(DEBUG=True)
+    def test_counts_once_query_log_is_full(self):
+        """ the debug query log only keeps the last 9000 queries """
+        connection.queries_log.extend( {} for i in range(connection.queries_log.maxlen) )
+        self.assertCounts()
+
+
+class ObjectFilterTests(MappingTestCase):
+
+    def binding(self, title, object_filter):
+        binding = ServiceBinding.objects.create(title=title, service_api=ServiceBinding.RDF4JREST, service_url='http://store/',
+            resource='/statements', object_filter=object_filter)
+        binding.object_mapping.add(self.mapping)
+        return binding
+
+    def test_invalid_filter_matches_nothing(self):
+        self.binding('drafts', 'name=mappings AND status')
+        fallback = self.binding('all', '')
+        binding_index.invalidate()
+        self.assertEqual(binding_index.get('objectmapping', (ServiceBinding.PERSIST_REPLACE,), self.mapping), fallback)
+
+    def test_clean_rejects_invalid_filter(self):
+        with self.assertRaises(ValidationError):
+            ServiceBinding(object_filter="{'name' : ").clean()
+        ServiceBinding(object_filter="{'name' : ['target']}").clean()
+
+
+class StoreTestCase(MappingTestCase):
+    """ publishes the ObjectMappings to a FakeStore """
+    def setUp(self):
+        super(StoreTestCase, self).setUp()
+        self.store = FakeStore(log=True).start()
+        self.addCleanup(self.store.stop)
+        self.addCleanup(binding_index.invalidate)
+
+    def binding(self, title, binding_type, service_api, resource, mapped=False, **kwargs):
+        binding = ServiceBinding.objects.create(title=title, binding_type=binding_type, service_api=service_api,
+            service_url=self.store.url, resource=resource, **kwargs)
+        if mapped :
+            binding.object_mapping.add(self.mapping)
+        binding_index.invalidate()
+        return binding
+
+
+class ChainTests(StoreTestCase):
+
+    def setUp(self):
+        super(ChainTests, self).setUp()
+        self.persist = self.binding('persist', ServiceBinding.PERSIST_UPDATE, ServiceBinding.LDP, '/ldp/{name}')
+        self.validate = self.binding('validate', ServiceBinding.VALIDATION, ServiceBinding.SHACLAPI, '/validate', mapped=True,
+            next_service=self.persist)
+        self.second = self.binding('second', ServiceBinding.PERSIST_UPDATE, ServiceBinding.LDP, '/second/{name}', mapped=True)
+
+    def publish(self):
+        return chains.publish_chain(self.target, 'objectmapping', build_graph(self.target, get_mapping_plan(self.ct)))
+
+    def test_validation_then_persist_and_second_root(self):
+        chain = chains.Chain('objectmapping')
+        self.assertEqual([ ib.binding for ib in chain.roots ], [self.validate, self.second])
+        self.assertTrue(chain.order.index(self.validate.pk) < chain.order.index(self.persist.pk))
+        summary = self.publish()
+        self.assertEqual(summary.failed, 0)
+        paths = self.store.paths()
+        self.assertEqual(self.store.paths('PUT'), sorted(['/ldp/target', '/second/target'], key=paths.index))
+        self.assertTrue(paths.index('/validate') < paths.index('/ldp/target'))
+
+    def test_loop_detected(self):
+        self.persist.next_service = self.validate
+        self.persist.save()
+        self.second.next_service = self.validate
+        self.second.save()
+        with self.assertRaises(RDFConfigException):
+            chains.Chain('objectmapping')
+
+    def test_failed_stage_reported(self):
+        self.store.fail = ('/validate',)
+        with self.assertRaises(RDFStoreException):
+            self.publish()
+        self.assertEqual(self.store.paths('PUT'), ['/second/target'])
+
+    def test_failed_stage_handed_to_on_fail_service(self):
+        self.validate.on_fail_service = self.binding('failed', ServiceBinding.PERSIST_UPDATE, ServiceBinding.LDP, '/failed/{name}')
+        self.validate.save()
+        self.store.fail = ('/validate',)
+        summary = self.publish()
+        self.assertEqual(summary.failed, 0)
+        self.assertEqual(sorted(self.store.paths('PUT')), ['/failed/target', '/second/target'])
+
+    def test_replace_purges_first(self):
+        self.persist.binding_type = ServiceBinding.PERSIST_REPLACE
+        self.persist.on_delete_service = self.binding('purge', ServiceBinding.PERSIST_PURGE, ServiceBinding.LDP, '/ldp/{name}')
+        self.persist.save()
+        self.publish()
+        ldp = [ (method, path) for (method, path, body) in self.store.log if path == '/ldp/target' ]
+        self.assertEqual(ldp[0], ('DELETE', '/ldp/target'))
+        self.assertEqual(ldp[-1], ('PUT', '/ldp/target'))
+
+    def test_sync_waits_for_every_stage(self):
+        """ a stage is only shut down once the stages handing on to it have finished """
+        self.store.latency = 0.02
+        summary = chains.sync_chains(self.ct, 'objectmapping', concurrency=1)
+        self.assertEqual(summary.failed, 0)
+        self.assertEqual(summary.objects, 2)
+        self.assertEqual(summary.stage(self.persist).published, 2)
+        self.assertEqual(sorted(self.store.paths('PUT')), ['/ldp/mappings', '/ldp/target', '/second/mappings', '/second/target'])
+
+
+class SyncCheckpointTests(StoreTestCase):
+
+    def setUp(self):
+        super(SyncCheckpointTests, self).setUp()
+        for i in range(10) :
+            ObjectMapping.objects.create(content_type=self.target.content_type, name='o%02d' % i, auto_push=False,
+                id_attr='name', target_uri_expr='"http://example.org/mapping/"')
+        self.persist = self.binding('persist', ServiceBinding.PERSIST_UPDATE, ServiceBinding.LDP, '/ldp/{name}', mapped=True)
+        self.pks = set( str(pk) for pk in ObjectMapping.objects.values_list('pk', flat=True) )
+
+    def published(self):
+        """ the objects published since the last call """
+        ids = set(PublishLedger.objects.values_list('object_id', flat=True))
+        PublishLedger.objects.all().delete()
+        return ids
+
+    def checkpoint(self):
+        return SyncCheckpoint.objects.get(content_type=self.ct, binding=self.persist)
+
+    def assertResumes(self, interrupted, batch_size):
+        """ resuming after interrupted publishes everything the checkpoint moved past and nothing before it """
+        interrupted()
+        checkpoint = self.checkpoint()
+        self.assertFalse(checkpoint.finished_at)
+        before = self.published()
+        self.store.fail = ()
+        summary = sync_model(self.ct, chunk_size=3, batch_size=batch_size, resume=True)
+        after = self.published()
+        self.assertEqual(summary.failed, 0)
+        self.assertTrue(self.checkpoint().finished_at)
+        self.assertEqual(before | after, self.pks)
+        if checkpoint.last_pk :
+            self.assertTrue(all( int(pk) > int(checkpoint.last_pk) for pk in after ))
+        return (checkpoint, after)
+
+    def test_resume_after_outage(self):
+        """ batches of 4 span the chunks of 3 - the chunks of a failed batch hold the checkpoint back """
+        failing = str(ObjectMapping.objects.get(name='o05').pk)
+        def outage():
+            self.store.fail = ('/ldp/o05',)
+            summary = sync_model(self.ct, chunk_size=3, batch_size=4)
+            self.assertEqual(summary.failed, 1)
+        (checkpoint, after) = self.assertResumes(outage, 4)
+        self.assertTrue(int(checkpoint.last_pk) < int(failing))
+        self.assertTrue(failing in after)
+
+    def test_resume_after_crash(self):
+        build_graph = rdf_io.views.serialize.build_graph
+        built = []
+        def crashing(obj, oml, sink=None):
+            built.append(obj.pk)
+            if len(built) == 8 :
+                raise KeyboardInterrupt()
+            return build_graph(obj, oml, sink)
+        def crash():
+            rdf_io.views.serialize.build_graph = crashing
+            try:
+                with self.assertRaises(KeyboardInterrupt):
+                    sync_model(self.ct, chunk_size=3, batch_size=1)
+            finally:
+                rdf_io.views.serialize.build_graph = build_graph
+        (checkpoint, after) = self.assertResumes(crash, 1)
+        self.assertTrue(checkpoint.last_pk)
+
+    def test_progress_waits_for_batches_spanning_chunks(self):
+        progress = _Progress(get_checkpoint(self.ct, self.persist), SyncSummary('objectmapping', 1))
+        progress.started(0)
+        progress.read(0, 3)
+        progress.read(1, 6)
+        self.assertEqual(progress.completed(), None)
+        progress.done(0)
+        self.assertEqual(progress.completed(), 6)
+        progress.started(2)
+        progress.read(2, 9)
+        progress.read(3, 12)
+        progress.done(2, ok=False)
+        self.assertEqual(progress.completed(), None)
+
+
+class OutboxTests(StoreTestCase):
+
+    def setUp(self):
+        super(OutboxTests, self).setUp()
+        self.binding('persist', ServiceBinding.PERSIST_UPDATE, ServiceBinding.LDP, '/ldp/{name}', mapped=True)
+
+    def test_saves_coalesced(self):
+        outbox.enqueue(self.target)
+        outbox.enqueue(self.target)
+        entry = PublishOutbox.objects.get()
+        self.assertEqual(entry.version, 2)
+        self.assertEqual(str(outbox.drain()), "published 1, failed 0, dropped 0")
+        self.assertEqual(self.store.paths('PUT'), ['/ldp/target'])
+        self.assertFalse(PublishOutbox.objects.exists())
+
+    def test_save_while_publishing_stays_queued(self):
+        push_batch = outbox.push_batch
+        def saved_meanwhile(pushes):
+            outbox.enqueue(self.target)
+            return push_batch(pushes)
+        outbox.enqueue(self.target)
+        outbox.push_batch = saved_meanwhile
+        try:
+            outbox.drain()
+        finally:
+            outbox.push_batch = push_batch
+        entry = PublishOutbox.objects.get()
+        self.assertEqual( (entry.version, entry.attempts), (2, 0) )
+        outbox.drain()
+        self.assertFalse(PublishOutbox.objects.exists())
+
+    def test_failure_backs_off(self):
+        self.assertEqual([ outbox.retry_delay(n) for n in (1, 2, 3, 20) ], [30, 60, 120, 3600])
+        self.store.fail = ('/ldp/',)
+        outbox.enqueue(self.target)
+        started = timezone.now()
+        self.assertEqual(outbox.drain().failed, 1)
+        entry = PublishOutbox.objects.get()
+        self.assertEqual(entry.attempts, 1)
+        self.assertTrue(entry.last_error)
+        self.assertTrue(entry.next_attempt >= started + timedelta(seconds=30))
+        # not due yet
+        self.assertEqual(str(outbox.drain()), "published 0, failed 0, dropped 0")
+
+
+class SparqlUpdateTests(StoreTestCase):
+
+    def setUp(self):
+        super(SparqlUpdateTests, self).setUp()
+        EmbeddedMapping.objects.create(scope=self.mapping, attr='obj_type', predicate='ex:type', struct='rdfs:label label', use_blank=True)
+        self.sparql = self.binding('sparql', ServiceBinding.PERSIST_REPLACE, ServiceBinding.SPARQL, '/update?graph=<http://example.org/g>')
+
+    def push(self, previous=None):
+        gr = build_graph(ObjectMapping.objects.get(pk=self.target.pk), get_mapping_plan(self.ct))
+        return StorePush(self.sparql, self.store.url + '/update?graph=<http://example.org/g>', gr, previous=previous)
+
+    def operations(self, update):
+        """ the triples of each operation in an update, by operation """
+        ops = {}
+        for op in update.split(" ;\n") :
+            ops.setdefault(op.split(" {")[0], []).extend( line for line in op.splitlines() if line.endswith(' .') )
+        return ops
+
+    def test_skolem_triples_stable(self):
+        triples = self.push().ledger_triples()
+        self.assertTrue('/.well-known/genid/' in triples)
+        self.assertEqual(self.push().ledger_triples(), triples)
+        self.assertEqual(self.push(triples.splitlines()).data, '')
+
+    def test_changed_literal(self):
+        first = self.push()
+        self.assertEqual(sorted(self.operations(first.data)), ['DELETE WHERE', 'INSERT DATA'])
+        ObjectType.objects.filter(label='B').update(label='Bee')
+        ops = self.operations(self.push(first.ledger_triples().splitlines()).data)
+        self.assertEqual(sorted(ops), ['DELETE DATA', 'INSERT DATA'])
+        self.assertEqual(len(ops['DELETE DATA']), 1)
+        self.assertEqual(len(ops['INSERT DATA']), 1)
+        self.assertTrue(ops['DELETE DATA'][0].endswith('"B" .'))
+        self.assertTrue(ops['INSERT DATA'][0].endswith('"Bee" .'))
+
+
+class Rdf4jBatchTests(StoreTestCase):
+
+    def test_transaction_clears_graphs_with_update_body(self):
+        binding = self.binding('rdf4j', ServiceBinding.PERSIST_REPLACE, ServiceBinding.RDF4JREST, '/repo/statements?context=<http://example.org/{name}>')
+        plan = get_mapping_plan(self.ct)
+        pushes = [ StorePush(binding, self.store.url + '/repo/statements?context=<http://example.org/%s>' % om.name, build_graph(om, plan))
+            for om in (self.mapping, self.target) ]
+        self.assertEqual([ error for (result, error) in push_batch(pushes) ], [None, None])
+        updates = [ body for (method, path, body) in self.store.log if 'action=UPDATE' in path ]
+        self.assertEqual(updates, ['CLEAR SILENT GRAPH <http://example.org/mappings>; CLEAR SILENT GRAPH <http://example.org/target>'])
+
+
+class ExportTests(MappingTestCase):
+
+    def export(self, strict):
+        build_rdf = rdf_io.views.serialize.build_rdf
+        def failing(gr, obj, oml, includemembers):
+            if obj.pk == self.mapping.pk :
+                raise ValueError('broken')
+            return build_rdf(gr, obj, oml, includemembers)
+        rdf_io.views.serialize.build_rdf = failing
+        try:
+            return list(rdf_io.views.serialize._export_lines([ (self.ct, get_mapping_plan(self.ct)) ], 'nt', None, 10, strict))
+        finally:
+            rdf_io.views.serialize.build_rdf = build_rdf
+
+    def test_failures_counted_in_trailer(self):
+        lines = self.export(False)
+        self.assertEqual(lines[0], "# could not serialise objectmapping %s\n" % self.mapping.pk)
+        self.assertEqual(lines[-1], "# export complete - 1 objects, 1 could not be serialised\n")
+
+    def test_strict_stops_at_first_failure(self):
+        lines = self.export(True)
+        self.assertEqual(lines, ["# export stopped - could not serialise objectmapping %s\n" % self.mapping.pk])
@@ -0,0 +1,118 @@
+"""
+    general purpose helpers with no dependency on the rdf_io models
+"""
+from collections import OrderedDict
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class LRUCache(object):
+    """
+        A small thread safe dict-like cache holding at most maxsize entries - the least recently used entry is evicted first
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            # re-insert to mark as most recently used
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize :
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+def queryset_chunks(queryset, chunk_size=500):
+    """
+        iterate over a queryset in lists of at most chunk_size objects, in primary key order
+
+        Uses keyset pagination (pk > last pk seen) rather than OFFSET, and evaluates each chunk separately
+        so any prefetch_related lookups on the queryset are applied per chunk and memory use stays bounded.
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True :
+        page = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(page[:chunk_size])
+        if not chunk :
+            return
+        yield chunk
+        if len(chunk) < chunk_size :
+            return
+        last_pk = chunk[-1].pk
+
+
+class BoundedPool(object):
+    """
+        Runs tasks on a fixed number of worker threads. submit blocks once max_pending tasks are waiting,
+        so a producer can never get more than a bounded amount of work ahead of the workers.
+
+        Each task is a callable - it should handle its own errors, anything it raises is passed to on_error if given.
+    """
+    def __init__(self, workers, max_pending=None, on_error=None, on_exit=None):
+        self.on_error = on_error
+        self.on_exit = on_exit
+        self._tasks = queue.Queue(maxsize=max_pending or workers * 2)
+        self._threads = [ threading.Thread(target=self._work) for i in range(max(1, workers)) ]
+        for t in self._threads :
+            t.daemon = True
+            t.start()
+
+    def _work(self):
+        try:
+            while True :
+                task = self._tasks.get()
+                if task is None :
+                    return
+                try:
+                    task()
+                except Exception as e:
+                    if self.on_error :
+                        self.on_error(e)
+        finally:
+            if self.on_exit :
+                self.on_exit()
+
+    def submit(self, task):
+        self._tasks.put(task)
+
+    def join(self):
+        """ wait for all submitted tasks to finish and stop the workers """
+        for t in self._threads :
+            self._tasks.put(None)
+        for t in self._threads :
+            t.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.join()
@@ -2,6 +2,10 @@
 from django.shortcuts import render_to_response, redirect
 from rdf_io.models import ObjectMapping,Namespace,AttributeMapping,EmbeddedMapping, ObjectType, getattr_path, apply_pathfilter, expand_curie, dequote
 from rdf_io.views import get_rdfstore,publish
+from rdf_io.plans import get_mapping_plan
+from rdf_io.sync import sync_model, check_modified_field
+from rdf_io import chains
+from rdf_io.metrics import metrics
 from django.template import RequestContext
 from django.contrib.contenttypes.models import ContentType
 from django.conf import settings
@@ -33,13 +37,57 @@ logger = logging.getLogger(__name__)
 def show_config(request) :
     return HttpResponse(json.dumps( settings.RDFSTORE ))
 
+def show_metrics(request) :
+    """
+        the instrumentation collected by this process (see rdf_io.metrics) as JSON - or with ?format=prometheus as Prometheus text.
+        ?reset=1 starts collecting again from zero after reporting
+    """
+    if request.GET.get('format') == 'prometheus' :
+        response = HttpResponse(metrics.prometheus(), content_type='text/plain; version=0.0.4')
+    else:
+        response = HttpResponse(json.dumps(metrics.snapshot()), content_type='application/json')
+    if request.GET.get('reset') :
+        metrics.reset()
+    return response
+
+def _positive_int(request, param):
+    """ the value of an integer request parameter of at least 1, or None if it isnt given - ValueError if it is invalid """
+    value = request.GET.get(param)
+    if not value :
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        value = 0
+    if value < 1 :
+        raise ValueError("%s must be a whole number of at least 1" % param)
+    return value
+
 def sync_remote(request,models):
     """
         Synchronises the RDF published output for the models, in the order listed (list containers before members!)
+        
+        ?concurrency=N overrides the number of concurrent requests configured in the ServiceBinding
+        ?batch_size=N sets how many objects are sent in each request where the store API allows it
+        ?incremental=1 skips objects whose RDF is unchanged since they were last published
+        ?modified_field=updated_at (with incremental) skips objects not modified since they were last published without serialising them
+        returns a JSON summary per model
     """
     if request.GET.get('pdb') :
         import pdb; pdb.set_trace()
+    try:
+        concurrency = _positive_int(request, 'concurrency')
+        batch_size = _positive_int(request, 'batch_size')
+    except ValueError as e:
+        return HttpResponse(str(e), status=400 )
+    incremental = request.GET.get('incremental') in ('1', 'true', 'True')
+    modified_field = request.GET.get('modified_field')
+ 
+    if chains.enabled() and (batch_size or incremental or modified_field) :
+        # chains publish every object through each of their stages
+        return HttpResponse("batch_size, incremental and modified_field are not supported with RDF_IO_SERVICE_CHAINS", status=400 )
  
+    cts = []
     for model in models.split(",") :
         try:
             (app,model) = model.split('.')
@@ -48,21 +96,36 @@ def sync_remote(request,models):
             ct = ContentType.objects.get(model=model)
         if not ct :
             raise Http404("No such model found")
+        if modified_field :
+            try:
+                check_modified_field(ct.model_class(), modified_field)
+            except ValueError as e:
+                return HttpResponse(str(e), status=400 )
+        cts.append( (model, ct) )
 
+    summaries = []
+    for (model, ct) in cts :
         try:
             rdfstore = get_rdfstore(model,name=request.GET.get('rdfstore') )
         except Exception as e:
             return  HttpResponse("RDF store not configured for model %s threw %s"  % (model,e) , status=410 )
 
-        do_sync_remote( model, ct , rdfstore )
-    return HttpResponse("sync successful for {}".format(models), status=200)
+        summary = do_sync_remote( model, ct , rdfstore, concurrency=concurrency, batch_size=batch_size, incremental=incremental, modified_field=modified_field )
+        summaries.append(summary.as_dict())
+    failed = any( summary['failed'] for summary in summaries )
+    return HttpResponse(json.dumps(summaries), content_type="application/json", status=500 if failed else 200)
     
-def do_sync_remote(formodel, ct ,rdfstore):
+def do_sync_remote(formodel, ct ,rdfstore, concurrency=None, batch_size=None, incremental=False, modified_field=None):
+    """
+        publish all objects of a model - returns a rdf_io.sync.SyncSummary, or with RDF_IO_SERVICE_CHAINS a rdf_io.chains.ChainSummary
+        (batch_size, incremental and modified_field dont apply to chains)
+    """
+    if chains.enabled() :
+        if batch_size or incremental or modified_field :
+            raise ValueError("batch_size, incremental and modified_field are not supported with RDF_IO_SERVICE_CHAINS")
+        return chains.sync_chains(ct, formodel, concurrency=concurrency)
+    return sync_model(ct, formodel, concurrency=concurrency, batch_size=batch_size, incremental=incremental, modified_field=modified_field)
 
-    oml = ObjectMapping.objects.filter(content_type=ct)
-    modelclass = ct.model_class()
-    for obj in modelclass.objects.all() :
-        publish( obj, formodel, oml, rdfstore)
 # gr.add((URIRef('skos:Concept'), RDF.type, URIRef('foaf:Person')))
 # gr.add((URIRef('rdf:Concept'), RDF.type, URIRef('xxx:Person')))
 
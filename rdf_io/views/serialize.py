@@ -1,6 +1,16 @@
 # # -*- coding:utf-8 -*-
 from django.shortcuts import render_to_response, redirect
 from rdf_io.models import ObjectMapping,Namespace,AttributeMapping,EmbeddedMapping, ObjectType,ServiceBinding, getattr_path, apply_pathfilter, expand_curie, dequote, push_to_store
+from rdf_io.sinks import NTriplesSink
+
+from rdf_io.plans import MappingPlan, get_mapping_plan
+from rdf_io.namespaces import registry
+from rdf_io.render_cache import get_rendered, store_rendered, Rendered
+from rdf_io.members import MemberPage, parse_cursor
+from rdf_io.utils import queryset_chunks
+from rdf_io.metrics import metrics, count_queries, enabled as metrics_enabled, queries_enabled
+from rdf_io import chains
+from rdf_io import materialize
 
 from django.template import RequestContext
 from django.contrib.contenttypes.models import ContentType
@@ -8,8 +18,10 @@ from django.conf import settings
 
 from rdflib import BNode
 # TODO make python 3 safe!
-import urllib as u
 import requests
+import hashlib
+import json
+import time
 
 from django.db.models import signals
 
@@ -19,7 +31,9 @@ from django.shortcuts import get_object_or_404
 # but not used anyway?
 # if needed.. from django.views.generic import ListView
 
-from django.http import HttpResponse,Http404
+from django.http import HttpResponse,Http404,StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 
 from rdflib import Graph,namespace
 from rdflib.term import URIRef, Literal
@@ -30,16 +44,11 @@ from rdflib.namespace import NamespaceManager,RDF
 import logging
 logger = logging.getLogger(__name__)
 
-_nslist = {}
-
-def _getNamespace( prefix ) :
-    if not _nslist.has_key( prefix ) :
-         ns = Namespace.objects.get(prefix = prefix)
-         if ns: 
-            _nslist[ prefix ] = ns.uri
-         else :
-            _nslist[ prefix ] = None
-    return _nslist[prefix]
+def _bind_namespaces(gr) :
+    """ bind all the registered namespace prefixes so serialisations can use them """
+    for (prefix,uri) in registry.prefixes().items() :
+        gr.namespace_manager.bind( str(prefix), namespace.Namespace(str(uri)), override=False)
+    return gr
   
 def _as_resource(gr,curie) :
     cleaned = dequote(curie)
@@ -50,10 +59,10 @@ def _as_resource(gr,curie) :
         (ns,value) = cleaned.split(":",2)
     except:
         raise ValueError("value not value HTTP or CURIE format %s" % curie)    
-    try :
-        return URIRef("".join((_getNamespace(ns),value)))
-    except:
-        raise ValueError("prefix " + ns + "not recognised")
+    nsuri = registry.expand(ns)
+    if nsuri is None :
+        raise ValueError("prefix " + ns + " not recognised")
+    return URIRef("".join((nsuri,value)))
  
  
 def to_rdfbykey(request,model,key):
@@ -77,6 +86,8 @@ def to_rdfbyid(request,model,id):
     except Exception as e: 
         return HttpResponse("Model not serialisable to RDF: %s" % e, status=500)
 
+RDF_CONTENT_TYPES = { 'turtle' : 'text/turtle', 'json-ld' : 'application/ld+json' }
+
 def _tordf(request,model,id,key):
     if request.GET.get('pdb') :
         import pdb; pdb.set_trace()
@@ -95,38 +106,98 @@ def _tordf(request,model,id,key):
         ct = ContentType.objects.get(model=model)
     if not ct :
         raise Http404("No such model found")
-    oml = ObjectMapping.objects.filter(content_type=ct)
+    oml = get_mapping_plan(ct)
     if not oml :
         return HttpResponse("Model not serialisable to RDF", status=410 )
+    # ?includemembers=1 adds a page of members (?page={cursor} for the others) - see rdf_io.members
+    includemembers = request.GET.get('includemembers') in ('1', 'true', 'True')
+    cursor = request.GET.get('page') if includemembers else None
+    if cursor :
+        try:
+            parse_cursor(cursor)
+        except ValueError as e:
+            return HttpResponse(str(e), status=400 )
+    # stored (or cached) output can be used without loading the object at all - member pages are always built
+    if includemembers :
+        lookup = lambda ct, pk, format : None
+    else:
+        lookup = materialize.get if materialize.enabled() else get_rendered
+    rendered = None
     if id :    
-        obj = get_object_or_404(ct.model_class(), pk=id)
+        rendered = lookup(ct, id, format)
+        if rendered is None :
+            obj = get_object_or_404(ct.model_class(), pk=id)
     else :
         try:
             obj = ct.model_class().objects.get_by_natural_key(key)
         except Exception as e:
+            # try the full URI for a CURIE, or the CURIE for a full URI
+            altkey = registry.expand_curie(key)
+            if altkey == key :
+                altkey = registry.compact(key)
+            if altkey == key :
+                raise e
             try:
-                (prefix,term) = key.split(':')
-                ns = Namespace.objects.get(prefix=prefix)
-                urikey = "".join((ns.uri,term))
-                obj = ct.model_class().objects.get_by_natural_key(urikey)
+                obj = ct.model_class().objects.get_by_natural_key(altkey)
             except Exception as e2:
                 raise e
+        rendered = lookup(ct, obj.pk, format)
     
-    # ok so object exists and is mappable, better get down to it..
- 
-    includemembers = False
+    if rendered is None and includemembers :
+        try:
+            page = MemberPage(obj, cursor).fetch()
+            links = ( _page_url(request, page.cursor), _page_url(request, None), _page_url(request, page.next) if page.next else None )
+            content = render_rdf(obj, oml, format, page, links)
+        except Exception as e:
+            raise Http404("Error during serialisation: " + str(e) )
+        rendered = Rendered(content, '"%s"' % hashlib.md5(content).hexdigest(), None)
+    elif rendered is None :
+        # ok so object exists and is mappable, better get down to it..
+        try:
+            content = render_rdf(obj, oml, format)
+        except Exception as e:
+            raise Http404("Error during serialisation: " + str(e) )
+        if materialize.enabled() :
+            rendered = materialize.store(ct, obj.pk, format, content)
+        else:
+            rendered = store_rendered(ct, obj.pk, format, content)
+        
+    response = HttpResponse(content_type=RDF_CONTENT_TYPES[format], content=rendered.content)
+    response['ETag'] = rendered.etag
+    if rendered.last_modified :
+        response['Last-Modified'] = http_date(rendered.last_modified)
+    return get_conditional_response(request, etag=rendered.etag, last_modified=rendered.last_modified, response=response)
+
+def _page_url(request, cursor):
+    """ the url of the member page starting at cursor (the first page if None) """
+    params = request.GET.copy()
+    params['includemembers'] = '1'
+    if cursor :
+        params['page'] = cursor
+    else:
+        params.pop('page', None)
+    return request.build_absolute_uri("%s?%s" % (request.path, params.urlencode()))
+
+def render_rdf(obj, oml, format, page=None, links=None):
+    """
+        the RDF for obj serialised in format (turtle or json-ld), with the registered namespaces bound -
+        and if page (a fetched rdf_io.members.MemberPage) is given its members, with links (this page, first, next urls)
+    """
+    includemembers = page is not None
     
     gr = Graph()
 #    import pdb; pdb.set_trace()
 #    ns_mgr = NamespaceManager(Graph())
 #    gr.namespace_manager = ns_mgr
-    try:
-        gr = build_rdf(gr, obj, oml, includemembers)
-    except Exception as e:
-        raise Http404("Error during serialisation: " + str(e) )
-    for ns in _nslist.keys() :
-        gr.namespace_manager.bind( str(ns), namespace.Namespace(str(_nslist[ns])), override=False)
-    return HttpResponse(content_type="text/turtle", content=gr.serialize(format=format))
+    gr = build_rdf(gr, obj, oml, False)
+    if includemembers :
+        page.add_to(gr, resource_uri(obj, oml), *links)
+    _bind_namespaces(gr)
+    started = time.time()
+    content = gr.serialize(format=format)
+    if metrics_enabled() :
+        metrics.serialized(format, time.time() - started, len(content))
+    return content
 
 def pub_rdf(request,model,id):
     """
@@ -142,7 +213,7 @@ def pub_rdf(request,model,id):
         ct = ContentType.objects.get(model=model)
     if not ct :
         raise Http404("No such model found")
-    oml = ObjectMapping.objects.filter(content_type=ct)
+    oml = get_mapping_plan(ct)
     if not oml :
         raise HttpResponse("Model not serialisable to RDF", status=410 )
     
@@ -158,8 +229,86 @@ def pub_rdf(request,model,id):
         result = publish(obj, model, oml,rdfstore)
     except Exception as e:
         return HttpResponse("Exception publishing remote RDF content %s" % e,status=500 )
+    if result is None :
+        return HttpResponse("Unchanged since last published")
+    if isinstance(result, chains.ChainSummary) :
+        return HttpResponse(json.dumps(result.as_dict()), content_type="application/json")
     return HttpResponse("Server reports %s" % result.content,status=result.status_code )
     
+EXPORT_FORMATS = { 'nt' : 'application/n-triples', 'nquads' : 'application/n-quads' }
+
+def export_rdf(request,models):
+    """
+        stream the RDF for every mapped instance of a list of models as N-Triples, or N-Quads with each resource in its own named graph
+        
+        ?_format=nt|nquads  (default nt) ?graph=uri puts all N-Quads in a single named graph
+        ?strict=1 ends the stream at the first object that cant be serialised, otherwise it is skipped -
+        either way a complete export ends with a "# export complete" comment giving the number of objects skipped
+    """
+    format = request.GET.get('_format') or 'nt'
+    if format not in EXPORT_FORMATS :
+        return HttpResponse("Unsupported export format %s - use one of %s" % (format, ",".join(EXPORT_FORMATS)), status=400 )
+    graph = request.GET.get('graph')
+    strict = request.GET.get('strict') in ('1', 'true', 'True')
+    
+    exports = []
+    for model in models.split(",") :
+        try:
+            try:
+                (app,model) = model.split('.')
+                ct = ContentType.objects.get(app_label=app,model=model)
+            except ValueError:
+                ct = ContentType.objects.get(model=model)
+        except ContentType.DoesNotExist:
+            raise Http404("No such model found %s" % model)
+        oml = get_mapping_plan(ct)
+        if not oml :
+            return HttpResponse("Model %s not serialisable to RDF" % model, status=410 )
+        exports.append( (ct,oml) )
+        
+    chunk_size = getattr(settings, 'RDF_IO_EXPORT_CHUNK_SIZE', 500)
+    response = StreamingHttpResponse(_export_lines(exports, format, graph, chunk_size, strict), content_type=EXPORT_FORMATS[format])
+    return response
+
+def _export_lines(exports, format, graph, chunk_size, strict=False):
+    """
+        generates the serialised RDF one object at a time, then a trailer comment with the counts - objects that cant be
+        serialised are skipped, or if strict the stream stops at the first without the trailer
+    """
+    # the sink serialises as triples are added, so there is no separate serialisation time to record
+    timed = metrics_enabled()
+    (exported, failed) = (0, 0)
+    for (ct,oml) in exports :
+        queryset = oml.prepare_queryset(oml.filter_queryset(ct.model_class().objects.all()))
+        for chunk in queryset_chunks(queryset, chunk_size) :
+            for obj in chunk :
+                try:
+                    if format == 'nquads' :
+                        sink = NTriplesSink(graph or resource_uri(obj, oml))
+                    else:
+                        sink = NTriplesSink()
+                    content = build_rdf(sink, obj, oml, False).getvalue()
+                    if timed :
+                        metrics.serialized(format, 0, len(content))
+                except Exception as e:
+                    logger.error("Could not serialise %s %s : %s" % (ct.model, obj.pk, e))
+                    if strict :
+                        yield "# export stopped - could not serialise %s %s\n" % (ct.model, obj.pk)
+                        return
+                    failed += 1
+                    yield "# could not serialise %s %s\n" % (ct.model, obj.pk)
+                    continue
+                exported += 1
+                yield content
+    yield "# export complete - %d objects, %d could not be serialised\n" % (exported, failed)
+
+def resource_uri(obj, oml):
+    """ the URI of the resource generated by the first ObjectMapping in a plan that applies to obj """
+    for om in oml :
+        if not om.filter or apply_pathfilter(obj, om.filter) :
+            return om.uri_for(obj)
+    return None
+    
 def get_rdfstore(model, name=None ):
     # now get the remote store mappings 
     
@@ -184,9 +333,16 @@ def get_rdfstore(model, name=None ):
     
     return rdfstore
     
-def publish(obj, model, oml, rdfstore ):
-      
-       
+def build_graph(obj, oml, sink=None):
+    """
+        a new graph holding the RDF for obj, with the registered namespaces bound -
+        or if sink is given (see rdf_io.sinks) the triples are added to that and it is returned instead
+    """
+    if sink is not None :
+        try:
+            return build_rdf(sink, obj, oml, False)
+        except Exception as e:
+            raise Exception("Error during serialisation: " + str(e) )
     gr = Graph()
 #    import pdb; pdb.set_trace()
 #    ns_mgr = NamespaceManager(Graph())
@@ -195,8 +351,14 @@ def publish(obj, model, oml, rdfstore ):
         gr = build_rdf(gr, obj, oml, False)
     except Exception as e:
         raise Exception("Error during serialisation: " + str(e) )
-    for ns in _nslist.keys() :
-        gr.namespace_manager.bind( str(ns), namespace.Namespace(str(_nslist[ns])), override=False)
+    return _bind_namespaces(gr)
+    
+def publish(obj, model, oml, rdfstore ):
+      
+    gr = build_graph(obj, oml)
+    if chains.enabled() :
+        # through every stage of the model's ServiceBinding chains - returns a ChainSummary
+        return chains.publish_chain(obj, model, gr)
     
 #    curl -X POST -H "Content-Type: text/turtle" -d @- http://192.168.56.151:8080/marmotta/import/upload?context=http://mapstory.org/def/featuretypes/gazetteer 
     
@@ -206,122 +368,100 @@ def publish(obj, model, oml, rdfstore ):
  
    
 def build_rdf( gr,obj, oml, includemembers ) :  
+    """
+        add the RDF for obj to graph gr 
+        
+        oml is either a compiled MappingPlan (see rdf_io.plans.get_mapping_plan) or a list of ObjectMappings
+    """
+    if not isinstance(oml, MappingPlan) :
+        oml = MappingPlan(oml)
 
     # would be nice to add some comments : as metadata on the graph? '# Turtle generated by django-rdf-io configurable serializer\n'  
+    timed = metrics_enabled()
+    counted = timed and queries_enabled()
     for om in oml :
         # check filter
-        objfilter = getattr(om,'filter') 
-        if objfilter and not apply_pathfilter(obj, objfilter ) :
+        if om.filter and not apply_pathfilter(obj, om.filter ) :
             continue
-        try:
-            tgt_id = getattr_path(obj,om.id_attr)[0]
-        except ValueError as e:
-            raise ValueError("target id attribute {} not found".format( (om.id_attr ,)))
-        if om.target_uri_expr[0] == '"' :   
-            uribase = om.target_uri_expr[1:-1]
-        else:
-            uribase = getattr_path(obj,om.target_uri_expr)[0]
-            
-        tgt_id = str(tgt_id).replace(uribase,"")
-        # strip uri base if present in tgt_id
-        uribase = expand_curie(uribase)
-        
- 
-        if not tgt_id:
-            uri = uribase
-        elif uribase[-1] == '/' or uribase[-1] == '#' :
-            uri = "".join((uribase,tgt_id))
-        else :
-            uri = "/".join((uribase,tgt_id))
-        
-        subject = URIRef(uri)
-        
-        for omt in om.obj_type.all() :
-            gr.add( (subject, RDF.type , _as_resource(gr,omt.uri)) )
+        if not timed :
+            _build_mapping(gr, obj, om)
+            continue
+        if not counted :
+            started = time.time()
+            _build_mapping(gr, obj, om)
+            metrics.mapping(om.name, time.time() - started)
+            continue
+        with count_queries() as queries :
+            started = time.time()
+            _build_mapping(gr, obj, om)
+        metrics.mapping(om.name, time.time() - started, queries[0])
+    # do this after looping through all object mappings!
+    return gr
+
+def _build_mapping(gr, obj, om):
+    """ add the RDF one ObjectMappingPlan generates for obj to gr """
+    uri = om.uri_for(obj)
+    subject = URIRef(uri)
+    
+    for omt in om.types :
+        gr.add( (subject, RDF.type , omt) )
   
-        # now get all the attribute mappings and add these in
-        for am in AttributeMapping.objects.filter(scope=om) :
-            _add_vals(gr, obj, subject, am.predicate, am.attr , am.is_resource)
-        for em in EmbeddedMapping.objects.filter(scope=om) :
+    # now get all the attribute mappings and add these in
+    for am in om.attributes :
+        _add_vals(gr, obj, subject, am.predicate, am.attr , am.is_resource)
+    for em in om.embedded :
+        try:
+            # three options - scalar value in which case attributes relative to basic obj, a mulitvalue obj or we have to look for related objects
             try:
-                # three options - scalar value in which case attributes relative to basic obj, a mulitvalue obj or we have to look for related objects
-                try:
-                    valuelist = getattr_path(obj,em.attr)
-                except:
-                    valuelist = [obj,] 
+                valuelist = getattr_path(obj,em.attr)
+            except:
+                valuelist = [obj,] 
 
-                for value in valuelist :
-                    newnode = None
+            for (index,value) in enumerate(valuelist) :
+                newnode = None
  
-                    for element in em.struct.split(";") :
-                        try:
-                            (predicate,expr) = element.split()
-                        except:
-                            predicate = None
-                            expr = element
-                            
-                        # resolve any internal template parameters {x}
-                        expr = expr.replace("{$URI}", uri )
+                for (predicate,element) in em.elements :
+                    if predicate :
+                        # an internal struct has been found so add a new node if not ye done
+                        if not newnode:
+                            newnode = _bnode(uri, em.key, index)
+                            gr.add( (subject, em.predicate , newnode) )
+                        node = newnode
+                    else:
+                        # add to parent
+                        (node, predicate) = (subject, em.predicate)
+                    if element.term is not None :
+                        # a constant - compiled once with the plan
+                        gr.add( (node, predicate, element.term) )
+                    else:
+                        _add_vals(gr, value, node, predicate, element.render(obj, value, uri), element.is_resource)
+        except Exception as e:
+            import traceback; import sys; traceback.print_exc()
+            print "Could not evaluate extended mapping %s : %s " % (e,em.attr), sys.exc_info()
+            raise ValueError("Could not evaluate extended mapping %s : %s " % (e,em.attr))
 
-                        is_resource = False
-                        if expr.startswith("<") :
-                            is_resource = True
-                            expr = expr[1:-1].join(('"','"'))
-                        elif expr.startswith("/") :
-                            #value relativeto root obj  - retrieve and use as literal
-                            try:
-                                expr = iter(getattr_path(obj,expr[1:])).next()
-                                if type(expr) == str :
-                                    expr = expr.join( ('"','"'))
-                            except:
-                                raise ValueError( "Could not access value of %s from mapped object %s (/ is relative to the object being mapped" % (expr,obj) )
-                        else:
-                            is_resource = False
-                        
-                        for (lit,var,x,y) in Formatter().parse(expr) :
-                            if var :
-                                try:
-                                    if var.startswith("^"):
-                                        val = iter(getattr_path(obj,var[1:])).next()
-                                    else:
-                                        val = iter(getattr_path(value,var)).next()
-                                    
-                                    if is_resource:
-                                        try:
-                                            val = u.urlencode({ 'v' : val.encode('utf-8')})[2:]
-                                        except:
-                                            #not a string, just pass
-                                            pass
-                                    val = str(val)
-                                except:
-                                    val="{!variable not found : %s}" % var
-                                expr = expr.replace(var.join(("{","}")), val )
-                        if predicate :
-                            # an internal struct has been found so add a new node if not ye done
-                            if not newnode:
-                                newnode = BNode()
-                                gr.add( (subject, _as_resource(gr,em.predicate) , newnode) )
-                            _add_vals(gr, value, newnode, predicate, expr , is_resource)
-                        else:
-                            # add to parent
-                            _add_vals(gr, value, subject, em.predicate, expr , is_resource)
-            except Exception as e:
-                import traceback; import sys; traceback.print_exc()
-                print "Could not evaluate extended mapping %s : %s " % (e,em.attr), sys.exc_info()
-                raise ValueError("Could not evaluate extended mapping %s : %s " % (e,em.attr))
-    # do this after looping through all object mappings!
-    return gr
+def _bnode(uri, key, index):
+    """
+        a blank node with an id derived from where it is used - the object, the EmbeddedMapping (key) and the value -
+        so the same object always serialises the same way
+    """
+    return BNode("b" + hashlib.md5("|".join((uri, key, str(index))).encode('utf-8')).hexdigest())
+
+def _literal_term(attr, is_resource):
+    """ the RDF term for a quoted literal (with optional @lang) - or if is_resource a quoted URI or CURIE """
+    if is_resource :
+        return _as_resource(None,attr)
+    try:
+        (str,lang) = attr.split('@')
+        return Literal(dequote(str),lang=lang)
+    except:
+        return Literal(dequote(attr))
 
 def _add_vals(gr, obj, subject, predicate, attr, is_resource ) :       
+            if not isinstance(predicate, URIRef) :
+                predicate = _as_resource(gr,predicate)
             if type(attr) == float or attr[0] in '\'\"' : # then a literal
-                if is_resource :
-                    gr.add( (subject, _as_resource(gr,predicate) , _as_resource(gr,attr) ) )
-                else:
-                    try:
-                        (str,lang) = attr.split('@')
-                        gr.add( (subject, _as_resource(gr,predicate) , Literal(dequote(str),lang=lang) ))
-                    except:
-                        gr.add( (subject, _as_resource(gr,predicate) , Literal(dequote(attr)) ))
+                gr.add( (subject, predicate , _literal_term(attr, is_resource) ) )
             else :
                 values = getattr_path(obj,attr)
                 for value in values :
@@ -342,4 +482,4 @@ def _add_vals(gr, obj, subject, predicate, attr, is_resource ) :
                                     object = Literal(value)
                         except:
                             raise ValueError("Value not a convertable type %s" % type(value))
-                    gr.add( (subject, _as_resource(gr,predicate) , object) )
+                    gr.add( (subject, predicate , object) )